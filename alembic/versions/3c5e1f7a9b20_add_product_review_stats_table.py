@@ -0,0 +1,53 @@
+"""Add product_review_stats table
+
+Revision ID: 3c5e1f7a9b20
+Revises: 749675d83296
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c5e1f7a9b20'
+down_revision: Union[str, None] = '749675d83296'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'product_review_stats',
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete="CASCADE"), primary_key=True),
+        sa.Column('num_reviews', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('rating_sum', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('avg_rating', sa.Numeric(), nullable=True),
+        sa.Column('rating_1', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('rating_2', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('rating_3', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('rating_4', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('rating_5', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')),
+    )
+    op.execute(
+        "CREATE INDEX ix_product_review_stats_top_rated ON product_review_stats "
+        "(coalesce(avg_rating, 0) DESC, coalesce(num_reviews, 0) DESC, product_id)"
+    )
+
+    # Backfill from the existing reviews, python -m server.db.review_stats_helper repairs it later on
+    op.execute(
+        "INSERT INTO product_review_stats "
+        "(product_id, num_reviews, rating_sum, avg_rating, rating_1, rating_2, rating_3, rating_4, rating_5) "
+        "SELECT product_id, count(id), coalesce(sum(rating), 0), avg(rating), "
+        "count(*) FILTER (WHERE rating = 1), count(*) FILTER (WHERE rating = 2), "
+        "count(*) FILTER (WHERE rating = 3), count(*) FILTER (WHERE rating = 4), "
+        "count(*) FILTER (WHERE rating = 5) "
+        "FROM reviews WHERE product_id IS NOT NULL GROUP BY product_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('product_review_stats')
@@ -0,0 +1,76 @@
+"""Add search_vector column in product table
+
+Revision ID: 5b7e9d1f3a64
+Revises: 8d2f4a6c1e37
+Create Date: 2026-10-18 11:41:07.583210
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e9d1f3a64'
+down_revision: Union[str, None] = '8d2f4a6c1e37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Product name weighs most, then the category name, then the description
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({product}.product_name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(
+        (SELECT category_name FROM product_categories WHERE id = {product}.category_id), ''
+    )), 'B') ||
+    setweight(to_tsvector('english', coalesce({product}.description, '')), 'C')
+"""
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    op.execute(f"""
+        CREATE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR.format(product='NEW')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER products_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF product_name, description, category_id ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """)
+
+    # Renaming a category touches the category_id of its products, which rebuilds their search_vector
+    op.execute("""
+        CREATE FUNCTION product_categories_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            UPDATE products SET category_id = category_id WHERE category_id = NEW.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER product_categories_search_vector_trigger
+        AFTER UPDATE OF category_name ON product_categories
+        FOR EACH ROW WHEN (OLD.category_name IS DISTINCT FROM NEW.category_name)
+        EXECUTE FUNCTION product_categories_search_vector_update()
+    """)
+
+    # Backfill the existing products before the index is built
+    op.execute(f"UPDATE products SET search_vector = {SEARCH_VECTOR.format(product='products')}")
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.execute("DROP TRIGGER product_categories_search_vector_trigger ON product_categories")
+    op.execute("DROP FUNCTION product_categories_search_vector_update()")
+    op.execute("DROP TRIGGER products_search_vector_trigger ON products")
+    op.execute("DROP FUNCTION products_search_vector_update()")
+    op.drop_column('products', 'search_vector')
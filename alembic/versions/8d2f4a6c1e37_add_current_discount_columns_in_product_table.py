@@ -0,0 +1,51 @@
+"""Add current discount columns in product table
+
+Revision ID: 8d2f4a6c1e37
+Revises: 3c5e1f7a9b20
+Create Date: 2026-10-18 11:04:52.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f4a6c1e37'
+down_revision: Union[str, None] = '3c5e1f7a9b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('current_discount_percent', sa.Float(), nullable=True))
+    op.add_column('products', sa.Column('effective_price', sa.Float(), nullable=True))
+
+    op.execute("CREATE INDEX ix_sales_product_latest ON sales (product_id, sale_date DESC, id DESC)")
+
+    # Backfill from the latest sale of every product
+    op.execute(
+        "UPDATE products SET "
+        "current_discount_percent = latest.discount_percent, "
+        "effective_price = products.price * (1 - coalesce(latest.discount_percent, 0) / 100) "
+        "FROM products AS p LEFT JOIN LATERAL ("
+        "SELECT discount_percent FROM sales WHERE sales.product_id = p.id "
+        "ORDER BY sale_date DESC, id DESC LIMIT 1"
+        ") AS latest ON true "
+        "WHERE products.id = p.id"
+    )
+
+    op.execute("CREATE INDEX ix_products_effective_price ON products (coalesce(effective_price, 0), id)")
+    op.execute(
+        "CREATE INDEX ix_products_on_sale ON products (coalesce(effective_price, 0), id) "
+        "WHERE current_discount_percent > 0"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_on_sale', table_name='products')
+    op.drop_index('ix_products_effective_price', table_name='products')
+    op.drop_index('ix_sales_product_latest', table_name='sales')
+    op.drop_column('products', 'effective_price')
+    op.drop_column('products', 'current_discount_percent')
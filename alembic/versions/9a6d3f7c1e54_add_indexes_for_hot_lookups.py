@@ -0,0 +1,87 @@
+"""Add indexes for the hot lookups
+
+Revision ID: 9a6d3f7c1e54
+Revises: f4b9d2e6a8c3
+Create Date: 2026-10-18 22:04:51.730126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a6d3f7c1e54'
+down_revision: Union[str, None] = 'f4b9d2e6a8c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (name, table, columns, options) of the indexes, built without blocking the writes to their table
+INDEXES = [
+    # Login and registration look the user up by email, an email belongs to one user
+    ('ix_users_email', 'users', ['email'], {'unique': True}),
+    ('ix_users_username', 'users', ['username'], {}),
+    # The reviews of a product, the rating is included so the review stats aggregate from the index alone
+    ('ix_reviews_product_id', 'reviews', ['product_id'], {'postgresql_include': ['rating']}),
+    ('ix_reviews_user_id', 'reviews', ['user_id'], {}),
+    # The cart, favorites and purchases of a user
+    ('ix_carts_user_id', 'carts', ['user_id'], {}),
+    ('ix_favorites_user_id', 'favorites', ['user_id'], {}),
+    ('ix_user_purchases_user_id', 'user_purchases', ['user_id'], {}),
+    ('ix_user_purchases_product_id', 'user_purchases', ['product_id'], {}),
+    # The child categories of a category
+    ('ix_product_categories_parent_category_id', 'product_categories', ['parent_category_id'], {}),
+    # The category listings in id order, replaces ix_products_category_id
+    ('ix_products_category_listing', 'products', ['category_id', 'id'], {}),
+    # The newest products and the listings sorted by newest
+    ('ix_products_newest', 'products', [sa.text('created_at DESC'), sa.text('id DESC')], {}),
+    # The price range filters and the listings sorted by price (both directions break ties by ascending id)
+    ('ix_products_price', 'products', ['price'], {}),
+    ('ix_products_price_asc', 'products', [sa.text('coalesce(price, 0)'), 'id'], {}),
+    ('ix_products_price_desc', 'products', [sa.text('coalesce(price, 0) DESC'), 'id'], {}),
+    # The products with the latest discounts
+    (
+        'ix_sales_latest_discount', 'sales', [sa.text('sale_date DESC')],
+        {'postgresql_include': ['product_id'], 'postgresql_where': sa.text('discount_percent IS NOT NULL')},
+    ),
+]
+
+
+def _index_state(name: str):
+    """None when the index does not exist, else whether it is valid (a failed concurrent build leaves an invalid one)."""
+    return op.get_bind().execute(
+        sa.text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"),
+        {"name": name},
+    ).scalar()
+
+
+def upgrade() -> None:
+    duplicates = op.get_bind().execute(
+        sa.text("SELECT email, count(*) FROM users WHERE email IS NOT NULL GROUP BY email HAVING count(*) > 1")
+    ).fetchall()
+    if duplicates:
+        raise RuntimeError(
+            "users.email can not be made unique, merge or delete the duplicated users first: "
+            + ", ".join(f"{email} ({count} users)" for email, count in duplicates)
+        )
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            state = _index_state(name)
+            if state:
+                continue
+            if state is False:
+                # Left by an interrupted run of this migration
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+            op.create_index(name, table, columns, postgresql_concurrently=True, **options)
+        op.drop_index('ix_products_category_id', table_name='products', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_category_id', 'products', ['category_id'], postgresql_concurrently=True, if_not_exists=True)
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,38 @@
+"""Add trigram indexes for fuzzy search
+
+Revision ID: a41c7e2d9f58
+Revises: 5b7e9d1f3a64
+Create Date: 2026-10-18 13:26:44.910372
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c7e2d9f58'
+down_revision: Union[str, None] = '5b7e9d1f3a64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        'ix_products_product_name_trgm', 'products', ['product_name'],
+        postgresql_using='gin', postgresql_ops={'product_name': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        'ix_product_categories_category_name_trgm', 'product_categories', ['category_name'],
+        postgresql_using='gin', postgresql_ops={'category_name': 'gin_trgm_ops'},
+    )
+    # Products of the categories matched by a fuzzy search are looked up by category
+    op.create_index('ix_products_category_id', 'products', ['category_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_category_id', table_name='products')
+    op.drop_index('ix_product_categories_category_name_trgm', table_name='product_categories')
+    op.drop_index('ix_products_product_name_trgm', table_name='products')
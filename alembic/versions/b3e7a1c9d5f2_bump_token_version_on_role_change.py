@@ -0,0 +1,42 @@
+"""Bump token_version on role change
+
+Revision ID: b3e7a1c9d5f2
+Revises: 9a6d3f7c1e54
+Create Date: 2026-10-18 14:05:12.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e7a1c9d5f2'
+down_revision: Union[str, None] = '9a6d3f7c1e54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The tokens carry the role they were issued with, a new role revokes them
+    # however the role is written (an endpoint, a script or by hand)
+    op.execute("""
+        CREATE FUNCTION users_role_token_version_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.token_version := OLD.token_version + 1;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER users_role_token_version_trigger
+        BEFORE UPDATE OF role ON users
+        FOR EACH ROW WHEN (OLD.role IS DISTINCT FROM NEW.role)
+        EXECUTE FUNCTION users_role_token_version_update()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER users_role_token_version_trigger ON users")
+    op.execute("DROP FUNCTION users_role_token_version_update()")
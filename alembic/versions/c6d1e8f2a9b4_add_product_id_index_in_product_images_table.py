@@ -0,0 +1,27 @@
+"""Add product_id index in product_images table
+
+Revision ID: c6d1e8f2a9b4
+Revises: a41c7e2d9f58
+Create Date: 2026-10-18 16:02:37.418265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6d1e8f2a9b4'
+down_revision: Union[str, None] = 'a41c7e2d9f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The images of a listing page are aggregated per product, in image id order
+    op.create_index('ix_product_images_product_id', 'product_images', ['product_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_images_product_id', table_name='product_images')
@@ -0,0 +1,27 @@
+"""Add token_version column in users table
+
+Revision ID: d7e2f9a3b5c1
+Revises: c6d1e8f2a9b4
+Create Date: 2026-10-18 19:12:05.208417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e2f9a3b5c1'
+down_revision: Union[str, None] = 'c6d1e8f2a9b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Tokens issued before this column carry no version and stay valid until it is bumped
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,36 @@
+"""Add expires_at column in tokens table
+
+Revision ID: e3a8c5d1f7b2
+Revises: d7e2f9a3b5c1
+Create Date: 2026-10-18 20:41:37.512094
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a8c5d1f7b2'
+down_revision: Union[str, None] = 'd7e2f9a3b5c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tokens', sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    # The blacklisted tokens were issued before their row was created, they expire at the latest
+    # ACCESS_TOKEN_EXPIRE_MINUTES after it
+    op.execute(
+        sa.text("UPDATE tokens SET expires_at = created_at + make_interval(mins => :minutes)")
+        .bindparams(minutes=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440)))
+    )
+    op.alter_column('tokens', 'expires_at', nullable=False)
+    op.create_index('ix_tokens_expires_at', 'tokens', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tokens_expires_at', table_name='tokens')
+    op.drop_column('tokens', 'expires_at')
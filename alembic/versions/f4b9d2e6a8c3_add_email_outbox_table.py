@@ -0,0 +1,41 @@
+"""Add email_outbox table
+
+Revision ID: f4b9d2e6a8c3
+Revises: e3a8c5d1f7b2
+Create Date: 2026-10-18 21:26:08.930417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b9d2e6a8c3'
+down_revision: Union[str, None] = 'e3a8c5d1f7b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('recipient', sa.String(), nullable=False),
+        sa.Column('subject', sa.String(), nullable=False),
+        sa.Column('body', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default=sa.text("'pending'")),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('next_attempt_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')),
+    )
+    op.create_index(
+        'ix_email_outbox_pending', 'email_outbox', ['next_attempt_at'], postgresql_where=sa.text("status = 'pending'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_outbox_pending', table_name='email_outbox')
+    op.drop_table('email_outbox')
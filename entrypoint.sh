@@ -1 +1,4 @@
+set -e
+# Create or upgrade the database schema before serving
+python -m alembic upgrade head
 python -m uvicorn server.backend:app --reload --host 0.0.0.0 --port 8080
\ No newline at end of file
@@ -1,6 +1,9 @@
-from fastapi import FastAPI, Request
-from server.utils.rate_limit import rate_limited
+from fastapi import FastAPI, Request, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from server.utils.rate_limit import rate_limited, add_rate_limit_headers
 from fastapi.middleware.cors import CORSMiddleware
+from server.schemas import token_schemas
+from server.utils import oauth2, search_engine, suggest_index, catalog_snapshot, response_cache, hash_helper, token_blacklist, email_outbox
 from server.routers import (
     sales_router,
     user_router, 
@@ -19,7 +22,7 @@ from server.routers import (
     banners_router,
 )
 
-app = FastAPI(title="Shopping center App Backend")
+app = FastAPI(title="Shopping center App Backend", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +31,65 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+app.middleware("http")(add_rate_limit_headers)
+
+
+@app.on_event("startup")
+def build_search_index():
+    """Fill the in-memory search index of this worker when product searches are answered from it."""
+    if search_engine.SEARCH_BACKEND == "memory":
+        search_engine.build_search_index()
+
+
+@app.on_event("startup")
+def build_suggest_index():
+    """Fill the autocomplete index of this worker."""
+    if suggest_index.AUTOCOMPLETE_ENABLED:
+        suggest_index.build_suggest_index()
+
+
+@app.on_event("startup")
+async def start_catalog_snapshot():
+    """Build the catalog snapshot of this worker in the background and refresh it periodically."""
+    if catalog_snapshot.CATALOG_SNAPSHOT_ENABLED:
+        catalog_snapshot.start_refresh()
+
+
+@app.on_event("shutdown")
+def stop_catalog_snapshot():
+    """Stop refreshing the catalog snapshot."""
+    catalog_snapshot.stop_refresh()
+
+
+@app.on_event("shutdown")
+def stop_password_hashing():
+    """Stop the password process pool."""
+    hash_helper.shutdown()
+
+
+@app.on_event("startup")
+async def start_token_blacklist_maintenance():
+    """Build the Bloom filter of the token blacklist in the background and prune its expired tokens periodically."""
+    token_blacklist.start_maintenance()
+
+
+@app.on_event("shutdown")
+def stop_token_blacklist_maintenance():
+    """Stop pruning the token blacklist."""
+    token_blacklist.stop_maintenance()
+
+
+@app.on_event("startup")
+async def start_email_sender():
+    """Send the emails of the outbox in the background."""
+    if email_outbox.EMAIL_OUTBOX_ENABLED:
+        email_outbox.start_sender()
+
+
+@app.on_event("shutdown")
+def stop_email_sender():
+    """Stop sending the emails of the outbox."""
+    email_outbox.stop_sender()
 
 
 # router for admin auth routes
@@ -63,6 +125,19 @@ async def health_check(request:Request):
 
     return {"message": "Hello I am working!"}
 
+@app.get("/cache/stats")
+@rate_limited(max_calls=10, time_frame=60)
+async def cache_stats(request: Request, current_user: token_schemas.Principal = Depends(oauth2.get_current_principal)):
+    """Counters of the response cache of this worker and of its shared second level, for admins."""
+    # Check if the current user has admin role
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action.",
+        )
+
+    return response_cache.response_cache.stats()
+
 @app.get("/")
 @rate_limited(max_calls=10, time_frame=60)
 async def intro(request: Request):
@@ -2,6 +2,7 @@ from fastapi import status,HTTPException, Response
 from server.schemas import banners_schemas
 from sqlalchemy.exc import SQLAlchemyError
 from server.models.models import Banner, Product
+from server.utils.response_cache import invalidate, BANNERS
 
 def helper_create_banner(session, banner: banners_schemas.CreateBanner):
     """
@@ -23,6 +24,7 @@ def helper_create_banner(session, banner: banners_schemas.CreateBanner):
 
         session.add(new_banner)
         session.commit()
+        invalidate(BANNERS)
         session.refresh(new_banner)
         return new_banner
     except SQLAlchemyError as e:
@@ -33,10 +35,6 @@ def helper_create_banner(session, banner: banners_schemas.CreateBanner):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
-
 
 def helper_delete_banner(session, banner_id: int):
     """
@@ -62,6 +60,7 @@ def helper_delete_banner(session, banner_id: int):
     try:
         session.delete(banner)
         session.commit()
+        invalidate(BANNERS)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     except SQLAlchemyError as e:
         session.rollback()
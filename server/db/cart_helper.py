@@ -1,5 +1,5 @@
 from fastapi import status,HTTPException, Response
-from server.models.models import Cart, Product, ProductImage
+from server.models.models import Cart, Product
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import cart_schemas
 from sqlalchemy.orm import joinedload
@@ -38,10 +38,7 @@ def create_product_cart(session, product_cart: cart_schemas.ProductCartCreate):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
-    
+
     # Return the newly created product cart
     return new_product_cart
 
@@ -81,10 +78,7 @@ def update_product_cart(session, id: int, product_cart_update: cart_schemas.Prod
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
-        
+
     return product_cart_query.first()
 
 
@@ -118,10 +112,6 @@ def delete_product_cart(session, id:int):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -141,11 +131,10 @@ def get_all_product_for_cart(session, UserId:int):
         - SQLAlchemyError: If an error occurs while querying the database.
     """
     try:
-        # Query the carts, join with the Product and ProductImage tables
+        # Query the carts, join with the Product table (its images are loaded by the joinedload)
         carts = (
             session.query(Cart)
             .join(Product, Cart.product_id == Product.id)
-            .outerjoin(ProductImage, ProductImage.product_id == Product.id)
             .filter(Cart.user_id == UserId)
             .options(
                 joinedload(Cart.product)  # Use joinedload to eagerly load the associated Product
@@ -164,10 +153,6 @@ def get_all_product_for_cart(session, UserId:int):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return carts
 
 
@@ -200,8 +185,4 @@ def delete_all_product_cart(session, id:int):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -7,24 +9,80 @@ load_dotenv()
 
 
 DB_URL: str = os.getenv("DB")
+# Url used by the asyncio engine of the read endpoints, defaults to DB with the asyncpg driver
+ASYNC_DB_URL: str = os.getenv("ASYNC_DB") or str(make_url(DB_URL).set(drivername="postgresql+asyncpg"))
+
+# Connection pool settings, every request checks out its own connection from this pool
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Queries running longer than this (in milliseconds) are cancelled by postgres
+DB_STATEMENT_TIMEOUT: int = int(os.getenv("DB_STATEMENT_TIMEOUT", 30000))
+# Number of compiled statements every engine keeps, the listing queries are compiled once per shape
+DB_QUERY_CACHE_SIZE: int = int(os.getenv("DB_QUERY_CACHE_SIZE", 1000))
+# Lowest word similarity (0..1) a fuzzy product search accepts, set as pg_trgm.word_similarity_threshold
+FUZZY_SEARCH_THRESHOLD: float = float(os.getenv("FUZZY_SEARCH_THRESHOLD", 0.4))
 
 print(f"\n\nDB_URL = {DB_URL}\n\n")
-engine = create_engine(DB_URL)
+
+engine_options = {
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "query_cache_size": DB_QUERY_CACHE_SIZE,
+}
+if DB_URL.startswith("postgres"):
+    engine_options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT} "
+                       f"-c pg_trgm.word_similarity_threshold={FUZZY_SEARCH_THRESHOLD}"
+        },
+    )
+
+engine = create_engine(DB_URL, **engine_options)
 
 SessionLocal = sessionmaker(
-    
+
     bind=engine
 )
 
-Base = declarative_base()
+# The read endpoints of the catalog use the asyncio engine over asyncpg, so one worker
+# can have many queries in flight without blocking the event loop
+async_engine_options = {
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "query_cache_size": DB_QUERY_CACHE_SIZE,
+    "connect_args": {
+        "server_settings": {
+            "statement_timeout": str(DB_STATEMENT_TIMEOUT),
+            "pg_trgm.word_similarity_threshold": str(FUZZY_SEARCH_THRESHOLD),
+        }
+    },
+}
+
+async_engine = create_async_engine(ASYNC_DB_URL, **async_engine_options)
+
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
 
-db = SessionLocal()
+Base = declarative_base()
 
 
 def get_db():
     """
     Generator function that returns a SQLAlchemy session object.
     This function is used as a context manager to ensure the session is properly closed.
+    Every request gets its own session (and pooled connection) through Depends(get_db).
     Yields:
         Session: A SQLAlchemy session object.
     """
@@ -32,4 +90,109 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """
+    Async generator function that returns a SQLAlchemy AsyncSession object.
+    The session runs on the asyncpg engine and is closed once the request is done.
+    Yields:
+        AsyncSession: A SQLAlchemy AsyncSession object.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+if __name__ == "__main__":
+    # Requests/sec and latency of the catalog endpoints on the asyncio engine against the sync path they
+    # replaced (an async def endpoint blocking the event loop on a SQLAlchemy Session), in one worker:
+    # python -m server.db.db [requests] [concurrent clients]
+    import asyncio
+    import statistics
+    import sys
+    import time
+    import httpx
+    from sqlalchemy import select
+    from server.backend import app
+    from server.models.models import Product
+    from server.utils import rate_limit, response_cache
+    # The engines and the dependency the app uses, this module runs as __main__
+    from server.db import db
+
+    # The queries are measured, not the rate limit or the response cache
+    rate_limit.check_rate_limit = lambda *args: {}
+    response_cache.RESPONSE_CACHE_ENABLED = False
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    class BlockingSession:
+        """A Session awaited like an AsyncSession, every query blocks the event loop as before."""
+
+        def __init__(self, session):
+            self.session = session
+
+        async def execute(self, *args, **kwargs):
+            return self.session.execute(*args, **kwargs)
+
+        async def commit(self):
+            self.session.commit()
+
+        async def rollback(self):
+            self.session.rollback()
+
+    async def get_blocking_db():
+        session = db.SessionLocal()
+        try:
+            yield BlockingSession(session)
+        finally:
+            session.close()
+
+    with db.SessionLocal() as session:
+        product_id, category_id = session.execute(
+            select(Product.id, Product.category_id).filter(Product.category_id.isnot(None)).limit(1)
+        ).one()
+    paths = [
+        "/productfilter/getproducts/20/0",
+        f"/productfilter/getbycategory/{category_id}/20/0",
+        f"/product/{product_id}",
+        "/productfilter/newarrivals/20",
+        "/landingpage/gettopratedproducts/20",
+    ]
+
+    async def run(label: str):
+        latencies = []
+        queue = [paths[index % len(paths)] for index in range(requests)]
+
+        async def client_loop(client):
+            while queue:
+                path = queue.pop()
+                request_started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                assert response.status_code == 200, f"{path}: {response.status_code} {response.text[:200]}"
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+            # Opens the connections of the pools and compiles the queries
+            for path in paths:
+                await client.get(path)
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(
+            f"{label:<6} {requests / elapsed:8.1f} req/s   p50 {statistics.median(latencies):8.1f} ms   "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1]:8.1f} ms"
+        )
+
+    async def main():
+        print(f"{requests} requests, {concurrency} concurrent clients, one worker")
+        app.dependency_overrides[db.get_async_db] = get_blocking_db
+        await run("sync")
+        app.dependency_overrides.clear()
+        await run("async")
+        await db.async_engine.dispose()
+
+    asyncio.run(main())
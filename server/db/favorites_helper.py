@@ -1,7 +1,7 @@
 from fastapi import status,HTTPException, Response
 from server.schemas import favorites_schemas
 from server.models.models import Favorite as Favorites
-from server.models.models import Product, ProductImage
+from server.models.models import Product
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 
@@ -38,10 +38,7 @@ def helper_create_product_favorite(session, product_favorite: favorites_schemas.
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
-        
+
     # Return the newly created product favorite
     return new_product_favorite
 
@@ -78,10 +75,6 @@ def helper_delete_product_favorite(session, id: int):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -96,10 +89,9 @@ def helper_get_all_product_favorite(session, UserId):
     - A list of product favorites.
     """
     try:
-        fav = (
+        data = (
             session.query(Favorites)
             .join(Product, Favorites.product_id == Product.id)
-            .outerjoin(ProductImage, ProductImage.product_id == Product.id)
             .filter(Favorites.user_id == UserId)
             .options(
                 joinedload(Favorites.product)  # Use joinedload to eagerly load the associated Product
@@ -107,7 +99,6 @@ def helper_get_all_product_favorite(session, UserId):
             )
             .all()
         )
-        data = session.query(Favorites).filter(Favorites.user_id == UserId).all()
         if data is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Product with id {UserId} does not exist")
@@ -116,9 +107,6 @@ def helper_get_all_product_favorite(session, UserId):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
     return data
     
 
@@ -149,8 +137,4 @@ def helper_delete_all_product_favorite(session, UserId):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -2,6 +2,7 @@ from server.schemas import featured_products_schemas
 from sqlalchemy.exc import SQLAlchemyError
 from server.models.models import FeaturedProduct
 from fastapi import status,HTTPException, Response
+from server.utils.response_cache import invalidate, FEATURED
 
 
 def helper_create_featured_product(session, featured_product: featured_products_schemas.FeaturedProductCreate):
@@ -24,6 +25,7 @@ def helper_create_featured_product(session, featured_product: featured_products_
 
         # Commit the changes to the database
         session.commit()
+        invalidate(FEATURED)
 
         # Refresh the new_featured_product with the latest data from the database
         session.refresh(new_featured_product)
@@ -38,9 +40,6 @@ def helper_create_featured_product(session, featured_product: featured_products_
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
 
     # Return the newly created featured product
     return new_featured_product
@@ -73,14 +72,11 @@ def helper_delete_featured_product(session, featured_product_id:int):
         # Delete the product
         featured_product_query.delete(synchronize_session=False)
         session.commit()
+        invalidate(FEATURED)
     
     except SQLAlchemyError as e:
         # Handle any SQLAlchemy errors
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
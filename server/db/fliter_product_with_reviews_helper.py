@@ -1,59 +1,598 @@
-from server.models.models import Product, ProductImage, Review, Sales, FeaturedProduct, ProductCategory
-from sqlalchemy import func, select
-from sqlalchemy import or_, and_
+from server.models.models import Product, ProductImage, ProductReviewStats, Sales, FeaturedProduct, ProductCategory
+from sqlalchemy import func, select, tuple_, literal, literal_column, Numeric, Float, String, exists, union_all, case
+from sqlalchemy import or_, and_, true
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import aggregate_order_by as _aggregate_order_by
+from sqlalchemy.sql.visitors import InternalTraversal
+from datetime import datetime
+import re
 from fastapi import HTTPException
 from sqlalchemy.exc import SQLAlchemyError
+from server.utils.pagination import clamp_page_size
 
 
-def get_products_with_images_and_reviews(search_keyword, startindex, number):
+class aggregate_order_by(_aggregate_order_by):
     """
-    Get products with images and reviews.
-    Args:
-        search_keyword (str): The keyword to search for in product name, description, or category name.
-        startindex (int): The starting index to retrieve the products.
-        number (int): The number of products to retrieve.
+    aggregate_order_by (ORDER BY inside an aggregate) that can be cached.
+    The one of SQLAlchemy 1.4.23 has no cache key, so every statement using it was compiled again on each execution.
+    """
+    _traverse_internals = [
+        ("target", InternalTraversal.dp_clauseelement),
+        ("type", InternalTraversal.dp_type),
+        ("order_by", InternalTraversal.dp_clauseelement),
+    ]
+
+
+def review_stats_table():
+    """
+    Number of reviews and average rating of every product.
+    The statistics are maintained on write in product_review_stats (see review_stats_helper),
+    so the listings read them with a primary key join instead of aggregating the reviews.
     Returns:
-        Query: The SQLAlchemy query object.
+        Table: One row per reviewed product (product_id, num_reviews, avg_rating, ...).
+    """
+    return ProductReviewStats.__table__
+
+
+def first_image_subquery():
+    """
+    The first image (lowest id) of every product.
+    Returns:
+        Subquery: One row per product with images (product_id, image_id).
     """
-    # Create the main query
-    subquery = (
+    return (
         select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
+            ProductImage.product_id,
+            func.min(ProductImage.id).label("image_id")
         )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
+        .group_by(ProductImage.product_id)
+        .subquery("first_images")
     )
 
-    query = (
+
+def product_images_column():
+    """
+    The images of the product as a json array, aggregated by a correlated subquery.
+    A listing row stays one row per product however many images it has, and the images of a page
+    come with the page instead of from a query per product.
+    Returns:
+        ScalarSelect: [{"id": ..., "image_path": ...}, ...] ordered by image id, [] without images.
+            It needs Product in the FROM clause of the enclosing query.
+    """
+    image = func.json_build_object("id", ProductImage.id, "image_path", ProductImage.image_path)
+    return (
+        select(func.coalesce(func.json_agg(aggregate_order_by(image, ProductImage.id)), literal_column("'[]'::json"), type_=JSON))
+        .filter(ProductImage.product_id == Product.id)
+        .scalar_subquery()
+    )
+
+
+# Text search configuration of products.search_vector (see the search_vector migration)
+SEARCH_CONFIG = "english"
+
+
+def prefix_tsquery(keyword: str):
+    """
+    Full text query matching every word of the keyword as a prefix ("red sho" finds "red shoes").
+    Args:
+        keyword (str): The text typed by the client.
+    Returns:
+        The tsquery expression, it matches nothing if the keyword has no words.
+    """
+    words = re.findall(r"\w+", keyword.lower())
+    # Only word characters reach to_tsquery, so the keyword can not inject tsquery operators
+    return func.to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), " & ".join(f"{word}:*" for word in words))
+
+
+def _similar(keyword: str, column):
+    """
+    Trigram match of the keyword against a word of the column (pg_trgm "<%" operator).
+    Served by the gin_trgm_ops index of the column, the threshold is FUZZY_SEARCH_THRESHOLD.
+    Args:
+        keyword (str): The text typed by the client.
+        column: The text column to match.
+    Returns:
+        The SQL expression.
+    """
+    return literal(keyword, String).op("<%")(column)
+
+
+def fuzzy_match_ids(keyword: str):
+    """
+    IDs of the products whose name or category name is similar to the keyword, for typo tolerant searches.
+    The two matches are combined with UNION ALL so each one uses its trigram index, and the
+    products of the matched categories are only read when a category matched at all.
+    Args:
+        keyword (str): The text typed by the client.
+    Returns:
+        Select: The product IDs (a product may appear twice).
+    """
+    products = aliased(Product)
+    categories = select(ProductCategory.id).filter(_similar(keyword, ProductCategory.category_name))
+    return union_all(
+        select(products.id).filter(_similar(keyword, products.product_name)),
+        select(products.id).filter(exists(categories), products.category_id.in_(categories)),
+    )
+
+
+def fuzzy_rank(keyword: str):
+    """
+    Similarity (0..1) of a product to the keyword, the best of its name and category name.
+    Args:
+        keyword (str): The text typed by the client.
+    Returns:
+        The SQL expression, it needs ProductCategory joined to Product.
+    """
+    return func.greatest(
+        func.word_similarity(literal(keyword, String), Product.product_name),
+        func.word_similarity(literal(keyword, String), func.coalesce(ProductCategory.category_name, "")),
+        type_=Float,
+    )
+
+
+async def did_you_mean(session, keyword: str):
+    """
+    The product or category name closest to the keyword, suggested when a search finds nothing.
+    Args:
+        session (AsyncSession): The SQLAlchemy async session.
+        keyword (str): The text typed by the client.
+    Returns:
+        str: The suggestion, None if no name is similar enough.
+    """
+    names = union_all(
         select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name, 
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
+            Product.product_name.label("name"),
+            func.word_similarity(literal(keyword, String), Product.product_name).label("score"),
+        ).filter(_similar(keyword, Product.product_name)),
+        select(
+            ProductCategory.category_name.label("name"),
+            func.word_similarity(literal(keyword, String), ProductCategory.category_name).label("score"),
+        ).filter(_similar(keyword, ProductCategory.category_name)),
+    ).subquery("names")
+    query = select(names.c.name).order_by(names.c.score.desc(), names.c.name).limit(1)
+    try:
+        return (await session.execute(query)).scalar()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+def listing_sort_columns(sort: str, review_stats, featured=None, rank=None):
+    """
+    The columns a listing is ordered by.
+    Every sort ends with the product id, so the order is total and can be used for keyset pagination.
+    Args:
+        sort (str): One of SORT_KEYS.
+        review_stats (Table): The review_stats_table joined into the listing.
+        featured: The FeaturedProduct entity when the listing is limited to featured products.
+        rank: The ts_rank (or fuzzy_rank) of the searched keyword, used by the relevance sort.
+    Returns:
+        list: (column, descending, getter) triples, getter reads the value of the column from a result row.
+    Raises:
+        HTTPException: If the sort key is unknown.
+    """
+    if sort == "id":
+        return [(Product.id, False, lambda row: row.Product.id)]
+    if sort == "newest":
+        return [
+            (Product.created_at, True, lambda row: row.Product.created_at),
+            (Product.id, True, lambda row: row.Product.id),
+        ]
+    if sort == "price_asc":
+        return [
+            (func.coalesce(Product.price, 0), False, lambda row: row.Product.price or 0),
+            (Product.id, False, lambda row: row.Product.id),
+        ]
+    if sort == "price_desc":
+        return [
+            (func.coalesce(Product.price, 0), True, lambda row: row.Product.price or 0),
+            (Product.id, False, lambda row: row.Product.id),
+        ]
+    if sort == "effective_price_asc":
+        return [
+            (func.coalesce(Product.effective_price, 0), False, lambda row: row.Product.effective_price or 0),
+            (Product.id, False, lambda row: row.Product.id),
+        ]
+    if sort == "effective_price_desc":
+        return [
+            (func.coalesce(Product.effective_price, 0), True, lambda row: row.Product.effective_price or 0),
+            (Product.id, True, lambda row: row.Product.id),
+        ]
+    if sort == "top_rated":
+        return [
+            (func.coalesce(review_stats.c.avg_rating, 0), True, lambda row: row.avg_rating or 0),
+            (func.coalesce(review_stats.c.num_reviews, 0), True, lambda row: row.num_reviews),
+            (Product.id, False, lambda row: row.Product.id),
+        ]
+    if sort == "relevance":
+        return [
+            (rank, True, lambda row: row.relevance),
+            (Product.id, False, lambda row: row.Product.id),
+        ]
+    if sort == "featured" and featured is not None:
+        return [(featured.id, False, lambda row: row.featured_id)]
+    raise HTTPException(status_code=400, detail=f"Unknown sort key {sort}")
+
+
+def _cursor_value(column, value):
+    """
+    Convert a sort value read from a cursor back to the python type of its column.
+    Args:
+        column: The sort column.
+        value: The json value from the cursor.
+    Returns:
+        The value as the type the database driver expects.
+    """
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def keyset_filter(sort_columns, values):
+    """
+    Filter that keeps the rows coming after the given sort values.
+    Args:
+        sort_columns (list): The listing_sort_columns of the listing.
+        values (list): The sort values of the last row of the previous page.
+    Returns:
+        The SQL expression.
+    Raises:
+        HTTPException: If the values do not match the sort columns.
+    """
+    if len(values) != len(sort_columns):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        values = [_cursor_value(column, value) for (column, _, _), value in zip(sort_columns, values)]
+    except (TypeError, ValueError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    directions = {descending for _, descending, _ in sort_columns}
+    columns = [column for column, _, _ in sort_columns]
+    # All columns in the same direction: a row value comparison the index can be used for
+    if len(directions) == 1:
+        values = tuple_(*[literal(value, column.type) for column, value in zip(columns, values)])
+        if directions.pop():
+            return tuple_(*columns) < values
+        return tuple_(*columns) > values
+
+    # Mixed directions: (c1 after v1) or (c1 = v1 and c2 after v2) or ...
+    clauses = []
+    for index, (column, descending, _) in enumerate(sort_columns):
+        after = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*[columns[i] == values[i] for i in range(index)], after))
+    return or_(*clauses)
+
+
+def listing_cursor_values(sort: str, row):
+    """
+    The sort values of a listing row, stored in the cursor of the next page.
+    Args:
+        sort (str): The sort key of the listing.
+        row: A row returned by build_product_listing_query.
+    Returns:
+        list: The value of every sort column.
+    """
+    return [getter(row) for _, _, getter in listing_sort_columns(sort, review_stats_table(), FeaturedProduct)]
+
+
+# Sort keys accepted by build_product_listing_query, "random" has no stable order
+SORT_KEYS = ("id", "newest", "price_asc", "price_desc", "effective_price_asc", "effective_price_desc", "top_rated", "relevance", "featured", "random")
+
+
+# Upper bounds of the price buckets counted by the price facet, the last bucket has no upper bound
+PRICE_BUCKETS = (25, 50, 100, 200, 500)
+
+
+def price_bucket():
+    """
+    The price bucket of a product: 0 below PRICE_BUCKETS[0], 1 up to PRICE_BUCKETS[1], ...
+    Returns:
+        Case: The bucket number.
+    """
+    # Constants instead of bound parameters, so the expression grouped by is the one selected
+    return case(
+        *[(Product.price < literal_column(str(bound)), literal_column(str(number))) for number, bound in enumerate(PRICE_BUCKETS)],
+        else_=literal_column(str(len(PRICE_BUCKETS))),
+    )
+
+
+def facet_conditions(category_ids=None, sizes=None, colors=None, audiences=None, min_price=None, max_price=None):
+    """
+    The filters of the faceted search keyed by facet.
+    Args:
+        category_ids (list): Categories to keep, None for all.
+        sizes (list): Sizes to keep, None for all.
+        colors (list): Colors to keep, None for all.
+        audiences (list): Target audiences to keep, None for all.
+        min_price (float): Lowest price (inclusive).
+        max_price (float): Highest price (inclusive).
+    Returns:
+        dict: The condition of every facet, None for the facets that are not filtered on.
+    """
+    price = []
+    if min_price is not None:
+        price.append(Product.price >= min_price)
+    if max_price is not None:
+        price.append(Product.price <= max_price)
+    return {
+        "category": Product.category_id.in_(category_ids) if category_ids else None,
+        "size": Product.product_size.in_(sizes) if sizes else None,
+        "color": Product.product_color.in_(colors) if colors else None,
+        "audience": Product.target_audience.in_(audiences) if audiences else None,
+        "price": and_(*price) if price else None,
+    }
+
+
+def build_facet_query(
+    search_keyword: str = None,
+    category_ids: list = None,
+    sizes: list = None,
+    colors: list = None,
+    audiences: list = None,
+    min_price: float = None,
+    max_price: float = None,
+    min_rating: float = None,
+):
+    """
+    Count the matching products per category, size, color, target audience and price bucket in one pass.
+
+    Every facet is counted with all the other filters but its own, so the shopper sees how many
+    products each alternative value would give (a category facet filtered on shoes still counts
+    the bags). One GROUPING SETS aggregate computes all of them, each grouping set reading the
+    count(*) FILTER of its facet, plus the total with every filter in the () set.
+
+    Args:
+        search_keyword (str): Full text search over the product name, category name and description.
+        category_ids (list): Categories to keep, None for all.
+        sizes (list): Sizes to keep, None for all.
+        colors (list): Colors to keep, None for all.
+        audiences (list): Target audiences to keep, None for all.
+        min_price (float): Lowest price (inclusive).
+        max_price (float): Highest price (inclusive).
+        min_rating (float): Only products with at least this average rating.
+
+    Returns:
+        Select: One row per grouping set and value: (category, size, color, audience, price, grouping,
+            total, <facet>_count..., category_name).
+    """
+    conditions = facet_conditions(category_ids, sizes, colors, audiences, min_price, max_price)
+    filtered = [condition for condition in conditions.values() if condition is not None]
+
+    def matches(*conditions):
+        return and_(*conditions) if conditions else true()
+
+    dimensions = {
+        "category": Product.category_id,
+        "size": Product.product_size,
+        "color": Product.product_color,
+        "audience": Product.target_audience,
+        "price": price_bucket(),
+    }
+
+    counts = [func.count().filter(matches(*filtered)).label("total")]
+    for facet in dimensions:
+        others = [condition for name, condition in conditions.items() if name != facet and condition is not None]
+        counts.append(func.count().filter(matches(*others)).label(f"{facet}_count"))
+
+    grouped = select(
+        *[column.label(facet) for facet, column in dimensions.items()],
+        # One bit per dimension (category first), set when the row is not grouped by it
+        func.grouping(*dimensions.values()).label("grouping"),
+        *counts,
+    ).select_from(Product)
+
+    if search_keyword is not None:
+        grouped = grouped.filter(Product.search_vector.op("@@")(prefix_tsquery(search_keyword)))
+    if min_rating is not None:
+        review_stats = review_stats_table()
+        grouped = (
+            grouped
+            .join(review_stats, Product.id == review_stats.c.product_id)
+            .filter(review_stats.c.avg_rating >= min_rating)
         )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id) 
-        .filter(
-            or_(
-                Product.product_name.ilike(f'%{search_keyword}%'),
-                Product.description.ilike(f'%{search_keyword}%'),
-                ProductCategory.category_name.ilike(f'%{search_keyword}%')
-            )
+    if len(filtered) > 1:
+        # Rows failing two facet filters are counted by no facet
+        grouped = grouped.filter(or_(*[
+            matches(*[condition for condition in filtered if condition is not other]) for other in filtered
+        ]))
+    grouped = grouped.group_by(
+        func.grouping_sets(*[tuple_(column) for column in dimensions.values()], tuple_())
+    ).subquery("facets")
+
+    return (
+        select(grouped, ProductCategory.category_name)
+        .outerjoin(ProductCategory, ProductCategory.id == grouped.c.category)
+    )
+
+
+def build_product_listing_query(
+    search_keyword: str = None,
+    name_keyword: str = None,
+    category_id: int = None,
+    product_size: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    product_ids: list = None,
+    featured_only: bool = False,
+    min_reviews: int = None,
+    on_sale: bool = False,
+    fuzzy: bool = False,
+    category_ids: list = None,
+    sizes: list = None,
+    colors: list = None,
+    audiences: list = None,
+    min_rating: float = None,
+    sort: str = "id",
+    after: list = None,
+    startindex: int = 0,
+    number: int = None,
+    include_image: bool = False,
+):
+    """
+    Build the query behind every product listing.
+
+    Review statistics are read from product_review_stats and the current discount from the product row,
+    so a listing never multiplies its rows by images x reviews x sales and needs no GROUP BY.
+    The page is picked before the details are joined, so only the returned rows are decorated.
+    Filters are bound parameters, so the compiled statement is reused from the engine cache.
+
+    Args:
+        search_keyword (str): Full text search over the product name, category name and description.
+        name_keyword (str): Matches the product name.
+        category_id (int): Only products of this category.
+        product_size (str): Matches the product size.
+        min_price (float): Lowest price (inclusive).
+        max_price (float): Highest price (inclusive).
+        product_ids (list): Only these products.
+        featured_only (bool): Only featured products.
+        min_reviews (int): Only products with at least this many reviews.
+        on_sale (bool): Only products with a current discount.
+        fuzzy (bool): Search with trigram similarity of the product and category name instead of full text,
+            so misspelled keywords still match.
+        category_ids (list): Only products of one of these categories.
+        sizes (list): Only products of one of these sizes (exact match).
+        colors (list): Only products of one of these colors (exact match).
+        audiences (list): Only products for one of these target audiences (exact match).
+        min_rating (float): Only products with at least this average rating.
+        sort (str): One of SORT_KEYS.
+        after (list): Sort values (from a cursor) of the last row of the previous page.
+        startindex (int): Number of rows to skip.
+        number (int): Maximum number of rows, None for all.
+        include_image (bool): Add the first ProductImage of every product to the row instead of all its images.
+
+    Returns:
+        Select: Rows of (Product, ProductImage or images, category_name, num_reviews, avg_rating, latest_discount_percent, [featured_id], [relevance]).
+    """
+    review_stats = review_stats_table()
+
+    columns = [Product]
+    if include_image:
+        columns.append(ProductImage)
+    else:
+        columns.append(product_images_column().label("images"))
+    columns += [
+        ProductCategory.category_name,
+        func.coalesce(review_stats.c.num_reviews, 0).label("num_reviews"),
+        review_stats.c.avg_rating.label("avg_rating"),
+        Product.current_discount_percent.label("latest_discount_percent"),
+    ]
+
+    # The page is picked from narrow rows first (the product id and what the filters and the sort need),
+    # so sorting many matches stays cheap. Only the rows of the page are joined with their details.
+    page = select(Product.id.label("product_id")).select_from(Product)
+    if sort == "top_rated" or min_reviews is not None or min_rating is not None:
+        page = page.outerjoin(review_stats, Product.id == review_stats.c.product_id)
+
+    featured = None
+    if featured_only:
+        featured = FeaturedProduct
+        page = (
+            page
+            .add_columns(FeaturedProduct.id.label("featured_id"))
+            .join(FeaturedProduct, Product.id == FeaturedProduct.product_id)
         )
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage, ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
+
+    # Filters
+    rank = None
+    if search_keyword is not None and fuzzy:
+        rank = fuzzy_rank(search_keyword)
+        page = (
+            page
+            .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)
+            .filter(Product.id.in_(fuzzy_match_ids(search_keyword)))
+        )
+    elif search_keyword is not None:
+        search_query = prefix_tsquery(search_keyword)
+        # Served by the GIN index on search_vector
+        rank = func.ts_rank(Product.search_vector, search_query, type_=Float)
+        page = page.filter(Product.search_vector.op("@@")(search_query))
+    if name_keyword is not None:
+        page = page.filter(Product.product_name.ilike(f'%{name_keyword}%'))
+    if category_id is not None:
+        page = page.filter(Product.category_id == category_id)
+    if product_size is not None:
+        page = page.filter(Product.product_size.ilike(f'%{product_size}%'))
+    if min_price is not None:
+        page = page.filter(Product.price >= min_price)
+    if max_price is not None:
+        page = page.filter(Product.price <= max_price)
+    if product_ids is not None:
+        page = page.filter(Product.id.in_(product_ids))
+    if min_reviews is not None:
+        page = page.filter(review_stats.c.num_reviews >= min_reviews)
+    if on_sale:
+        page = page.filter(Product.current_discount_percent > 0)
+    if min_rating is not None:
+        page = page.filter(review_stats.c.avg_rating >= min_rating)
+    for condition in facet_conditions(category_ids, sizes, colors, audiences).values():
+        if condition is not None:
+            page = page.filter(condition)
+
+    # Sort and page
+    order = []
+    if sort == "random":
+        if after is not None:
+            raise HTTPException(status_code=400, detail="Random listings can not be paged with a cursor")
+        page = page.order_by(func.random())
+    else:
+        if sort == "relevance" and rank is None:
+            raise HTTPException(status_code=400, detail="Only searches can be sorted by relevance")
+        sort_columns = listing_sort_columns(sort, review_stats, featured, rank)
+        if after is not None:
+            page = page.filter(keyset_filter(sort_columns, after))
+        order = [
+            column.desc() if descending else column
+            for column, descending, _ in sort_columns
+        ]
+        page = page.order_by(*order)
+    if startindex:
+        page = page.offset(startindex)
+    if number is not None:
+        page = page.limit(number)
+    page = page.subquery("page")
+
+    query = (
+        select(*columns)
+        .select_from(page)
+        .join(Product, Product.id == page.c.product_id)
+        .outerjoin(review_stats, Product.id == review_stats.c.product_id)
+        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)
     )
 
-    return query
+    if include_image:
+        first_images = first_image_subquery()
+        query = (
+            query
+            .outerjoin(first_images, Product.id == first_images.c.product_id)
+            .outerjoin(ProductImage, ProductImage.id == first_images.c.image_id)
+        )
+
+    if featured_only:
+        query = (
+            query
+            .add_columns(FeaturedProduct.id.label("featured_id"))
+            .join(FeaturedProduct, FeaturedProduct.id == page.c.featured_id)
+        )
+    if rank is not None:
+        query = query.add_columns(rank.label("relevance"))
+
+    # The rows of the page in the order they were picked in
+    return query.order_by(*order)
+
+
+def get_products_with_images_and_reviews(search_keyword, startindex, number):
+    """
+    Get products with images and reviews.
+    Args:
+        search_keyword (str): The keyword to search for in product name, description, or category name.
+        startindex (int): The starting index to retrieve the products.
+        number (int): The number of products to retrieve.
+    Returns:
+        Query: The SQLAlchemy query object.
+    """
+    return build_product_listing_query(search_keyword=search_keyword, sort="relevance", startindex=startindex, number=clamp_page_size(number))
 
 
 def get_products(number: int, startindex: int):
@@ -67,45 +606,15 @@ def get_products(number: int, startindex: int):
     Returns:
         A query object that can be executed to retrieve the products and their images.
     """
-    # Create the main query to retrieve products and their images
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
-
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name, 
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage, ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-    return query
+    return build_product_listing_query(startindex=startindex, number=clamp_page_size(number))
 
 
 def get_product_by_category(category_id: int,startindex: int, number: int):
     """
     Retrieve products by category with additional information:
-    - ProductImage
     - Number of reviews
     - Average rating
+    - Latest discount
     Args:
     - category_id: int - the ID of the category
     - startindex: int - the starting index for pagination
@@ -113,40 +622,7 @@ def get_product_by_category(category_id: int,startindex: int, number: int):
     Returns:
     - query: SQLAlchemy query object
     """
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
-
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name, 
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .filter(Product.category_id == category_id)
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage, ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-
-    return query
-
- # this function retruns is working but it is not searching form the product description
+    return build_product_listing_query(category_id=category_id, startindex=startindex, number=clamp_page_size(number))
 
 
 def get_product_by_category_keyword(category_id: int, search_keyword: str, number: int, startindex: int):
@@ -154,46 +630,13 @@ def get_product_by_category_keyword(category_id: int, search_keyword: str, numbe
     Retrieve products based on category, search keyword, and pagination.
     Args:
         category_id (int): The ID of the category to filter the products by.
-        search_keyword (str): The keyword to search for in the product name and description.
+        search_keyword (str): The keyword to search for in the product name, description or category name.
         number (int): The number of products to retrieve.
         startindex (int): The starting index of the retrieved products.
     Returns:
-        sqlalchemy.orm.query.Query: The query object to retrieve the products.
+        sqlalchemy.sql.selectable.Select: The query object to retrieve the products.
     """
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
-
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        # .filter(or_(Product.product_name.ilike(f'%{search_keyword}%')), Product.description.ilike(f'%{search_keyword}%'))
-        .filter(Product.product_name.ilike(f'%{search_keyword}%'))        
-        .filter(Product.category_id == category_id)
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage,ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-
-    return query
+    return build_product_listing_query(category_id=category_id, search_keyword=search_keyword, sort="relevance", startindex=startindex, number=clamp_page_size(number))
 
 
 def search_product_by_productsize(product_size: str, number: int, startindex: int):
@@ -207,40 +650,7 @@ def search_product_by_productsize(product_size: str, number: int, startindex: in
     Returns:
         A query object that fetches products filtered by product size.
     """
-    # Call the helper function to execute the query and return the result
-    
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
-
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .filter(Product.product_size.ilike(f'%{product_size}%'))
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage,ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-
-    return query
+    return build_product_listing_query(product_size=product_size, startindex=startindex, number=clamp_page_size(number))
 
 
 def filter_product_by_price(min_price: float, max_price: float, number: int, product_name: str, startindex: int):
@@ -255,44 +665,14 @@ def filter_product_by_price(min_price: float, max_price: float, number: int, pro
     Returns:
         A query object that fetches products filtered by price range.
     """
-    # Create the query object
-    
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
+    return build_product_listing_query(
+        min_price=min_price,
+        max_price=max_price,
+        name_keyword=product_name,
+        startindex=startindex,
+        number=clamp_page_size(number),
     )
 
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .filter(Product.price >= min_price)
-        .filter(Product.price <= max_price)
-        .filter(Product.product_name.ilike(f'%{product_name}%'))
-        .offset(startindex)
-        .limit(number)
-        .group_by(Product, ProductImage,ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-
-
-    return query
-
 
 def get_featured_products(number: int, startindex: int):
     """
@@ -300,81 +680,44 @@ def get_featured_products(number: int, startindex: int):
 
     Args:
         number (int): The number of products to retrieve.
-        startindex (int): The starting index of the products.
+        startindex (int): The position (starting at 1) of the first featured product.
 
     Returns:
         sqlalchemy.sql.selectable.Select: The query to retrieve the featured products.
     """
-    # Create a common table expression (CTE) to rank the featured products
-    cte = (
-        select(
-            FeaturedProduct.product_id,
-            func.row_number().over().label("rownum")
-        )
-        .select_from(FeaturedProduct)
-        .alias("ranked_featured")
+    # Featured products are numbered from 1 in the order they were featured
+    return build_product_listing_query(
+        featured_only=True,
+        sort="featured",
+        startindex=max(startindex - 1, 0),
+        number=clamp_page_size(number),
     )
 
-    # Create a subquery to get the latest discount percent for each product
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
 
-    # Build the query to retrieve the featured products with additional information
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            cte.c.rownum,
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .select_from(Product)
-        .join(cte, Product.id == cte.c.product_id)
-        .outerjoin(ProductImage, Product.id == ProductImage.product_id)
-        .outerjoin(Review, Product.id == Review.product_id)
-        .outerjoin(subquery, Product.id == subquery.c.product_id)
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .filter(cte.c.rownum.between(startindex, startindex + number - 1))
-        .group_by(Product, ProductImage,ProductCategory.category_name, cte.c.rownum, Sales.discount_percent)
-        .order_by(cte.c.rownum)
-    )
-
-    return query
-
-
-def deal_of_the_day(session, number: int):
+async def deal_of_the_day(session, number: int):
     """
     Generates the deal of the day by retrieving products and their details.
 
     Args:
+        session (AsyncSession): The SQLAlchemy async session.
         number (int): The number of products to retrieve.
-        startindex (int): The starting index of the products to retrieve.
 
     Returns:
-        sqlalchemy.sql.selectable.Select: The query to retrieve the deal of the day products.
+        List[int]: The IDs of the products with the latest discounts.
     """
     # Create the main query to retrieve products and their images
    # Query to get the top 10 product IDs with the newly added discount_percent
     try:
-        top_product_ids = (
-            session.query(
+        query = (
+            select(
                 Product.id
             )
             .join(Sales, Product.id == Sales.product_id)
             .filter(Sales.discount_percent.isnot(None))
             .order_by(Sales.sale_date.desc())  # Order by sale date to get the latest discount first
-            .limit(number)
-            .all()
+            .limit(clamp_page_size(number))
         )
+        top_product_ids = (await session.execute(query)).all()
 
         # Extracting product IDs from the result
         product_ids = [product_id for (product_id,) in top_product_ids]
@@ -382,15 +725,15 @@ def deal_of_the_day(session, number: int):
         return product_ids
     except SQLAlchemyError as e:
         # Rollback the session in case of an error and raise an HTTPException
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
 
-def new_arrivals(session, number: int):
+async def new_arrivals(session, number: int):
     """
     Retrieve the IDs of the most recent products.
     Args:
-        session (Session): The SQLAlchemy session.
+        session (AsyncSession): The SQLAlchemy async session.
         number (int): The number of products to retrieve.
     Returns:
         List[int]: The IDs of the most recent products.
@@ -401,16 +744,16 @@ def new_arrivals(session, number: int):
     # Query the product IDs in descending order of creation date
     try:
         query = (
-            session.query(Product.id)
+            select(Product.id)
             .order_by(Product.created_at.desc())
-            .limit(number)
+            .limit(clamp_page_size(number))
         )
-        results = [result[0] for result in query.all()]
+        results = (await session.execute(query)).scalars().all()
         # Retrieve the results and extract the IDs from the query results
         return results
     except SQLAlchemyError as e:
         # Rollback the session in case of an error and raise an HTTPException
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
 
@@ -420,35 +763,6 @@ def get_product_details_query(product_ids):
     Args:
         product_ids (list): A list of product IDs.
     Returns:
-        query: SQLAlchemy query object that retrieves the product details.
+        query: SQLAlchemy query object that retrieves the product details with their first image.
     """
-    # Subquery to get the latest sale date for each product
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
-    # Main query to retrieve product details
-    query = (
-        select(
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Join ProductCategory
-        .filter(Product.id.in_(product_ids))  # Filter by provided product IDs
-        .group_by(Product, ProductImage, ProductCategory.category_name, Sales.discount_percent)
-        .order_by(Product.id)
-        .distinct(Product.id)
-    )
-    return query
+    return build_product_listing_query(product_ids=product_ids, include_image=True)
@@ -1,8 +1,8 @@
-from server.models.models1 import session
-from server.models.models import ProductImage, Review, UserPurchase, Product, Sales, ProductCategory
+from server.models.models import ProductImage, UserPurchase, Product, ProductCategory
 from sqlalchemy.sql.expression import func, desc
-from sqlalchemy.orm import aliased
 from sqlalchemy import func, select, distinct
+from server.db.fliter_product_with_reviews_helper import build_product_listing_query, review_stats_table, first_image_subquery
+from server.utils.pagination import clamp_page_size
 
 
 def get_random_products_helper(number_of_products: int):
@@ -13,38 +13,7 @@ def get_random_products_helper(number_of_products: int):
     Returns:
         The query that retrieves the random subset of product details.
     """
-    # Use aliased to create an alias for the Product table
-    product_alias = aliased(Product)
-
-    # Create a subquery to get a random subset of product IDs
-    random_product_ids = (
-        select([Product.id])
-        .order_by(func.random())
-        .limit(number_of_products)
-    ).alias("random_products")
-
-    # Create the main query to retrieve product details for the random subset
-    query = (
-        select(
-            product_alias,
-            ProductImage,
-            ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("latest_discount_percent")
-        )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(Sales)
-        .outerjoin(ProductCategory, product_alias.category_id == ProductCategory.id)  # Use product_alias here
-        .filter(product_alias.id == random_product_ids.c.id)  # Use product_alias here
-        .group_by(product_alias, ProductImage, ProductCategory.category_name, Sales.discount_percent)
-        .order_by(product_alias.id)
-        .distinct(product_alias.id)
-    )
-
-
-    return query
+    return build_product_listing_query(sort="random", number=clamp_page_size(number_of_products))
 
 
 def get_top_rated_products_helper(number_of_products: int = 5):
@@ -55,42 +24,8 @@ def get_top_rated_products_helper(number_of_products: int = 5):
     Returns:
         sqlalchemy.sql.selectable.Select: SQLAlchemy select query to retrieve top rated products.
     """
-    # Use aliased to create an alias for the Review table
-    review_alias = aliased(Review)
-
-    # Create a subquery to get the number of reviews and average rating for each product
-    review_info_subquery = (
-        select([
-            Product.id,
-            func.count(review_alias.id).label("num_reviews"),
-            func.avg(review_alias.rating).label("avg_rating")
-        ])
-        .outerjoin(review_alias)
-        .group_by(Product.id)
-    ).alias("review_info")
-
-    # Create the main query to retrieve product details with reviews and discounts
-    query = (
-        select([
-            Product,
-            ProductImage,
-            ProductCategory.category_name,
-            review_info_subquery.c.num_reviews,
-            review_info_subquery.c.avg_rating,
-            Sales.discount_percent.label("latest_discount_percent")
-        ])
-        .select_from(Product)  # Explicitly set the main table
-        .outerjoin(ProductImage)
-        .outerjoin(review_info_subquery, Product.id == review_info_subquery.c.id)
-        .outerjoin(Sales, Product.id == Sales.product_id)
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Add this line for the missing join condition
-        .filter(review_info_subquery.c.num_reviews > 0)
-        .order_by(desc(review_info_subquery.c.avg_rating), desc(review_info_subquery.c.num_reviews))
-        .distinct(review_info_subquery.c.avg_rating, review_info_subquery.c.num_reviews, Product.id)
-        .limit(number_of_products)
-    )
-
-    return query
+    # Only reviewed products, best average rating first and the most reviewed on ties
+    return build_product_listing_query(min_reviews=1, sort="top_rated", number=clamp_page_size(number_of_products))
 
 
 # purchase_counts_subquery not wokring properly
@@ -103,19 +38,8 @@ def get_trending_product_with_reviews(number_of_products: int):
         query: The query object containing the results.
     """
 
-    # Use aliased to create an alias for the Review table
-    review_alias = aliased(Review)
-
-    # Create a subquery to get the number of reviews and average rating for each product
-    review_info_subquery = (
-        select([
-            Product.id,
-            func.count(review_alias.id).label("num_reviews"),
-            func.avg(review_alias.rating).label("avg_rating")
-        ])
-        .outerjoin(review_alias)
-        .group_by(Product.id)
-    ).alias("review_info")
+    # The number of reviews and average rating of each product, maintained on write
+    review_stats = review_stats_table()
 
     # Create a subquery to get the count of purchases for each product
     purchase_counts_subquery = (
@@ -123,6 +47,9 @@ def get_trending_product_with_reviews(number_of_products: int):
         .group_by(UserPurchase.product_id)
     ).alias("purchase_counts")
 
+    # The first image of each product, joining all of them would repeat the product once per image
+    first_images = first_image_subquery()
+
     # Create the main query to retrieve product details with reviews and discounts
 
     query = (
@@ -130,24 +57,24 @@ def get_trending_product_with_reviews(number_of_products: int):
             Product,
             ProductImage,
             ProductCategory.category_name,
-            review_info_subquery.c.num_reviews.label("num_reviews"),
-            review_info_subquery.c.avg_rating.label("avg_rating"),
-            Sales.discount_percent.label("discount_percent"),
+            review_stats.c.num_reviews.label("num_reviews"),
+            review_stats.c.avg_rating.label("avg_rating"),
+            Product.current_discount_percent.label("discount_percent"),
             purchase_counts_subquery.c.purchase_count.label("purchase_count")
         ])
         .select_from(Product)
-        .outerjoin(ProductImage)
-        .outerjoin(review_info_subquery, Product.id == review_info_subquery.c.id)
-        .outerjoin(Sales, Product.id == Sales.product_id)
+        .outerjoin(first_images, Product.id == first_images.c.product_id)
+        .outerjoin(ProductImage, ProductImage.id == first_images.c.image_id)
+        .outerjoin(review_stats, Product.id == review_stats.c.product_id)
         .outerjoin(purchase_counts_subquery, Product.id == purchase_counts_subquery.c.product_id)
         .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)  # Add this line for the missing join condition
-        .filter(review_info_subquery.c.num_reviews > 0)
+        .filter(review_stats.c.num_reviews > 0)
         .order_by(
-            desc(review_info_subquery.c.num_reviews),
+            desc(review_stats.c.num_reviews),
             desc(purchase_counts_subquery.c.purchase_count),
-            desc(review_info_subquery.c.avg_rating)
+            desc(review_stats.c.avg_rating)
         )
-        .distinct(review_info_subquery.c.avg_rating, review_info_subquery.c.num_reviews, purchase_counts_subquery.c.purchase_count, Product.id)
-        .limit(number_of_products)
+        .distinct(review_stats.c.avg_rating, review_stats.c.num_reviews, purchase_counts_subquery.c.purchase_count, Product.id)
+        .limit(clamp_page_size(number_of_products))
     )
     return query
@@ -1,8 +1,11 @@
 from fastapi import status,HTTPException, Response
-from server.models.models import ProductCategory
+from server.models.models import Product, ProductCategory
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import product_cat_schemas
 from sqlalchemy.orm import aliased
+from server.utils.search_engine import index_products
+from server.utils.suggest_index import refresh_category_suggestions
+from server.utils.response_cache import invalidate, category_tag, CATEGORIES
 
 def helper_create_product_category(session, product_category: product_cat_schemas.ProductCategoryCreate ):
     """
@@ -24,9 +27,11 @@ def helper_create_product_category(session, product_category: product_cat_schema
 
         # Commit the changes to the database
         session.commit()
+        invalidate(CATEGORIES)
 
         # Refresh the new_product_category with the latest data from the database
         session.refresh(new_product_category)
+        refresh_category_suggestions(new_product_category.id, new_product_category.category_name)
     
     except SQLAlchemyError as e:
         # Print the error message
@@ -35,10 +40,6 @@ def helper_create_product_category(session, product_category: product_cat_schema
         # Rollback the transaction
         session.rollback()
 
-    finally:
-        # Close the session
-        session.close()
-    
     # Return the newly created ProductCategory
     return new_product_category
 
@@ -65,9 +66,15 @@ def helper_delete_product_category(session, id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Product Category with id {id} does not exist")
 
+    # The products of the category lose its name in the search index
+    product_ids = [product_id for product_id, in session.query(Product.id).filter(Product.category_id == id)]
+
     # Delete the product category
     product_cat_query.delete(synchronize_session=False)
     session.commit()
+    index_products(session, product_ids)
+    refresh_category_suggestions(id)
+    invalidate(CATEGORIES, category_tag(id))
 
     # Return a response with no content
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -105,11 +112,13 @@ def helper_update_product_category(session, id: int, productcat_update: product_
         session.query(ProductCategory).filter(ProductCategory.id == id).update(productcat_update.model_dump(),
                                                                               synchronize_session=False)
         session.commit()
+        # The products of the category are searched by its (new) name
+        index_products(session, [product_id for product_id, in session.query(Product.id).filter(Product.category_id == id)])
+        refresh_category_suggestions(id, productcat_update.category_name)
+        invalidate(CATEGORIES, category_tag(id))
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         session.rollback()
-    finally:
-        session.close()
 
     # Retrieve and return the updated product category
     return session.query(ProductCategory).filter(ProductCategory.id == id).first()
@@ -4,6 +4,11 @@ from server.models.models import Product, ProductImage, Sales, Review, ProductCa
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import product_schemas
 from sqlalchemy import or_, and_
+from server.db.fliter_product_with_reviews_helper import review_stats_table
+from server.db.sales_helper import refresh_product_discount
+from server.utils.search_engine import index_products, remove_product
+from server.utils.suggest_index import refresh_product_suggestions, remove_product_suggestions
+from server.utils.response_cache import invalidate, product_tag, PRODUCTS
 
 
 def helper_for_get_one_product(session, id: int):
@@ -74,16 +79,18 @@ def helper_update_product(session, id:int, product_update:product_schemas.Produc
 
         # Update the product with the new data
         product_query.update(product_update.model_dump(), synchronize_session=False)
+
+        # The effective price follows the new price
+        refresh_product_discount(session, id)
         session.commit()
+        index_products(session, [id])
+        refresh_product_suggestions(session, [id])
+        invalidate(PRODUCTS, product_tag(id))
     except SQLAlchemyError as e:
         # If an error occurs during the update, print the error and rollback the transaction
         print(f"An error occurred: {e}")
         session.rollback()
 
-    finally:
-        # Close the database session
-        session.close()
-
     # Return the updated product
     return product_query.first()
 
@@ -111,16 +118,15 @@ def helper_for_deleting_product(session, id:int):
         # Delete the product
         product_query.delete(synchronize_session=False)
         session.commit()
+        remove_product(id)
+        remove_product_suggestions(id)
+        invalidate(PRODUCTS, product_tag(id))
     
     except SQLAlchemyError as e:
         # Handle any SQLAlchemy errors
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -138,6 +144,8 @@ def helper_create_product(session, product_data: product_schemas.ProductCreate):
     try:
         # Convert the Pydantic model to a SQLAlchemy model
         new_product = Product(**product_data.model_dump(exclude={"images"}))
+        # A new product is on no sale yet
+        new_product.effective_price = new_product.price
 
         # Create product images and associate with the product
         image_urls = []  # List to store image URLs
@@ -150,6 +158,9 @@ def helper_create_product(session, product_data: product_schemas.ProductCreate):
         session.add(new_product)
         session.commit()
         session.refresh(new_product)
+        index_products(session, [new_product.id])
+        refresh_product_suggestions(session, [new_product.id])
+        invalidate(PRODUCTS)
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
@@ -158,9 +169,6 @@ def helper_create_product(session, product_data: product_schemas.ProductCreate):
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
 
-    finally:
-        session.close()
-
     # Construct a dictionary representation of the new product with image URLs
     result = {
         "id": new_product.id,
@@ -180,7 +188,7 @@ def helper_create_product(session, product_data: product_schemas.ProductCreate):
     return result
 
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import selectinload
 
 def get_product_by_id(product_id: int):
     """
@@ -192,38 +200,21 @@ def get_product_by_id(product_id: int):
     Returns:
         A query object that can be executed to retrieve the product and its data.
     """
-    # Create the subquery to get the latest discount percent for the product
-    subquery = (
-        select(
-            Sales.product_id,
-            func.max(Sales.sale_date).label("max_sale_date")
-        )
-        .where(Sales.product_id == product_id)
-        .group_by(Sales.product_id)
-        .alias("latest_sales")
-    )
+    review_stats = review_stats_table()
 
     # Build the query to retrieve the product and its data, including all images
     query = (
         select(
             Product,
             ProductCategory.category_name,
-            func.count(Review.id).label("num_reviews"),
-            func.avg(Review.rating).label("avg_rating"),
-            Sales.discount_percent.label("discount_percent"),
-            # ProductImage
+            func.coalesce(review_stats.c.num_reviews, 0).label("num_reviews"),
+            review_stats.c.avg_rating.label("avg_rating"),
+            Product.current_discount_percent.label("discount_percent"),
         )
-        .outerjoin(ProductImage)
-        .outerjoin(Review)
-        .outerjoin(subquery, and_(Product.id == subquery.c.product_id))
-        .outerjoin(Sales, and_(Product.id == Sales.product_id, Sales.sale_date == subquery.c.max_sale_date))
-        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id) 
+        .outerjoin(review_stats, Product.id == review_stats.c.product_id)
+        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)
         .filter(Product.id == product_id)
-        .options(joinedload(Product.images))  # Use joinedload to eagerly load images
-        .group_by(Product, Sales.discount_percent, ProductImage, ProductCategory.category_name,)
-        .order_by(Product.id)
-        .distinct(Product.id, ProductImage.id)
+        .options(selectinload(Product.images))  # Use selectinload to eagerly load images (lazy loads are not allowed on an AsyncSession)
     )
 
     return query
-
@@ -2,6 +2,7 @@ from server.models.models import ProductImage
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import product_image_schemas
 from fastapi import status,HTTPException, Response
+from server.utils.response_cache import invalidate, product_tag
 
 def helper_create_product_image(session, product_image:product_image_schemas.ProductImageCreate ):
     """
@@ -23,6 +24,7 @@ def helper_create_product_image(session, product_image:product_image_schemas.Pro
 
         # Commit the changes to the database
         session.commit()
+        invalidate(product_tag(new_product_image.product_id))
 
         # Refresh the new_product_category with the latest data from the database
         session.refresh(new_product_image)
@@ -38,10 +40,6 @@ def helper_create_product_image(session, product_image:product_image_schemas.Pro
             detail=f"An error occurred while processing your request. \n most probably product with id {product_image.product_id} does not exist."
         )
 
-    finally:
-        # Close the session
-        session.close()
-    
     # Return the newly created ProductCategory
     return new_product_image
 
@@ -73,6 +71,7 @@ def helper_delete_product_image(session, id: int):
         # Delete the product category
         product_image_query.delete(synchronize_session=False)
         session.commit()
+        invalidate(product_tag(product_cat.product_id))
 
         # Return a response with no content
         return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -87,9 +86,6 @@ def helper_delete_product_image(session, id: int):
             detail=f"An error occurred while processing your request. \n most probably product with id {id} does not exist."
         )
 
-    finally:
-        # Close the session
-        session.close()
 
 def helper_update_product_image(session, id: int, product_image:product_image_schemas.ProductImageUpdate ):
     """
@@ -123,6 +119,7 @@ def helper_update_product_image(session, id: int, product_image:product_image_sc
 
         # Commit the changes to the database
         session.commit()
+        invalidate(product_tag(product_image1.product_id), product_tag(product_image.product_id))
 
     except SQLAlchemyError as e:
         # Handle any database errors and rollback the session
@@ -134,9 +131,5 @@ def helper_update_product_image(session, id: int, product_image:product_image_sc
         )
         
 
-    finally:
-        # Close the session
-        session.close()
-
     # Return the updated review
     return product_image_query.first()
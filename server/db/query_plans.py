@@ -0,0 +1,105 @@
+import json
+import sys
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects import postgresql
+
+from server.models.models import User, Review, Cart, Favorite, UserPurchase, ProductCategory, Product, Sales
+from server.db.fliter_product_with_reviews_helper import listing_sort_columns
+
+
+def listing_order(sort: str):
+    """The ORDER BY of a listing sorted by sort, as build_product_listing_query writes it."""
+    return [column.desc() if descending else column for column, descending, _ in listing_sort_columns(sort, None)]
+
+
+# (lookup, index it must use, query) of the hot lookups of the helpers and routers
+HOT_QUERIES = [
+    ("login (auth_router.login)", "ix_users_email", select(User).filter(User.email == "user@example.com")),
+    ("registration username check", "ix_users_username", select(User.id).filter(User.username == "user")),
+    ("reviews of a product (review_helper)", "ix_reviews_product_id", select(Review).filter(Review.product_id == 1)),
+    (
+        "review stats of products (review_stats_helper)", "ix_reviews_product_id",
+        select(Review.product_id, func.count(Review.id), func.sum(Review.rating))
+        .filter(Review.product_id.in_([1, 2, 3]))
+        .group_by(Review.product_id),
+    ),
+    ("reviews of a user", "ix_reviews_user_id", select(Review.id).filter(Review.user_id == 1)),
+    (
+        "cart of a user (cart_helper)", "ix_carts_user_id",
+        select(Cart, Product).join(Product, Cart.product_id == Product.id).filter(Cart.user_id == 1),
+    ),
+    (
+        "favorites of a user (favorites_helper)", "ix_favorites_user_id",
+        select(Favorite, Product).join(Product, Favorite.product_id == Product.id).filter(Favorite.user_id == 1),
+    ),
+    (
+        "purchases of a user (user_purchases_helper)", "ix_user_purchases_user_id",
+        select(UserPurchase, Product).join(Product, UserPurchase.product_id == Product.id).filter(UserPurchase.user_id == 1),
+    ),
+    ("purchases of a product", "ix_user_purchases_product_id", select(UserPurchase.id).filter(UserPurchase.product_id == 1)),
+    ("child categories", "ix_product_categories_parent_category_id", select(ProductCategory).filter(ProductCategory.parent_category_id == 1)),
+    (
+        "category listing", "ix_products_category_listing",
+        select(Product.id).filter(Product.category_id == 1).order_by(*listing_order("id")).limit(20),
+    ),
+    ("newest listing", "ix_products_newest", select(Product.id).order_by(*listing_order("newest")).limit(20)),
+    ("price range filter", "ix_products_price", select(Product.id).filter(Product.price >= 10, Product.price <= 20)),
+    ("listing by price, cheapest first", "ix_products_price_asc", select(Product.id).order_by(*listing_order("price_asc")).limit(20)),
+    ("listing by price, dearest first", "ix_products_price_desc", select(Product.id).order_by(*listing_order("price_desc")).limit(20)),
+    (
+        "latest discounts (deal of the day)", "ix_sales_latest_discount",
+        select(Product.id)
+        .join(Sales, Product.id == Sales.product_id)
+        .filter(Sales.discount_percent.isnot(None))
+        .order_by(Sales.sale_date.desc())
+        .limit(10),
+    ),
+]
+
+
+def plan_indexes(plan: dict) -> set:
+    """The names of the indexes an EXPLAIN (FORMAT JSON) plan reads."""
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", ()):
+        names |= plan_indexes(child)
+    return names
+
+
+def check_query_plans(connection) -> list:
+    """
+    EXPLAIN every hot lookup and check it reads its index.
+
+    Sequential scans are disabled for the check: on the small tables of a development database the planner
+    rightly prefers them, what is checked is that an index exists that the query can use.
+
+    Args:
+        connection: SQLAlchemy connection object.
+
+    Returns:
+        list: (lookup, expected index, indexes of the plan, whether the expected one is used) per lookup.
+    """
+    results = []
+    with connection.begin():
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for lookup, index, query in HOT_QUERIES:
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = plan_indexes(plan[0]["Plan"])
+            results.append((lookup, index, used, index in used))
+    return results
+
+
+if __name__ == "__main__":
+    # Print the plans of the hot lookups of the configured database: python -m server.db.query_plans
+    # Exits with 1 when a lookup does not use its index (e.g. a migration was not applied),
+    # tests/test_query_plans.py runs the same check with the tests
+    from server.db.db import engine
+
+    with engine.connect() as connection:
+        results = check_query_plans(connection)
+    for lookup, index, used, ok in results:
+        print(f"{'ok' if ok else 'MISSING':>7}  {lookup:<48} {index:<42} plan: {', '.join(sorted(used)) or 'no index'}")
+    sys.exit(0 if all(ok for *_, ok in results) else 1)
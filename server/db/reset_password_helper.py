@@ -1,7 +1,7 @@
 from server.models.models import User, Token
-import smtplib
-from server.utils import hash_helper
-from email.mime.text import MIMEText
+from server.utils import hash_helper, oauth2, token_blacklist, email_outbox
+from datetime import datetime, timezone
+from jose import jwt
 from sqlalchemy.exc import SQLAlchemyError
 import os
 from dotenv import load_dotenv
@@ -9,10 +9,6 @@ from fastapi import status, HTTPException
 load_dotenv()
 
 
-password: str = os.getenv("password")
-email1: str = os.getenv("email")
-
-
 def get_user_by_email(session, email: str):
     """
     Retrieves a user from the session by their email.
@@ -55,12 +51,14 @@ def update_user_password(session, user: User, new_password: str):
     Returns:
         None
     """
-    try:
-        # Hash the new password
-        hashed_password = hash_helper.hash(new_password)
+    # Hash the new password in the password process pool (a 503 when too many are queued)
+    hashed_password = hash_helper.run(hash_helper.hash, new_password)
 
+    try:
         # Update the user's hashed password
         user.password = hashed_password
+        # Revoke the tokens issued with the old password
+        user.token_version = User.token_version + 1
 
         # Commit changes to the database
         session.add(user)
@@ -74,63 +72,58 @@ def update_user_password(session, user: User, new_password: str):
             detail=f"An error occurred while processing your request. \n most probably user with email {user.email} does not exist."
         )
 
+    oauth2.forget_user(user.id)
 
-def send_reset_email(email: str, token: str):
+
+def send_reset_email(email: str, token: str, session=None):
     """
     Send a password reset email to the specified email address.
 
     Args:
         email (str): The recipient's email address.
         token (str): The password reset token.
+        session: The database session, the email is added to the outbox with it when EMAIL_OUTBOX_ENABLED.
 
     Returns:
         None
 
     Raises:
-        Exception: If there is an error sending the email.
+        HTTPException: If the email could not be added to the outbox.
     """
-
-    # SMTP server configuration
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
-    smtp_username = email1
-    smtp_password = password
-
     # Email content
     subject = "Password Reset"
     
     body = f"Click the following link to reset your password: http://localhost:60602/reset-password?token={token}"
 
-
-    # Create MIMEText object
-    message = MIMEText(body)
-    message["Subject"] = subject
-    message["From"] = smtp_username
-    message["To"] = email
+    if email_outbox.EMAIL_OUTBOX_ENABLED and session is not None:
+        # Sent by the background sender, the request does not wait for the SMTP server
+        email_outbox.enqueue(session, email, subject, body)
+        return
 
     try:
-        # Connect to the SMTP server
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-
-        # Log in to the SMTP server
-        server.login(smtp_username, smtp_password)
-
-        # Send the email
-        server.sendmail(smtp_username, [email], message.as_string())
-
-        # Disconnect from the SMTP server
-        server.quit()
-
+        email_outbox.send_now(email, subject, body)
         print("Password reset email sent successfully.")
     except Exception as e:
         print(f"Error sending password reset email: {e}")
 
 
 def check_token_validity(session,token:str):
+    """
+    Check whether a reset token was already used, i.e. is in the blacklist.
+
+    Args:
+        session: The database session.
+        token (str): The reset token.
+
+    Returns:
+        bool: True if the token is blacklisted. Tokens the Bloom filter of the blacklist does not
+            contain are answered without a query.
+    """
+    if not token_blacklist.may_contain(token):
+        return False
+
     try:
         token = session.query(Token).filter(Token.token == token).first()
-        session.close()
         return token is not None
     
     except SQLAlchemyError as e:
@@ -143,14 +136,25 @@ def check_token_validity(session,token:str):
 
 
 def add_token_blacklist(session,token:str, user_id:int):
+    """
+    Blacklist a used reset token until it expires.
+
+    Args:
+        session: The database session.
+        token (str): The reset token, already verified.
+        user_id (int): The id of the user of the token.
+    """
+    # The row is kept until the token expires, the pruning of the blacklist deletes it after
+    expires_at = datetime.fromtimestamp(jwt.get_unverified_claims(token)["exp"], timezone.utc)
     try:
-        session.add(Token(token=token, user_id=user_id))
+        session.add(Token(token=token, user_id=user_id, expires_at=expires_at))
         session.commit()
-        session.close()
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         session.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while processing your request. user with id {user_id} does not exist."
-        )
\ No newline at end of file
+        )
+
+    token_blacklist.remember(token)
@@ -2,6 +2,8 @@ from fastapi import  status,HTTPException, Response
 from server.models.models import Review
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import reviews_schemas
+from server.db.review_stats_helper import apply_review_delta
+from server.utils.response_cache import invalidate, product_tag, REVIEWS
 
 
 
@@ -22,9 +24,13 @@ def helper_create_review(session, product_data: reviews_schemas.CreateReview ):
         
         # Add the Review object to the session
         session.add(db_review)
+
+        # Count the review in the product statistics within the same transaction
+        apply_review_delta(session, db_review.product_id, db_review.rating, 1)
         
         # Commit the transaction to persist the changes
         session.commit()
+        invalidate(REVIEWS, product_tag(db_review.product_id))
         
         # Refresh the Review object to get the updated values from the database
         session.refresh(db_review)
@@ -36,9 +42,6 @@ def helper_create_review(session, product_data: reviews_schemas.CreateReview ):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while processing your request. \n most probably product with id {db_review.product_id} does not exist or user with id {db_review.user_id} does not exist."
         )
-    finally:
-        # Close the session
-        session.close()
 
     return db_review
 
@@ -59,29 +62,33 @@ def helper_review_update(session, id:int , review_update: reviews_schemas.Update
         # Query the review by ID
         review_query = session.query(Review).filter(Review.id == id)
 
-        # Get the review object
-        review = review_query.first()
+        # Get the review object, locked so a concurrent update can not count the old rating twice.
+        # The router already loaded it into this session, populate_existing refreshes it with the
+        # row read under the lock instead of returning the rating it saw before
+        review = review_query.populate_existing().with_for_update().first()
 
         # If the review does not exist, raise a 404 error
         if review is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Review with id {id} does not exist")
 
+        # Move the review from its old rating to the new one in the product statistics
+        if review.rating != review_update.rating:
+            apply_review_delta(session, review.product_id, review.rating, -1)
+            apply_review_delta(session, review.product_id, review_update.rating, 1)
+
         # Update the review with the new data
         review_query.update(review_update.model_dump(), synchronize_session=False)
 
         # Commit the changes to the database
         session.commit()
+        invalidate(REVIEWS, product_tag(review.product_id))
 
     except SQLAlchemyError as e:
         # Handle any database errors and rollback the session
         print(f"An error occurred: {e}")
         session.rollback()
 
-    finally:
-        # Close the session
-        session.close()
-
     # Return the updated review
     return review_query.first()
 
@@ -101,7 +108,8 @@ def helper_delete_product(session, id:int):
     try:
         # Query the database for the product with the given id
         product_query = session.query(Review).filter(Review.id == id)
-        product = product_query.first()
+        # Locked and read again, the rating loaded by the router may predate a concurrent update
+        product = product_query.populate_existing().with_for_update().first()
 
         if product is None:
             # If the product does not exist, raise an HTTPException
@@ -109,20 +117,20 @@ def helper_delete_product(session, id:int):
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Product with id {id} does not exist"
             )
+
+        # Remove the review from the product statistics within the same transaction
+        apply_review_delta(session, product.product_id, product.rating, -1)
         
         # Delete the product from the database
         product_query.delete(synchronize_session=False)
         session.commit()
+        invalidate(REVIEWS, product_tag(product.product_id))
     
     except SQLAlchemyError as e:
         # Handle any SQLAlchemy errors and rollback the transaction
         print(f"An error occurred: {e}")
         session.rollback()
 
-    finally:
-        # Close the session
-        session.close()
-    
     # Return a response with status code 204
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
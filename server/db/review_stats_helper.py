@@ -0,0 +1,115 @@
+from sqlalchemy import case, cast, func, select, Numeric
+from sqlalchemy.dialects.postgresql import insert
+from server.models.models import ProductReviewStats, Review
+
+# Ratings counted in the per star histogram
+STARS = (1, 2, 3, 4, 5)
+
+
+def apply_review_delta(session, product_id: int, rating: int, count: int):
+    """
+    Add (count = 1) or remove (count = -1) one review from the statistics of a product.
+
+    The statistics are changed with a single upsert that adds the delta to the stored
+    values, so concurrent reviews of the same product never lose an update. It runs in
+    the transaction of the review write and is committed (or rolled back) with it.
+
+    Args:
+        session: SQLAlchemy session object.
+        product_id (int): The ID of the reviewed product.
+        rating (int): The rating of the review.
+        count (int): 1 when the review is added, -1 when it is removed.
+    """
+    if product_id is None:
+        return
+
+    rating = rating or 0
+    values = {
+        "product_id": product_id,
+        "num_reviews": count,
+        "rating_sum": rating * count,
+        # Only used when this is the first review of the product
+        "avg_rating": rating if count > 0 else None,
+    }
+    for star in STARS:
+        values[f"rating_{star}"] = count if rating == star else 0
+
+    statement = insert(ProductReviewStats).values(**values)
+    stats = ProductReviewStats.__table__.c
+    num_reviews = stats.num_reviews + statement.excluded.num_reviews
+    rating_sum = stats.rating_sum + statement.excluded.rating_sum
+
+    update = {
+        "num_reviews": num_reviews,
+        "rating_sum": rating_sum,
+        "avg_rating": cast(rating_sum, Numeric) / func.nullif(num_reviews, 0),
+        "updated_at": func.now(),
+    }
+    for star in STARS:
+        update[f"rating_{star}"] = stats[f"rating_{star}"] + statement.excluded[f"rating_{star}"]
+    session.execute(statement.on_conflict_do_update(index_elements=["product_id"], set_=update))
+
+    # Products whose last review was removed keep no statistics, like after rebuild_review_stats
+    if count < 0:
+        session.execute(
+            ProductReviewStats.__table__.delete().where(
+                ProductReviewStats.product_id == product_id,
+                ProductReviewStats.num_reviews <= 0,
+            )
+        )
+
+
+def rebuild_review_stats(session, product_ids: list = None):
+    """
+    Recompute the review statistics from the reviews table.
+    Used to backfill the table and to repair it if it ever drifts from the reviews.
+
+    Args:
+        session: SQLAlchemy session object.
+        product_ids (list): Only repair these products, None for all of them.
+
+    Returns:
+        int: The number of products with reviews.
+    """
+    columns = [
+        Review.product_id,
+        func.count(Review.id).label("num_reviews"),
+        func.coalesce(func.sum(Review.rating), 0).label("rating_sum"),
+        func.avg(Review.rating, type_=Numeric).label("avg_rating"),
+    ]
+    for star in STARS:
+        columns.append(func.count(case((Review.rating == star, 1))).label(f"rating_{star}"))
+
+    aggregated = select(*columns).filter(Review.product_id.isnot(None)).group_by(Review.product_id)
+    if product_ids is not None:
+        aggregated = aggregated.filter(Review.product_id.in_(product_ids))
+
+    names = ["product_id", "num_reviews", "rating_sum", "avg_rating"] + [f"rating_{star}" for star in STARS]
+    statement = insert(ProductReviewStats).from_select(names, aggregated)
+    statement = statement.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={**{name: statement.excluded[name] for name in names[1:]}, "updated_at": func.now()},
+    )
+
+    # Products whose reviews are all gone keep no statistics
+    stale = ProductReviewStats.__table__.delete().where(
+        ~ProductReviewStats.product_id.in_(select(Review.product_id).filter(Review.product_id.isnot(None)))
+    )
+    if product_ids is not None:
+        stale = stale.where(ProductReviewStats.product_id.in_(product_ids))
+
+    session.execute(statement)
+    session.execute(stale)
+    session.commit()
+    return session.query(func.count(ProductReviewStats.product_id)).scalar()
+
+
+if __name__ == "__main__":
+    # Backfill / repair: python -m server.db.review_stats_helper
+    from server.db.db import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Review statistics rebuilt for {rebuild_review_stats(session)} products")
+    finally:
+        session.close()
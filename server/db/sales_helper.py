@@ -1,7 +1,44 @@
 from fastapi import status,HTTPException, Response
-from server.models.models import Sales
+from server.models.models import Product, Sales
+from sqlalchemy import func, select, update
 from sqlalchemy.exc import SQLAlchemyError
 from server.schemas import sales_schemas
+from server.utils.response_cache import invalidate, product_tag, SALES
+
+
+def refresh_product_discount(session, product_id: int):
+    """
+    Store the discount of the latest sale of a product and the price after it on the product.
+
+    The product row is locked first, so concurrent sale writes of the same product are applied
+    one after the other and the last one always sees every committed sale.
+    Runs in the transaction of the caller, which commits it.
+
+    Args:
+    - product_id: ID of the product whose sales changed.
+    """
+    if product_id is None:
+        return
+
+    session.execute(select(Product.id).filter(Product.id == product_id).with_for_update())
+
+    # Latest sale first, the id breaks ties between sales created at the same time
+    latest_discount = (
+        select(Sales.discount_percent)
+        .filter(Sales.product_id == product_id)
+        .order_by(Sales.sale_date.desc(), Sales.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(
+            current_discount_percent=latest_discount,
+            effective_price=Product.price * (1 - func.coalesce(latest_discount, 0) / 100),
+        )
+        .execution_options(synchronize_session=False)
+    )
 
 
 
@@ -21,9 +58,14 @@ def helper_create_product_sales(session ,product_sales: sales_schemas.ProductSal
 
         # Add the new_product_sales to the session
         session.add(new_product_sales)
+        session.flush()
+
+        # The new sale is the latest one of its product
+        refresh_product_discount(session, new_product_sales.product_id)
 
         # Commit the changes to the database
         session.commit()
+        invalidate(SALES, product_tag(new_product_sales.product_id))
 
         # Refresh the new_product_sales with the latest data from the database
         session.refresh(new_product_sales)
@@ -38,10 +80,7 @@ def helper_create_product_sales(session ,product_sales: sales_schemas.ProductSal
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
     )
-    finally:
-        # Close the session
-        session.close()
-    
+
     # Return the newly created product cart
     return new_product_sales
 
@@ -63,8 +102,12 @@ def helper_update_product_sales(session, id: int, product_sales_update: sales_sc
         # Update the product sales with the data from the product_sales_update model
         product_sales.discount_percent = product_sales_update.discount_percent
 
+        session.flush()
+        refresh_product_discount(session, product_sales.product_id)
+
         # Commit the changes to the database
         session.commit()
+        invalidate(SALES, product_tag(product_sales.product_id))
 
         # Refresh the product sales with the latest data from the database
         session.refresh(product_sales)
@@ -79,9 +122,6 @@ def helper_update_product_sales(session, id: int, product_sales_update: sales_sc
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
 
     # Return the updated product sales
     return product_sales
@@ -103,8 +143,12 @@ def helper_delete_product_sales(session, id: int):
         # Delete the product sales
         session.delete(product_sales)
 
+        session.flush()
+        refresh_product_discount(session, product_sales.product_id)
+
         # Commit the changes to the database
         session.commit()
+        invalidate(SALES, product_tag(product_sales.product_id))
 
     except SQLAlchemyError as e:
         # Print the error message
@@ -113,9 +157,5 @@ def helper_delete_product_sales(session, id: int):
         # Rollback the transaction
         session.rollback()
 
-    finally:
-        # Close the session
-        session.close()
-
     # Return the deleted product sales
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
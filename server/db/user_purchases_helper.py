@@ -1,5 +1,5 @@
 from fastapi import status,HTTPException, Response
-from server.models.models import UserPurchase, Product, ProductImage
+from server.models.models import UserPurchase, Product
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 from server.schemas import user_purchases_schemas
@@ -38,12 +38,7 @@ def helper_create_user_purchase(session,user_purchase: user_purchases_schemas.Us
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Foreign key constraint violation or other unprocessable entity error",
         )
-    finally:
-        # Close the session
-        session.close()
-    
-        session.rollback()
-        
+
     return new_user_purchase
 
 def helper_update_user_purchase(session, id: int, user_purchase_update: user_purchases_schemas.UserPurchasesUpdate):
@@ -81,9 +76,6 @@ def helper_update_user_purchase(session, id: int, user_purchase_update: user_pur
 
         # Rollback the transaction
         session.rollback()
-    finally:
-        # Close the session
-        session.close()
 
     return user_purchase_query.first()
 
@@ -121,9 +113,6 @@ def helper_delete_user_purchase(session, id: int):
 
         # Rollback the transaction
         session.rollback()
-    finally:
-        # Close the session
-        session.close()
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -139,11 +128,10 @@ def helper_get_all_user_purchases(session, UserId:int):
         A list of all user purchases.
     """
     try:
-        # Query the carts, join with the Product and ProductImage tables
+        # Query the carts, join with the Product table (its images are loaded by the joinedload)
         userPurchase = (
             session.query(UserPurchase)
             .join(Product, UserPurchase.product_id == Product.id)
-            .outerjoin(ProductImage, ProductImage.product_id == Product.id)
             .filter(UserPurchase.user_id == UserId)
             .options(
                 joinedload(UserPurchase.product)  # Use joinedload to eagerly load the associated Product
@@ -162,10 +150,6 @@ def helper_get_all_user_purchases(session, UserId:int):
         print(f"An error occurred: {e}")
         session.rollback()  # Rollback the transaction
 
-    finally:
-        # Close the session
-        session.close()
-
     return userPurchase
 
 
@@ -184,11 +168,10 @@ def helper_get_all_user_purchases_for_given_number(session, startindex: int, num
        # this function does not retrun given numbers of user purchases 
 
     try:
-        # Query the carts, join with the Product and ProductImage tables
+        # Query the carts, join with the Product table (its images are loaded by the joinedload)
         user_purchases = (
             session.query(UserPurchase)
             .join(Product, UserPurchase.product_id == Product.id)
-            .outerjoin(ProductImage, ProductImage.product_id == Product.id)
             .options(
                 joinedload(UserPurchase.product)  # Use joinedload to eagerly load the associated Product
                 .joinedload(Product.images)  # Use joinedload to eagerly load the associated ProductImage
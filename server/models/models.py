@@ -1,5 +1,6 @@
-from sqlalchemy import  Column, Integer, String, ForeignKey, Float
+from sqlalchemy import  Column, Integer, String, ForeignKey, Float, Numeric, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from server.db.db import Base
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -20,6 +21,8 @@ class User(Base):
     shipping_address = Column(String,nullable=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
+    # Stamped into the access and refresh tokens, bumping it revokes every token issued before
+    token_version = Column(Integer, nullable=False, default=0, server_default=text('0'))
     
     
     # Establishing relationships
@@ -29,6 +32,12 @@ class User(Base):
     favorite_items = relationship("Favorite", back_populates="user")
     purchases = relationship("UserPurchase", back_populates="user")  # Added this line
     tokens = relationship("Token", back_populates="user")
+
+    __table_args__ = (
+        # Login and registration look the user up by email, an email belongs to one user
+        Index('ix_users_email', 'email', unique=True),
+        Index('ix_users_username', 'username'),
+    )
         
     
 class Token(Base):
@@ -39,6 +48,8 @@ class Token(Base):
     token = Column(String, index=True, unique=True, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
+    # Expiry of the JWT, the row is deleted by the pruning of the blacklist once it is reached
+    expires_at = Column(TIMESTAMP(timezone=True), index=True, nullable=False)
 
     # Add the relationship with the User model
     user = relationship("User", back_populates="tokens")
@@ -57,6 +68,18 @@ class ProductCategory(Base):
     # Corrected relationship with Product
     products = relationship("Product", back_populates="category")
 
+    __table_args__ = (
+        # Serves the fuzzy (typo tolerant) product search
+        Index(
+            'ix_product_categories_category_name_trgm',
+            'category_name',
+            postgresql_using='gin',
+            postgresql_ops={'category_name': 'gin_trgm_ops'},
+        ),
+        # The child categories of a category
+        Index('ix_product_categories_parent_category_id', 'parent_category_id'),
+    )
+
 
 class Product(Base):
     __tablename__ = 'products'
@@ -71,6 +94,11 @@ class Product(Base):
     product_color = Column(String, nullable=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
     category_id = Column(Integer, ForeignKey('product_categories.id',ondelete="SET NULL"))
+    # Discount of the latest sale and the price after it, kept up to date by sales_helper
+    current_discount_percent = Column(Float, nullable=True)
+    effective_price = Column(Float, nullable=True)
+    # Weighted full text document (name A, category B, description C), maintained by a database trigger
+    search_vector = Column(TSVECTOR, nullable=True)
     
     # Establishing relationships
     category = relationship("ProductCategory", back_populates="products")
@@ -86,6 +114,35 @@ class Product(Base):
     banner = relationship("Banner", back_populates="product", uselist=False)
     # purchases = relationship("User", secondary="user_purchases", back_populates="purchases")  # Uncommented this line    
 
+    __table_args__ = (
+        # Serves the full text product search
+        Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        # Serve the fuzzy (typo tolerant) product search
+        Index(
+            'ix_products_product_name_trgm',
+            'product_name',
+            postgresql_using='gin',
+            postgresql_ops={'product_name': 'gin_trgm_ops'},
+        ),
+        # Serves the category listings (in id order) and the products of the categories a search matched
+        Index('ix_products_category_listing', 'category_id', 'id'),
+        # Serves the newest products and the listings sorted by newest
+        Index('ix_products_newest', text('created_at DESC'), text('id DESC')),
+        # Serve the price range filters and the listings sorted by price
+        Index('ix_products_price', 'price'),
+        Index('ix_products_price_asc', text('coalesce(price, 0)'), 'id'),
+        Index('ix_products_price_desc', text('coalesce(price, 0) DESC'), 'id'),
+        # Serves the listings sorted by effective price
+        Index('ix_products_effective_price', text('coalesce(effective_price, 0)'), 'id'),
+        # Serves the "on sale" listings
+        Index(
+            'ix_products_on_sale',
+            text('coalesce(effective_price, 0)'),
+            'id',
+            postgresql_where=text('current_discount_percent > 0'),
+        ),
+    )
+
 
 class Banner(Base):
     __tablename__ = 'banners'
@@ -108,6 +165,18 @@ class Sales(Base):
     product_id = Column(Integer, ForeignKey('products.id', ondelete="SET NULL"))
     product = relationship("Product", back_populates="sale", uselist=False)  # Added this line
 
+    __table_args__ = (
+        # Finds the latest sale of a product when its current discount is refreshed
+        Index('ix_sales_product_latest', 'product_id', text('sale_date DESC'), text('id DESC')),
+        # Serves the products with the latest discounts
+        Index(
+            'ix_sales_latest_discount',
+            text('sale_date DESC'),
+            postgresql_include=['product_id'],
+            postgresql_where=text('discount_percent IS NOT NULL'),
+        ),
+    )
+
 
 class ProductImage(Base):
     __tablename__ = 'product_images'
@@ -117,6 +186,11 @@ class ProductImage(Base):
     # Establishing relationship with Product
     product = relationship("Product", back_populates="images") 
 
+    __table_args__ = (
+        # The listings aggregate the images of every product of the page
+        Index('ix_product_images_product_id', 'product_id', 'id'),
+    )
+
 
 
 class Review(Base):
@@ -132,6 +206,41 @@ class Review(Base):
     product = relationship("Product", back_populates="reviews")
     user = relationship("User", back_populates="reviews")
 
+    __table_args__ = (
+        # The reviews of a product, the rating is included so the review stats aggregate from the index alone
+        Index('ix_reviews_product_id', 'product_id', postgresql_include=['rating']),
+        Index('ix_reviews_user_id', 'user_id'),
+    )
+
+
+class ProductReviewStats(Base):
+    """
+    Review statistics of a product, kept up to date by review_helper on every review write
+    so listings read them instead of aggregating the reviews table.
+    """
+    __tablename__ = 'product_review_stats'
+    product_id = Column(Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    num_reviews = Column(Integer, nullable=False, server_default=text('0'))
+    rating_sum = Column(Integer, nullable=False, server_default=text('0'))
+    avg_rating = Column(Numeric, nullable=True)
+    # Number of reviews per star
+    rating_1 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_2 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_3 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_4 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_5 = Column(Integer, nullable=False, server_default=text('0'))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+
+    __table_args__ = (
+        # Serves the top rated listing (best average first, most reviewed on ties)
+        Index(
+            'ix_product_review_stats_top_rated',
+            text('coalesce(avg_rating, 0) DESC'),
+            text('coalesce(num_reviews, 0) DESC'),
+            'product_id',
+        ),
+    )
+
 
 class Cart(Base):
     __tablename__ = 'carts'
@@ -145,6 +254,11 @@ class Cart(Base):
     user = relationship("User", back_populates="cart_items")
     product = relationship("Product", back_populates="carts")
 
+    __table_args__ = (
+        # The cart of a user
+        Index('ix_carts_user_id', 'user_id'),
+    )
+
 
 class Favorite(Base):
     __tablename__ = 'favorites'
@@ -157,6 +271,11 @@ class Favorite(Base):
     user = relationship("User", back_populates="favorite_items")
     product = relationship("Product", back_populates="favorites")
 
+    __table_args__ = (
+        # The favorites of a user
+        Index('ix_favorites_user_id', 'user_id'),
+    )
+
  
 class UserPurchase(Base):
     __tablename__ = 'user_purchases'
@@ -170,6 +289,12 @@ class UserPurchase(Base):
     user = relationship("User", back_populates="purchases")
     product = relationship("Product", back_populates="purchases")
 
+    __table_args__ = (
+        # The purchases of a user and the purchases of a product
+        Index('ix_user_purchases_user_id', 'user_id'),
+        Index('ix_user_purchases_product_id', 'product_id'),
+    )
+
 
 class FeaturedProduct(Base):
     __tablename__ = "featured_products"
@@ -179,3 +304,28 @@ class FeaturedProduct(Base):
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
 
     product = relationship("Product", back_populates="featured_product")
+
+
+class OutboundEmail(Base):
+    """
+    Emails waiting in the outbox, sent by the background sender of email_outbox.
+    Rows are deleted once their email is sent, the ones that failed EMAIL_OUTBOX_MAX_ATTEMPTS times are kept as failed.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    # pending or failed
+    status = Column(String, nullable=False, server_default=text("'pending'"))
+    attempts = Column(Integer, nullable=False, server_default=text('0'))
+    # The sender claims a row by moving it forward, a sender that died releases it when it is reached
+    next_attempt_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    last_error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+
+    __table_args__ = (
+        # Serves the claims of the sender, only pending rows are indexed
+        Index('ix_email_outbox_pending', 'next_attempt_at', postgresql_where=text("status = 'pending'")),
+    )
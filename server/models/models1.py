@@ -1,6 +0,0 @@
-from server.db.db import Base, engine, db
-
-Base.metadata.create_all(engine)
-
-
-session = db  
\ No newline at end of file
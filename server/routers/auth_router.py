@@ -1,5 +1,7 @@
 from fastapi import APIRouter, status, HTTPException, Depends
-from server.models.models1 import session as db
+from server.db.db import get_async_db
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.models.models import User
 from server.utils import hash_helper, oauth2
 from server.schemas import token_schemas
@@ -12,7 +14,7 @@ router = APIRouter(tags=['Authentication'])
 
 
 @router.post('/login', response_model=token_schemas.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends()):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_db)):
     """
     Endpoint for user login.
 
@@ -26,26 +28,36 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends()):
         HTTPException: If user is not found or credentials are invalid.
         ValueError: If there is an error validating the token data.
     """
+    # Refused right away while the password process pool is saturated (e.g. a credential stuffing burst)
+    hash_helper.refuse_when_busy()
+
     try:
         # Query the database to find the user with the given email
-        user = db.query(User).filter(User.email == user_credentials.username).first()
+        user = (await session.execute(select(User).filter(User.email == user_credentials.username))).scalars().first()
 
         # If user is not found, raise an HTTPException with a 403 status code and an error message
         if not user:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials")
 
-        if not hash_helper.verify(user_credentials.password, user.password):
+        # bcrypt runs in the password process pool, the event loop keeps serving the other requests
+        valid, new_hash = await hash_helper.run_async(hash_helper.verify_and_update, user_credentials.password, user.password)
+        if not valid:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials")
 
+        # The hash used another cost than BCRYPT_ROUNDS, store the new one
+        if new_hash is not None:
+            user.password = new_hash
+            await session.commit()
+
         # Generate an access token using the oauth2 library, passing the user_id as data
-        access_token = oauth2.create_access_token(data={"user_id": user.id, "role": user.role})
+        access_token = oauth2.create_access_token(data={"user_id": user.id, "role": user.role, "ver": user.token_version})
         # Generate an Refresh token using the oauth2 library, passing the user_id as data
-        refresh_token = oauth2.create_refresh_token(data={"user_id": user.id, "role": user.role})
+        refresh_token = oauth2.create_refresh_token(data={"user_id": user.id, "role": user.role, "ver": user.token_version})
 
     except SQLAlchemyError as e:
         # Handle the exception
         print(e)
-        db.rollback()
+        await session.rollback()
 
     if access_token is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to generate access token")
@@ -104,11 +116,40 @@ async def refresh_token(refresh_token: str = Depends(oauth2.oauth2_scheme)):
     
     except (JWTError, ValidationError):
         raise credentials_exception
+
+    # Refresh tokens issued before a logout or a password reset are revoked with the access tokens
+    token_version = payload.get("ver", 0)
+    user = await oauth2.get_user_record(int(user_id))
+    if user is None or token_version != user.token_version:
+        raise credentials_exception
     
-    # Create a new access token
-    new_access_token = oauth2.create_access_token(data={"user_id": int(user_id), "role": role})
+    # Create a new access token, with the current role of the user
+    new_access_token = oauth2.create_access_token(data={"user_id": int(user_id), "role": user.role, "ver": token_version})
     
     # Return the new access token and token type
     return {"access_token": new_access_token, "token_type": "bearer"}
     
-    
\ No newline at end of file
+    
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(current_user: token_schemas.Principal = Depends(oauth2.get_current_principal), session: AsyncSession = Depends(get_async_db)):
+    """
+    Revokes every access and refresh token of the current user, on every device.
+
+    Parameters:
+        current_user (token_schemas.Principal): The caller of the request.
+
+    Raises:
+        HTTPException: If there is an error updating the user.
+    """
+    try:
+        await session.execute(
+            update(User).where(User.id == current_user.id).values(token_version=User.token_version + 1)
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    # Tokens of the previous version are refused by every worker from now on
+    await oauth2.forget_user_async(current_user.id)
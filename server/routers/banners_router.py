@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends, HTTPException, Request
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import banners_schemas
 from server.db import banner_helper
 from typing import List
@@ -8,18 +9,21 @@ from server.utils import oauth2
 from server.db.fliter_product_with_reviews_helper import get_product_details_query
 from sqlalchemy.exc import SQLAlchemyError
 from server.utils.rate_limit import rate_limited
+from server.utils.serialization import TypedResponseRoute
+from server.utils.response_cache import cached_response, BANNERS
 
 
-router = APIRouter(prefix="/banner", tags=["Banner CRUD"])
+router = APIRouter(prefix="/banner", tags=["Banner CRUD"], route_class=TypedResponseRoute)
 
 @router.post(
     "/create",
     status_code=status.HTTP_201_CREATED,
     response_model=banners_schemas.BannerCreateResponse,
 )
-async def create_banner(
+def create_banner(
     banner: banners_schemas.CreateBanner = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create a new banner.
@@ -44,16 +48,17 @@ async def create_banner(
 
 
 @router.delete("/delete/{banner_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_banner(
+def delete_banner(
     banner_id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Deletes a banner by ID.
 
     Parameters:
         - `banner_id` (int): The ID of the banner to be deleted.
-        - `current_user` (int, optional): The ID of the current user. Defaults to `Depends(oauth2.get_current_user)`.
+        - `current_user` (int, optional): The ID of the current user. Defaults to `Depends(oauth2.get_current_principal)`.
 
     Raises:
         - `HTTPException`: If the current user does not have admin role.
@@ -79,9 +84,11 @@ async def delete_banner(
             status_code= status.HTTP_200_OK,
             response_model=List[banners_schemas.BannerGetAllResponse])
 @rate_limited(max_calls=10, time_frame=60) 
-async def get_all_banners(
+@cached_response(tags=(BANNERS,))
+def get_all_banners(
     request: Request,
-    number: int, 
+    number: int,
+    session: Session = Depends(get_db), 
     ):
     """
     Retrieve all banners and their details.
@@ -1,22 +1,25 @@
 from fastapi import Body, status, Depends, HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import cart_schemas
 from server.db import cart_helper
 from typing import List
 from server.models.models import Cart
 from server.utils import oauth2
 from sqlalchemy.exc import SQLAlchemyError
-router = APIRouter(prefix="/cart", tags=["Product Cart CRUD"])
+from server.utils.serialization import TypedResponseRoute
+router = APIRouter(prefix="/cart", tags=["Product Cart CRUD"], route_class=TypedResponseRoute)
 
 @router.post(
     "/create",
     status_code=status.HTTP_201_CREATED,
     response_model=cart_schemas.ProductCartCreateResponse,
 )
-async def create_product_cart(
+def create_product_cart(
     sub_product_cart: cart_schemas.SubProductCartCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Creates a new product cart.
@@ -72,10 +75,11 @@ async def create_product_cart(
     status_code=status.HTTP_201_CREATED,
     response_model=cart_schemas.ProductCartUpdateResponse,
 )
-async def product_cart_update(
+def product_cart_update(
     id: int,
     product_cart_update: cart_schemas.ProductCartUpdate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Update a product cart by ID.
@@ -118,8 +122,9 @@ async def product_cart_update(
 
 
 @router.delete("/remove-all", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_cart(
-    current_user: int = Depends(oauth2.get_current_user),
+def delete_product_cart(
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete all products from the user's cart.
@@ -138,9 +143,10 @@ async def delete_product_cart(
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_cart(
+def delete_product_cart(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a product cart by ID.
@@ -189,8 +195,9 @@ async def delete_product_cart(
     status_code=status.HTTP_200_OK,
     response_model=List[cart_schemas.ProductCartGetResponse]
 )
-async def get_all_product_cart(
-    current_user: int = Depends(oauth2.get_current_user)
+def get_all_product_cart(
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Get all products in the cart for a given user.
@@ -1,22 +1,25 @@
 from fastapi import Body, status,Depends, HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import favorites_schemas
 from server.db import  favorites_helper
 from server.utils import oauth2
 from typing import List
 from server.models.models import Favorite as Favorites
 from sqlalchemy.exc import SQLAlchemyError
+from server.utils.serialization import TypedResponseRoute
 
-router = APIRouter(prefix="/favorites", tags=["Product favorite CRUD"])
+router = APIRouter(prefix="/favorites", tags=["Product favorite CRUD"], route_class=TypedResponseRoute)
 @router.post(
     "/create",
     status_code=status.HTTP_201_CREATED,
     response_model=favorites_schemas.ProductFavoriteCreateResponse
 )
-async def create_product_favorite(
+def create_product_favorite(
     sub_product_favorite: favorites_schemas.ProductFavoriteSubCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Creates a new product favorite.
@@ -52,8 +55,9 @@ async def create_product_favorite(
 
 
 @router.delete("/delete-all", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_favorite(
-    current_user: int = Depends(oauth2.get_current_user),
+def delete_product_favorite(
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete all product favorites for the current user.
@@ -74,16 +78,17 @@ async def delete_product_favorite(
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_favorite(
+def delete_product_favorite(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a product favorite by ID.
 
     Args:
         id (int): ID of the product favorite to be deleted.
-        current_user (int, optional): ID of the current user. Defaults to Depends(oauth2.get_current_user).
+        current_user (int, optional): ID of the current user. Defaults to Depends(oauth2.get_current_principal).
 
     Raises:
         HTTPException: If the current user is not authorized to perform the requested action.
@@ -120,7 +125,7 @@ async def delete_product_favorite(
 @router.get("/get-all",status_code=status.HTTP_200_OK,
             response_model=List[favorites_schemas.ProductFavoriteGetAll]
             )
-async def get_all_product_favorite(current_user: int = Depends(oauth2.get_current_user)):
+def get_all_product_favorite(current_user: int = Depends(oauth2.get_current_principal), session: Session = Depends(get_db)):
     """
     Get all product favorites for the current user.
     
@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends, HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import featured_products_schemas
 from server.db import featured_helper
 from server.utils import oauth2
@@ -10,9 +11,10 @@ router = APIRouter(prefix="/featured", tags=["featured Product CRUD"])
              status_code=status.HTTP_201_CREATED,
              response_model=featured_products_schemas.FeaturedProductCreateResponse
              )
-async def create_featured_product(
+def create_featured_product(
     featured_product: featured_products_schemas.FeaturedProductCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Creates a new featured product.
@@ -37,9 +39,10 @@ async def create_featured_product(
     return data
 
 @router.delete("/delete/{featured_product_id}")
-async def delete_featured_product(
+def delete_featured_product(
     featured_product_id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
     ):
     """
     Deletes a featured product.
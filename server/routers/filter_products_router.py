@@ -1,15 +1,22 @@
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db import fliter_product_with_reviews_helper
 from server.utils import helper_for_getting_data
-from typing import List
-from fastapi import  status, HTTPException, Request
+from typing import List, Optional
+from fastapi import  status, HTTPException, Request, Depends, Query
 from server.schemas import filter_products_schemas
 from sqlalchemy.exc import SQLAlchemyError
 from server.utils.rate_limit import rate_limited
+from server.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from server.utils.search_engine import SEARCH_BACKEND
+from server.utils import suggest_index, catalog_snapshot
+from server.utils.listing_documents import LISTING_DOCUMENTS_ENABLED
+from server.utils.serialization import TypedResponseRoute
+from server.utils.response_cache import cached_response, listing_tags, PRODUCTS, FEATURED, SALES
 
 
-router = APIRouter(prefix="/productfilter", tags=["------------------------neutral Auth ----------------------Filters for Product Endpoints"])
+router = APIRouter(prefix="/productfilter", tags=["------------------------neutral Auth ----------------------Filters for Product Endpoints"], route_class=TypedResponseRoute)
 
 
 @router.get("/getbyname/{search_keyword}/{number}/{startindex}", 
@@ -17,7 +24,7 @@ router = APIRouter(prefix="/productfilter", tags=["------------------------neutr
             response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_by_name(request: Request, search_keyword: str, number: int, startindex: int):
+async def get_product_by_name(request: Request, search_keyword: str, number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get multiple products with their images based on the provided product name.
 
@@ -29,9 +36,18 @@ async def get_product_by_name(request: Request, search_keyword: str, number: int
     Returns:
         dict: A dictionary containing the products and their images.
     """
-    query = fliter_product_with_reviews_helper.get_products_with_images_and_reviews(search_keyword=search_keyword, number=number, startindex=startindex)
-
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if SEARCH_BACKEND == "memory":
+        data = await helper_for_getting_data.helper_for_search_engine_results(session=session, search_keyword=search_keyword, startindex=startindex, number=number)
+    else:
+        query = fliter_product_with_reviews_helper.get_products_with_images_and_reviews(search_keyword=search_keyword, number=number, startindex=startindex)
+        if LISTING_DOCUMENTS_ENABLED:
+            data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+        else:
+            data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+
+    # Searches that found products count towards the popular search suggestions
+    if startindex == 0:
+        suggest_index.record_search(search_keyword)
     return data
 
 
@@ -40,7 +56,8 @@ async def get_product_by_name(request: Request, search_keyword: str, number: int
             response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_up_to_given_number(request: Request,number: int, startindex: int):
+@cached_response(tags=(PRODUCTS,))
+async def get_product_up_to_given_number(request: Request,number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get a list of products with their images up to the specified number.
 
@@ -53,7 +70,10 @@ async def get_product_up_to_given_number(request: Request,number: int, startinde
     """
 
     query = fliter_product_with_reviews_helper.get_products(number=number, startindex=startindex)
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
     # return result
 
@@ -63,7 +83,8 @@ async def get_product_up_to_given_number(request: Request,number: int, startinde
             response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_by_category(request: Request,category_id: int, number: int, startindex: int):
+@cached_response(tags=(PRODUCTS,))
+async def get_product_by_category(request: Request,category_id: int, number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get multiple products with their images based on the provided category ID.
 
@@ -75,10 +96,17 @@ async def get_product_by_category(request: Request,category_id: int, number: int
     Returns:
     - A list of products with their images.
     """
+    # Picked from the catalog snapshot of this worker when it is enabled
+    if catalog_snapshot.answers("id", {"category_id": category_id}):
+        return await helper_for_getting_data.helper_for_snapshot_results(session=session, startindex=startindex, number=number, category_id=category_id)
+
     # Create the main query
     query = fliter_product_with_reviews_helper.get_product_by_category(category_id=category_id, number=number, startindex=startindex)
     # Get the data using the helper function
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
 
  # this function retruns 404 even if product  are in the database
@@ -88,7 +116,8 @@ async def get_product_by_category(request: Request,category_id: int, number: int
             response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_by_keyword(request: Request,category_id: int, search_keyword: str, number: int, startindex: int):
+@cached_response(tags=(PRODUCTS,))
+async def get_product_by_keyword(request: Request,category_id: int, search_keyword: str, number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Note: The search keyword is working product name 
     Get a list of products with their images based on the provided product category and search keyword.
@@ -106,7 +135,10 @@ async def get_product_by_keyword(request: Request,category_id: int, search_keywo
     query = fliter_product_with_reviews_helper.get_product_by_category_keyword(category_id=category_id, search_keyword=search_keyword, number=number, startindex=startindex)
 
     # Get the data using the helper function
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
 
 @router.get("/searchbyproductsize/{product_size}/{number}/{startindex}",
@@ -114,7 +146,8 @@ async def get_product_by_keyword(request: Request,category_id: int, search_keywo
             # response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_by_size(request: Request,product_size: str, number: int, startindex: int):
+@cached_response(tags=(PRODUCTS,))
+async def get_product_by_size(request: Request,product_size: str, number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get multiple products with their images based on the provided product size.
 
@@ -129,7 +162,7 @@ async def get_product_by_size(request: Request,product_size: str, number: int, s
     # Call the helper function to execute the query and return the result
     query = fliter_product_with_reviews_helper.search_product_by_productsize(product_size=product_size, number=number, startindex=startindex)
     # Get the data using the helper function
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
 
 
@@ -138,7 +171,8 @@ async def get_product_by_size(request: Request,product_size: str, number: int, s
             response_model=List[filter_products_schemas.FilterProductsProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def filter_by_price(request: Request, min_price: float, max_price: float, number: int, product_name: str, startindex: int):
+@cached_response(tags=(PRODUCTS,))
+async def filter_by_price(request: Request, min_price: float, max_price: float, number: int, product_name: str, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get multiple products with their images based on the provided price range and product name.
 
@@ -152,11 +186,19 @@ async def filter_by_price(request: Request, min_price: float, max_price: float,
     Returns:
     - A list of products with their images.
     """
+    # Picked from the catalog snapshot of this worker when it is enabled
+    filters = {"min_price": min_price, "max_price": max_price, "name_keyword": product_name}
+    if catalog_snapshot.answers("id", filters):
+        return await helper_for_getting_data.helper_for_snapshot_results(session=session, startindex=startindex, number=number, **filters)
+
     # Call the helper function to execute the query and return the result
     query = fliter_product_with_reviews_helper.filter_product_by_price(min_price=min_price, max_price=max_price, number=number, product_name=product_name, startindex=startindex)
 
     # Get the data using the helper function
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
 
 # Get featured products need responde model
@@ -165,7 +207,8 @@ async def filter_by_price(request: Request, min_price: float, max_price: float,
             response_model=List[filter_products_schemas.FeaturedProductUpToGivenNumberResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_featured_product_up_to_given_number(request: Request,number: int, startindex: int):
+@cached_response(tags=(PRODUCTS, FEATURED))
+async def get_featured_product_up_to_given_number(request: Request,number: int, startindex: int, session: AsyncSession = Depends(get_async_db)):
     """
     Note: This endpoint returns different data from the other endpoints.
     Get a list of products with their images up to the specified number.
@@ -181,7 +224,7 @@ async def get_featured_product_up_to_given_number(request: Request,number: int,
     query = fliter_product_with_reviews_helper.get_featured_products(number=number, startindex=startindex)
 
     # Get the data using the helper function
-    result =helper_for_getting_data.helper_get_featured_products(session= session, query=query)
+    result = await helper_for_getting_data.helper_get_featured_products(session= session, query=query)
     # result = session.execute(query).all()
     return result
 
@@ -191,7 +234,8 @@ async def get_featured_product_up_to_given_number(request: Request,number: int,
             response_model=List[filter_products_schemas.ProductForNewArrivalesResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def deal_of_the_day(request: Request, number: int):
+@cached_response(tags=(PRODUCTS, SALES))
+async def deal_of_the_day(request: Request, number: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get a list of products who has highest sales with their images up to the specified number.
 
@@ -203,14 +247,14 @@ async def deal_of_the_day(request: Request, number: int):
     - List of products with images.
     """
 
-    product_ids = fliter_product_with_reviews_helper.deal_of_the_day(session=session,number=number)
+    product_ids = await fliter_product_with_reviews_helper.deal_of_the_day(session=session,number=number)
     query = fliter_product_with_reviews_helper.get_product_details_query(product_ids)
 
     try:
         # Execute the query and retrieve the results
-        result = session.execute(query).all()
+        result = (await session.execute(query)).all()
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
     # Reverse the order of the results
@@ -224,7 +268,8 @@ async def deal_of_the_day(request: Request, number: int):
             response_model=List[filter_products_schemas.ProductForNewArrivalesResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def new_arrivales(request: Request, number: int):
+@cached_response(tags=(PRODUCTS,))
+async def new_arrivales(request: Request, number: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get a list of products with the highest sales up to the specified number.
 
@@ -236,19 +281,316 @@ async def new_arrivales(request: Request, number: int):
     """
 
     # Get the product ids of the new arrivals
-    product_ids = fliter_product_with_reviews_helper.new_arrivals(session=session, number=number)
+    product_ids = await fliter_product_with_reviews_helper.new_arrivals(session=session, number=number)
 
     # Generate the query to get the details of the products
     query = fliter_product_with_reviews_helper.get_product_details_query(product_ids)
 
     try:
         # Execute the query and retrieve the results
-        result = session.execute(query).all()
+        result = (await session.execute(query)).all()
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
     # Reverse the order of the results
     re = result[::-1]
 
     return re
+
+
+# Keyset (cursor) paginated listings, the {number}/{startindex} routes above are kept for compatibility
+
+@router.get("/getbyname/{search_keyword}",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.SearchProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+async def get_product_page_by_name(
+    request: Request,
+    search_keyword: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.SearchPageSort = "relevance",
+    fuzzy: bool = False,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products whose name, description or category matches the search keyword.
+
+    Parameters:
+    - search_keyword: The keyword to search for.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+    - fuzzy: Match misspelled keywords by trigram similarity of the product and category name.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    - did_you_mean: The closest product or category name when nothing was found.
+    """
+    # With SEARCH_BACKEND=memory the products are ranked by the in-memory BM25 index
+    if SEARCH_BACKEND == "memory" and sort == "relevance" and not fuzzy:
+        page = await helper_for_getting_data.helper_for_search_engine_page(session=session, limit=limit, cursor=cursor, search_keyword=search_keyword)
+    else:
+        page = await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, search_keyword=search_keyword, fuzzy=fuzzy, sort=sort)
+
+    # Searches that found products count towards the popular search suggestions
+    if cursor is None and page["items"]:
+        suggest_index.record_search(search_keyword)
+    return page
+
+
+@router.get("/facetedsearch",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FacetedProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), min_rating=params.get("min_rating")))
+async def get_faceted_product_page(
+    request: Request,
+    keyword: Optional[str] = None,
+    category_id: List[int] = Query(None),
+    product_size: List[str] = Query(None),
+    product_color: List[str] = Query(None),
+    target_audience: List[str] = Query(None),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = Query(None, ge=0, le=5),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: Optional[filter_products_schemas.SearchPageSort] = None,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products matching any combination of filters, with the number of products per
+    category, size, color, target audience and price bucket.
+
+    Parameters:
+    - keyword: Full text search over the product name, category name and description.
+    - category_id, product_size, product_color, target_audience: Keep the products with one of
+      the given values (repeat the parameter to select several).
+    - min_price, max_price: The price range (inclusive).
+    - min_rating: The lowest average rating.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products, by relevance for keyword searches and by id otherwise.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    - total, facets (first page only): The number of matching products and the counts per facet
+      value. Each facet is counted with every filter but its own, so the counts show what
+      selecting another value would give.
+    """
+    if sort is None:
+        sort = "relevance" if keyword is not None else "id"
+
+    return await helper_for_getting_data.helper_for_faceted_page(
+        session=session, limit=limit, cursor=cursor, sort=sort,
+        search_keyword=keyword, category_ids=category_id, sizes=product_size, colors=product_color,
+        audiences=target_audience, min_price=min_price, max_price=max_price, min_rating=min_rating,
+    )
+
+
+@router.get("/suggest",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.SuggestionsResponse
+            )
+@rate_limited(max_calls=120, time_frame=60)
+async def get_suggestions(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(suggest_index.MAX_SUGGESTIONS, ge=1, le=suggest_index.MAX_SUGGESTIONS),
+):
+    """
+    Autocomplete the search box while the user types.
+    Answered from the in-memory prefix index, the database is not queried.
+    No suggestions unless AUTOCOMPLETE_ENABLED is set.
+
+    Parameters:
+    - q: The text typed so far.
+    - limit: The number of suggestions (at most MAX_SUGGESTIONS).
+
+    Returns:
+    - The product names, category names and popular searches starting with q, most popular first.
+    """
+    return {"suggestions": suggest_index.suggest(q, limit)}
+
+
+@router.get("/getproducts",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FilterProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), params.get("on_sale", False)))
+async def get_product_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.ProductPageSort = "id",
+    on_sale: bool = False,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products with their images.
+
+    Parameters:
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+    - on_sale: Only products with a current discount.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, sort=sort, on_sale=on_sale)
+
+
+@router.get("/getbycategory/{category_id}",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FilterProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), params.get("on_sale", False)))
+async def get_product_page_by_category(
+    request: Request,
+    category_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.ProductPageSort = "id",
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products of the given category.
+
+    Parameters:
+    - category_id: The ID of the category.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, category_id=category_id, sort=sort)
+
+
+@router.get("/getbycategory_keyword/{category_id}/{search_keyword}",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.SearchProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), params.get("on_sale", False)))
+async def get_product_page_by_keyword(
+    request: Request,
+    category_id: int,
+    search_keyword: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.SearchPageSort = "relevance",
+    fuzzy: bool = False,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products of the given category whose name, description or category matches the search keyword.
+
+    Parameters:
+    - category_id: The ID of the product category.
+    - search_keyword: The search keyword to filter the products.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+    - fuzzy: Match misspelled keywords by trigram similarity of the product and category name.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    - did_you_mean: The closest product or category name when nothing was found.
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, category_id=category_id, search_keyword=search_keyword, fuzzy=fuzzy, sort=sort)
+
+
+@router.get("/searchbyproductsize/{product_size}",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FilterProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), params.get("on_sale", False)))
+async def get_product_page_by_size(
+    request: Request,
+    product_size: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.ProductPageSort = "id",
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products of the given size.
+
+    Parameters:
+    - product_size: The size of the product.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, product_size=product_size, sort=sort)
+
+
+@router.get("/filterbyprice/{min_price}/{max_price}/{product_name}",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FilterProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=lambda params: listing_tags(params.get("sort"), params.get("on_sale", False)))
+async def filter_page_by_price(
+    request: Request,
+    min_price: float,
+    max_price: float,
+    product_name: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: filter_products_schemas.ProductPageSort = "id",
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of products in the given price range whose name matches the product name.
+
+    Parameters:
+    - min_price: The minimum price of the product.
+    - max_price: The maximum price of the product.
+    - product_name: The name of the product.
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+    - sort: The order of the products.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, min_price=min_price, max_price=max_price, name_keyword=product_name, sort=sort)
+
+
+@router.get("/getfeaturedproducts",
+            status_code=status.HTTP_200_OK,
+            response_model=filter_products_schemas.FeaturedProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=(PRODUCTS, FEATURED))
+async def get_featured_product_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of featured products in the order they were featured.
+
+    Parameters:
+    - limit: The number of products on the page (at most MAX_PAGE_SIZE).
+    - cursor: The next_cursor of the previous page, omitted for the first page.
+
+    Returns:
+    - The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(session=session, limit=limit, cursor=cursor, featured_only=True, sort="featured")
@@ -1,13 +1,18 @@
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db import landing_page_helper 
-from server.utils import helper_for_getting_data
+from server.utils import helper_for_getting_data, catalog_snapshot
+from server.utils.listing_documents import LISTING_DOCUMENTS_ENABLED
 from server.utils.rate_limit import rate_limited
+from server.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from server.schemas import landing_page_schemas
-from typing import List
-from fastapi import  status, Request
+from typing import List, Optional
+from fastapi import  status, Request, Depends, Query
+from server.utils.serialization import TypedResponseRoute
+from server.utils.response_cache import cached_response, PRODUCTS, REVIEWS
 
-router = APIRouter(prefix="/landingpage", tags=["landing page Endpoints"])
+router = APIRouter(prefix="/landingpage", tags=["landing page Endpoints"], route_class=TypedResponseRoute)
 
 # Your endpoint function
 @router.get("/getrandomproducts/{number_of_products}",
@@ -15,7 +20,7 @@ router = APIRouter(prefix="/landingpage", tags=["landing page Endpoints"])
             response_model=List[landing_page_schemas.LandingPageProductCResponse]
           )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_random_products(request: Request, number_of_products: int):  # Reordered arguments
+async def get_random_products(request: Request, number_of_products: int, session: AsyncSession = Depends(get_async_db)):  # Reordered arguments
     """
     Get a random subset of products for the landing page.
     
@@ -29,7 +34,10 @@ async def get_random_products(request: Request, number_of_products: int):  # Reo
     print(number_of_products)
     query = landing_page_helper.get_random_products_helper(number_of_products=number_of_products)
 
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
 
 
@@ -40,7 +48,8 @@ async def get_random_products(request: Request, number_of_products: int):  # Reo
             response_model=List[landing_page_schemas.LandingPageUpToGivenNumberResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_trending_products_with_reviews(request: Request,number_of_products:int):
+@cached_response(tags=(PRODUCTS, REVIEWS), stale_while_revalidate=True)
+async def get_trending_products_with_reviews(request: Request,number_of_products:int, session: AsyncSession = Depends(get_async_db)):
     """
     Note: This endpoint returns different data from the other endpoints.
     and there is issue in this endpoint which is for some reason it just return one images object
@@ -54,7 +63,7 @@ async def get_trending_products_with_reviews(request: Request,number_of_products
     
     # data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     # return data
-    result = session.execute(query).all()
+    result = (await session.execute(query)).all()
     return result
 
 
@@ -63,7 +72,8 @@ async def get_trending_products_with_reviews(request: Request,number_of_products
             response_model=List[landing_page_schemas.LandingPageProductCResponse]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_top_rated_products(request: Request, number_of_products: int):
+@cached_response(tags=(PRODUCTS, REVIEWS), stale_while_revalidate=True)
+async def get_top_rated_products(request: Request, number_of_products: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get the top rated products.
 
@@ -73,9 +83,43 @@ async def get_top_rated_products(request: Request, number_of_products: int):
     Returns:
         data (List[dict]): A list of dictionaries representing the top rated products.
     """
+    # Picked from the catalog snapshot of this worker when it is enabled
+    if catalog_snapshot.answers("top_rated", {"min_reviews": 1}):
+        return await helper_for_getting_data.helper_for_snapshot_results(session=session, startindex=0, number=number_of_products, sort="top_rated", min_reviews=1)
+
     # Call the helper function to get the query for retrieving top rated products
     query = landing_page_helper.get_top_rated_products_helper(number_of_products=number_of_products)
     # result = session.execute(query).all()
     # return result
-    data = helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
+    if LISTING_DOCUMENTS_ENABLED:
+        data = await helper_for_getting_data.helper_for_listing_documents(session=session, query=query)
+    else:
+        data = await helper_for_getting_data.helper_for_filters_with_review_and_discount(session=session, query=query)
     return data
+
+
+@router.get("/gettopratedproducts",
+            status_code=status.HTTP_200_OK,
+            response_model=landing_page_schemas.LandingPageProductsPageResponse
+            )
+@rate_limited(max_calls=10, time_frame=60)
+@cached_response(tags=(PRODUCTS, REVIEWS), stale_while_revalidate=True)
+async def get_top_rated_products_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a page of the top rated products, paged with a cursor.
+
+    Args:
+        limit (int): The number of products on the page (at most MAX_PAGE_SIZE).
+        cursor (str): The next_cursor of the previous page, omitted for the first page.
+
+    Returns:
+        dict: The products of the page and the cursor of the next page (null on the last page).
+    """
+    return await helper_for_getting_data.helper_for_product_page(
+        session=session, limit=limit, cursor=cursor, sort="top_rated", min_reviews=1
+    )
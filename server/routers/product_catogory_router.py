@@ -1,23 +1,27 @@
 from fastapi import Body, status, Depends, HTTPException, Request
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import product_cat_schemas
 from server.db import product_cat_helper
 from typing import List
 from server.utils import oauth2
 from server.utils.rate_limit import rate_limited
+from server.utils.serialization import TypedResponseRoute
+from server.utils.response_cache import cached_response, CATEGORIES
 
 
-router = APIRouter(prefix="/product_cat", tags=["----------------------Required Admin Role------------------------ Product category CRUD"])
+router = APIRouter(prefix="/product_cat", tags=["----------------------Required Admin Role------------------------ Product category CRUD"], route_class=TypedResponseRoute)
 
 @router.post(
     "/create",
     status_code=status.HTTP_201_CREATED,
     response_model=product_cat_schemas.ProductCategoryCreateResponse,
 )
-async def create_product_category(
+def create_product_category(
     product_category: product_cat_schemas.ProductCategoryCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create a new product category.
@@ -48,9 +52,10 @@ async def create_product_category(
     status_code=status.HTTP_201_CREATED,
     response_model=List[product_cat_schemas.ProductCategoryCreateResponse],
 )
-async def create_product(
+def create_product(
     products_category: List[product_cat_schemas.ProductCategoryCreate] = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create multiple product categories and return the created categories.
@@ -89,9 +94,10 @@ async def create_product(
 
 # Delete a product category
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_category(
+def delete_product_category(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a product category by its ID.
@@ -126,10 +132,10 @@ async def delete_product_category(
 @router.put("/{id}", 
             status_code=status.HTTP_201_CREATED, 
             response_model=product_cat_schemas.ProductCategoryUpdateResponse)
-async def update_product_category(
+def update_product_category(
     id: int,
     productcat_update: product_cat_schemas.ProductCategoryUpdate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user)
+    current_user: int = Depends(oauth2.get_current_principal), session: Session = Depends(get_db)
 ):
     """
     Update a product category by ID.
@@ -162,7 +168,8 @@ async def update_product_category(
 @router.get("/all", 
             response_model=List[product_cat_schemas.ProductCategoryGetALLResponse])
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_category(request: Request):
+@cached_response(tags=(CATEGORIES,))
+def get_product_category(request: Request, session: Session = Depends(get_db)):
     """
     Get all product categories with their IDs and names.
 
@@ -178,7 +185,8 @@ async def get_product_category(request: Request):
 # Get a specific product category by ID
 @router.get("/{id}", response_model=product_cat_schemas.ProductCategoryGetResponse)
 @rate_limited(max_calls=10, time_frame=60)
-async def get_one_product_category(request: Request,id: int):
+@cached_response(tags=(CATEGORIES,))
+def get_one_product_category(request: Request,id: int, session: Session = Depends(get_db)):
     """
     Retrieve a specific product category by ID.
 
@@ -199,7 +207,8 @@ async def get_one_product_category(request: Request,id: int):
             response_model=list[product_cat_schemas.ProductCategoryWithSubCat]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_product_category_all(request: Request):
+@cached_response(tags=(CATEGORIES,))
+def get_product_category_all(request: Request, session: Session = Depends(get_db)):
     """
     Get all product categories with their sub-categories.
 
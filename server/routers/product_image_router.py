@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends, HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import product_image_schemas
 from server.db import product_image_helper
 from server.utils import oauth2
@@ -12,9 +13,10 @@ router = APIRouter(prefix="/Product Images", tags=["Product Images CRUD"])
              response_description="Product Image created successfully",
              response_model=product_image_schemas.ProductImageCreateResponse
              )
-async def create_product_image(
+def create_product_image(
     product_image: product_image_schemas.ProductImageCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
     ):
     """
     Create a new product image.
@@ -40,16 +42,17 @@ async def create_product_image(
     return data
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_image(
+def delete_product_image(
     id: int,
-    current_id = Depends(oauth2.get_current_user),
+    current_id = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
     ):
     """
     Delete a product image by its ID.
 
     Args:
         id (int): The ID of the product image to be deleted.
-        current_id (User): The current user object obtained from OAuth2 authentication.
+        current_id (token_schemas.Principal): The current user obtained from OAuth2 authentication.
 
     Raises:
         HTTPException: If the product image with the given ID does not exist.
@@ -70,8 +73,8 @@ async def delete_product_image(
     status_code=status.HTTP_201_CREATED,
     response_model=product_image_schemas.ProductImageUpdateResponse,
 )
-async def update_product_image(
-    id: int, product_image: product_image_schemas.ProductImageUpdate = Body(...), current_id=Depends(oauth2.get_current_user)
+def update_product_image(
+    id: int, product_image: product_image_schemas.ProductImageUpdate = Body(...), current_id=Depends(oauth2.get_current_principal), session: Session = Depends(get_db)
 ):
     """
     Update a product image in the database.
@@ -1,15 +1,19 @@
 from fastapi import Body, status, Depends, HTTPException, Request
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db, get_async_db
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.schemas import product_schemas
 from server.db import product_helper
 from typing import List
 from server.utils import oauth2
 from server.utils.rate_limit import rate_limited
+from server.utils.serialization import TypedResponseRoute
+from server.utils.response_cache import cached_response, product_tag
 
 
 
-router = APIRouter(prefix="/product", tags=["Product  CRUD"])
+router = APIRouter(prefix="/product", tags=["Product  CRUD"], route_class=TypedResponseRoute)
 
 
 @router.post(
@@ -17,9 +21,10 @@ router = APIRouter(prefix="/product", tags=["Product  CRUD"])
     status_code=status.HTTP_201_CREATED,
     response_model=product_schemas.ProductCreateResponse
 )
-async def create_product(
+def create_product(
     product_data: product_schemas.ProductCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create a new product along with associated images.
@@ -49,9 +54,10 @@ async def create_product(
     status_code=status.HTTP_201_CREATED,
     response_model=List[product_schemas.ProductCreateResponse]
 )
-async def create_product(
+def create_product(
     products_data: List[product_schemas.ProductCreate] = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create multiple products along with associated images.
@@ -84,9 +90,10 @@ async def create_product(
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product(
+def delete_product(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a product by ID.
@@ -118,10 +125,11 @@ async def delete_product(
             status_code=status.HTTP_201_CREATED,
             response_model=product_schemas.ProductUpadteResponse
             )
-async def update_product(
+def update_product(
     id: int,  # ID of the product to be updated.
     product_update: product_schemas.ProductUpadte = Body(...),  # Pydantic model containing updated data.
-    current_user: int = Depends(oauth2.get_current_user),  # Get the current user from OAuth2.
+    current_user: int = Depends(oauth2.get_current_principal),  # Get the current user from OAuth2.
+    session: Session = Depends(get_db),
 
     ):
     """
@@ -149,7 +157,8 @@ async def update_product(
             response_model=product_schemas.ProductGetResponseAdvance
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_one_product(request: Request,product_id: int):
+@cached_response(tags=lambda params: [product_tag(params["product_id"])])
+async def get_one_product(request: Request,product_id: int, session: AsyncSession = Depends(get_async_db)):
     """
     Get a single product with its images based on the provided product ID.
 
@@ -161,6 +170,6 @@ async def get_one_product(request: Request,product_id: int):
     """
     # Get the product with the given id but image it gets one image at a time and this issue needs to be fixed
     query= product_helper.get_product_by_id(product_id=product_id)
-    results = session.execute(query).first()
+    results = (await session.execute(query)).first()
     return results
     
@@ -1,8 +1,9 @@
 # Import necessary libraries
-from fastapi import  HTTPException, status, APIRouter, Body
+from fastapi import  HTTPException, status, APIRouter, Body, Depends
 from server.utils import oauth2
 # Assuming you have a user model
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.db import reset_password_helper
 from server.schemas import reset_password_schemas
 
@@ -11,7 +12,7 @@ router = APIRouter(prefix="/reset", tags=["For reseting password"])
 
 # Route to initiate password reset
 @router.post("/forget_password", response_model=dict)
-async def initiate_password_reset(data: reset_password_schemas.ResetPasswordRequest = Body(...)):
+def initiate_password_reset(data: reset_password_schemas.ResetPasswordRequest = Body(...), session: Session = Depends(get_db)):
     """
     Initiate a password reset for the given email.
     
@@ -32,7 +33,7 @@ async def initiate_password_reset(data: reset_password_schemas.ResetPasswordRequ
     # Generate a unique token and send it to the user's email
     token_data = {"sub": data.email}
     token = oauth2.create_access_token(token_data)
-    reset_password_helper.send_reset_email(data.email, token)
+    reset_password_helper.send_reset_email(data.email, token, session=session)
     
     return {"message": "Password reset initiated"}
 
@@ -41,7 +42,7 @@ async def initiate_password_reset(data: reset_password_schemas.ResetPasswordRequ
              response_model=dict,
              status_code=status.HTTP_201_CREATED
              )
-async def reset_password(data: reset_password_schemas.ResetPassword = Body(...)):
+def reset_password(data: reset_password_schemas.ResetPassword = Body(...), session: Session = Depends(get_db)):
     """
     Reset the user's password using the provided token.
 
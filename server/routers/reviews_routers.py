@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends, HTTPException, Request
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import reviews_schemas
 from server.db import review_helper
 from server.utils import oauth2
@@ -16,9 +17,10 @@ router = APIRouter(prefix="/review", tags=["Review  CRUD"])
              status_code=status.HTTP_201_CREATED,
              response_model=reviews_schemas.CreateReviewResponse
              )
-async def create_review(
+def create_review(
     sub_product_data: reviews_schemas.SubCreateReview = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Create a new review.
@@ -53,10 +55,11 @@ async def create_review(
             status_code=status.HTTP_201_CREATED,
             response_model=reviews_schemas.UpdateReviewResponse
             )
-async def review_update(
+def review_update(
     id: int, 
     review_update: reviews_schemas.UpdateReview = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
     ):
     """
     Update a review by ID.
@@ -94,9 +97,10 @@ async def review_update(
     return data
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product(
+def delete_product(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a product by ID.
@@ -138,7 +142,7 @@ async def delete_product(
             response_model=List[reviews_schemas.GetAllReview]
             )
 @rate_limited(max_calls=10, time_frame=60)
-async def get_all_review_of_one_product(request: Request,id: int):
+def get_all_review_of_one_product(request: Request,id: int, session: Session = Depends(get_db)):
     """
     Get all reviews of a product based on its ID.
 
@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends, HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import sales_schemas
 from server.db import  sales_helper
 from server.utils import oauth2
@@ -13,9 +14,10 @@ router = APIRouter(prefix="/sales", tags=["Product sales CRUD"])
     status_code=status.HTTP_201_CREATED,
     response_model=sales_schemas.ProductSalesCreateResponse,
 )
-async def create_product_sales(
+def create_product_sales(
     product_sales: sales_schemas.ProductSalesCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Creates a new product sales.
@@ -49,10 +51,11 @@ async def create_product_sales(
     status_code=status.HTTP_201_CREATED,
     response_model=sales_schemas.ProductSalesUpdateResponse,
 )
-async def product_sales_update(
+def product_sales_update(
     id: int,
     product_sales_update: sales_schemas.ProdcutSalesUpdate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Update a product sales by ID.
@@ -78,9 +81,10 @@ async def product_sales_update(
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_sales(
+def delete_product_sales(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete product sales by ID.
@@ -1,6 +1,7 @@
 from fastapi import Body, status, Depends,HTTPException
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.schemas import user_purchases_schemas
 from server.db import  user_purchases_helper
 from typing import List
@@ -15,9 +16,10 @@ router = APIRouter(prefix="/user_purchases", tags=["User Purchases CRUD"])
     status_code=status.HTTP_201_CREATED,
     response_model=user_purchases_schemas.UserPurchasesCreateResponse,
 )
-async def create_user_purchase(
+def create_user_purchase(
     sub_user_purchase: user_purchases_schemas.SubUserPurchasesCreate = Body(...),
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Creates a new user purchase.
@@ -53,10 +55,11 @@ async def create_user_purchase(
     status_code=status.HTTP_201_CREATED,  # HTTP status code for successful update
     response_model=user_purchases_schemas.UserPurchasesUpdateResponse,  # Response model for the updated user purchase
 )
-async def user_purchase_update(
+def user_purchase_update(
     id: int,  # ID of the user purchase to be updated
     user_purchase_update: user_purchases_schemas.UserPurchasesUpdate = Body(...),  # Data for the update
-    current_user: int = Depends(oauth2.get_current_user),  # Current user making the request
+    current_user: int = Depends(oauth2.get_current_principal),  # Current user making the request
+    session: Session = Depends(get_db),
 ):
     """
     Update a user purchase by ID.
@@ -85,16 +88,17 @@ async def user_purchase_update(
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user_purchase(
+def delete_user_purchase(
     id: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Delete a user purchase by ID.
 
     Args:
         id (int): ID of the user purchase to be deleted.
-        current_user (int, optional): The current user. Defaults to Depends(oauth2.get_current_user).
+        current_user (int, optional): The current user. Defaults to Depends(oauth2.get_current_principal).
 
     Returns:
         dict: The deleted user purchase.
@@ -117,8 +121,9 @@ async def delete_user_purchase(
     status_code=status.HTTP_200_OK,
     response_model=List[user_purchases_schemas.UserPurchasesGetAll]
 )
-async def get_all_user_purchase(
-    current_user: int = Depends(oauth2.get_current_user)
+def get_all_user_purchase(
+    current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Get all user purchases.
@@ -143,12 +148,13 @@ async def get_all_user_purchase(
 
 
 @router.get("/{number}/{startindex}", status_code=status.HTTP_200_OK)
-async def get_all_user_purchases_for_given_number(
+def get_all_user_purchases_for_given_number(
     number: int,
     startindex: int,
-    current_user: int = Depends(oauth2.get_current_user),
+    current_user: int = Depends(oauth2.get_current_principal),
     
-    # current_user: int = Depends(oauth2.get_current_user),
+    # current_user: int = Depends(oauth2.get_current_principal),
+    session: Session = Depends(get_db),
 ):
     """
     Get all user purchases for a given status.
@@ -1,6 +1,7 @@
-from fastapi import Body, status,HTTPException
+from fastapi import Body, status,HTTPException, Depends
 from fastapi.routing import APIRouter
-from server.models.models1 import session
+from server.db.db import get_db
+from sqlalchemy.orm import Session
 from server.models.models import User
 from server.schemas import user_schemas
 from server.utils import hash_helper
@@ -12,7 +13,7 @@ router = APIRouter(prefix="/user", tags=[" ------------------------ Required Use
              status_code=status.HTTP_201_CREATED,
              response_model=user_schemas.GetUserResponse
              )
-async def create_user(user_data: user_schemas.GetUser = Body(...)):
+def create_user(user_data: user_schemas.GetUser = Body(...), session: Session = Depends(get_db)):
     """
     Create a new user in the database.
 
@@ -34,10 +35,10 @@ async def create_user(user_data: user_schemas.GetUser = Body(...)):
     if email_exists:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
 
+    # Hash the password in the password process pool (a 503 when too many are queued)
+    hashed_password = hash_helper.run(hash_helper.hash, user_data.password)
+
     try:
-       
-        # Hash the password
-        hashed_password = hash_helper.hash(user_data.password)
         user_data.password = hashed_password
 
         # Create a new User object
@@ -47,8 +48,8 @@ async def create_user(user_data: user_schemas.GetUser = Body(...)):
         session.add(user)
         session.commit()
         session.refresh(user)
-        access_token = oauth2.create_access_token(data={"user_id": user.id, "role": user.role})
-        refresh_token = oauth2.create_refresh_token(data={"user_id": user.id, "role": user.role})
+        access_token = oauth2.create_access_token(data={"user_id": user.id, "role": user.role, "ver": user.token_version})
+        refresh_token = oauth2.create_refresh_token(data={"user_id": user.id, "role": user.role, "ver": user.token_version})
 
         user_data = {
             "username": user.username,
@@ -4,7 +4,7 @@ from server.schemas.product_schemas import (
     ProductImageCreate,  # need for inhertance for FilterProductsProductImage
     ProductUpadte # need for used as type in FeaturedProductUpToGivenNumberResponse
     )
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class FilterProductsProductImage(ProductImageCreate):
@@ -53,4 +53,59 @@ class ProductForNewArrivalesResponse(BaseModel):
     latest_discount_percent: Optional[float] | None
     category_name: str
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Keyset (cursor) pages
+
+# Orders a product page can be requested in
+ProductPageSort = Literal["id", "newest", "price_asc", "price_desc", "effective_price_asc", "effective_price_desc", "top_rated"]
+# Orders a search result page can be requested in, best match first by default
+SearchPageSort = Literal["relevance", "id", "newest", "price_asc", "price_desc", "effective_price_asc", "effective_price_desc", "top_rated"]
+
+
+class FilterProductsPageResponse(BaseModel):
+    items: List[FilterProductsProductCResponse]
+    next_cursor: Optional[str] | None
+
+
+class SearchProductsPageResponse(FilterProductsPageResponse):
+    # Closest product or category name when the search found nothing
+    did_you_mean: Optional[str] = None
+
+
+class FacetCount(BaseModel):
+    value: int | str
+    # Name of the category for the category facet
+    label: Optional[str] = None
+    count: int
+
+
+class PriceFacetCount(BaseModel):
+    min_price: float
+    # None for the last bucket
+    max_price: Optional[float] = None
+    count: int
+
+
+class ProductFacets(BaseModel):
+    category: List[FacetCount]
+    size: List[FacetCount]
+    color: List[FacetCount]
+    audience: List[FacetCount]
+    price: List[PriceFacetCount]
+
+
+class FacetedProductsPageResponse(FilterProductsPageResponse):
+    # Products matching every filter and the counts per facet value, only on the first page
+    total: Optional[int] = None
+    facets: Optional[ProductFacets] = None
+
+
+class SuggestionsResponse(BaseModel):
+    # Product names, category names and popular searches starting with the typed text
+    suggestions: List[str]
+
+
+class FeaturedProductsPageResponse(BaseModel):
+    items: List[FeaturedProductUpToGivenNumberResponse]
+    next_cursor: Optional[str] | None
@@ -32,3 +32,7 @@ class LandingPageUpToGivenNumberResponse(BaseModel):
     purchase_count: Optional[int]| None
     category_name: str
 
+
+class LandingPageProductsPageResponse(BaseModel):
+    items: List[LandingPageProductCResponse]
+    next_cursor: Optional[str] | None
@@ -16,4 +16,10 @@ class Token(BaseModel):
 
 
 class TokenData(BaseModel):
-    id: Optional[str] = None
\ No newline at end of file
+    id: Optional[str] = None
+
+class Principal(BaseModel):
+    """The caller of an authenticated request, from the claims of its access token."""
+    id: int
+    role: Optional[str] = None
+    token_version: int = 0
@@ -1,5 +1,6 @@
 from pydantic import BaseModel , EmailStr,Field
 from typing import Optional
+from datetime import datetime
 
 class GetUser(BaseModel):
     """   This schema is for reciving user data  """
@@ -36,3 +37,17 @@ class UpdateUser(BaseModel):
     role:str =Field(default="user")
     billing_address: Optional[str] | None
     shipping_address: Optional[str] | None
+
+
+class CurrentUser(BaseModel):
+    """ The user of an authenticated request as cached for authorization, without its password hash """
+    id: int
+    username: Optional[str] | None
+    email: Optional[str] | None
+    first_name: Optional[str] | None
+    last_name: Optional[str] | None
+    role: Optional[str] | None
+    billing_address: Optional[str] | None
+    shipping_address: Optional[str] | None
+    token_version: int
+    created_at: datetime
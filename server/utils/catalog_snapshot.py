@@ -0,0 +1,561 @@
+import asyncio
+import bisect
+import heapq
+import os
+import time
+from array import array
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Answer the category, price, size and top rated listings from a columnar snapshot of the catalog
+# kept by every worker, only the products of the page are read from the database
+CATALOG_SNAPSHOT_ENABLED: bool = os.getenv("CATALOG_SNAPSHOT_ENABLED", "false").lower() == "true"
+# Seconds between two rebuilds of the snapshot, the listings see new products and changed prices,
+# ratings or discounts after that (the details of the returned products are always read fresh)
+CATALOG_SNAPSHOT_REFRESH_SECONDS: int = int(os.getenv("CATALOG_SNAPSHOT_REFRESH_SECONDS", 300))
+
+# Sort keys of build_product_listing_query the snapshot can order by
+SNAPSHOT_SORTS = ("id", "price_asc", "price_desc", "effective_price_asc", "effective_price_desc", "top_rated")
+# Filters of build_product_listing_query the snapshot can apply
+SNAPSHOT_FILTERS = ("category_id", "min_price", "max_price", "name_keyword", "product_size", "min_reviews", "on_sale")
+
+# Separates the product names in CatalogSnapshot.names, postgres text can not contain it
+NAME_SEPARATOR = "\x00"
+# Characters of the names a name filter counts its matches in to estimate how many products it keeps
+NAME_SAMPLE: int = 1 << 20
+
+
+def like_keyword(keyword: str):
+    """
+    The lowercase text an ILIKE '%keyword%' filter looks for, if the snapshot can match it the same way.
+
+    Args:
+        keyword (str): The keyword sent by the client.
+
+    Returns:
+        str: The text to find in the lowercase values, None when the filter is left to the database
+            (LIKE wildcards, non ASCII text whose case folding may differ, empty keywords).
+    """
+    if not keyword or not keyword.isascii() or any(character in keyword for character in "%_\\" + NAME_SEPARATOR):
+        return None
+    return keyword.lower()
+
+
+class CatalogSnapshot:
+    """
+    The columns of the catalog the hot listings filter and sort on, one array per column.
+
+    Row i of every array is the i-th product by id. Nullable numbers are stored as the value the
+    listings coalesce them to (the price keeps a separate null flag, a null price never matches a
+    price range). Sizes are dictionary encoded. The lowercase product names are concatenated in a
+    single string so a name filter is one str.find over the whole catalog.
+
+    Every sort order is a permutation of the rows computed once per snapshot, so a listing walks
+    the order of its sort from the cursor and stops once the page is full. When a filter keeps
+    few products (a small category, a narrow price range, a rare name) its rows are read instead
+    and only the page is picked out of them with a heap.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.price = array("d")
+        self.price_null = bytearray()
+        self.effective_price = array("d")
+        self.category_id = array("q")
+        self.size_code = array("i")
+        self.sizes = []
+        self.discount = array("d")
+        self.num_reviews = array("q")
+        self.avg_rating = array("d")
+        self.names = ""
+        self.name_start = array("q")
+        # Sort key -> rows in the order of the sort
+        self.orders = {}
+        # Category id -> rows of the category in id order
+        self.categories = {}
+        # Size code -> rows of the size in id order
+        self.size_rows = {}
+        # Rows with a current discount in id order
+        self.on_sale_rows = array("i")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, partitions):
+        """
+        Fill the columns and compute the sort orders.
+
+        Args:
+            partitions: Lists of snapshot_rows, in product id order.
+        """
+        size_codes = {}
+        names = []
+        position = 0
+        for rows in partitions:
+            product_ids, product_names, prices, price_nulls, effective_prices, category_ids, sizes, \
+                discounts, num_reviews, avg_ratings = zip(*rows)
+            self.ids.extend(product_ids)
+            self.price.extend(prices)
+            self.price_null.extend(price_nulls)
+            self.effective_price.extend(effective_prices)
+            self.category_id.extend(category_ids)
+            self.size_code.extend(-1 if size is None else size_codes.setdefault(size, len(size_codes)) for size in sizes)
+            self.discount.extend(discounts)
+            self.num_reviews.extend(num_reviews)
+            self.avg_rating.extend(avg_ratings)
+            for name in product_names:
+                self.name_start.append(position)
+                position += len(name) + 1
+            names.append(NAME_SEPARATOR.join(product_names))
+            names.append(NAME_SEPARATOR)
+        self.name_start.append(position)
+        self.names = "".join(names)
+        self.sizes = list(size_codes)
+
+        # Python sorts are stable and the rows are in id order, so sorting by the first column
+        # alone already breaks ties by ascending id
+        rows = range(len(self.ids))
+        self.orders["id"] = rows
+        self.orders["price_asc"] = array("i", sorted(rows, key=self.price.__getitem__))
+        negated = [-price for price in self.price]
+        self.orders["price_desc"] = array("i", sorted(rows, key=negated.__getitem__))
+        by_effective_price = sorted(rows, key=self.effective_price.__getitem__)
+        self.orders["effective_price_asc"] = array("i", by_effective_price)
+        # Descending effective price breaks ties by descending id: the exact reverse
+        by_effective_price.reverse()
+        self.orders["effective_price_desc"] = array("i", by_effective_price)
+        negated = [-count for count in self.num_reviews]
+        top_rated = sorted(rows, key=negated.__getitem__)
+        negated = [-rating for rating in self.avg_rating]
+        top_rated.sort(key=negated.__getitem__)
+        self.orders["top_rated"] = array("i", top_rated)
+
+        for row, category_id in enumerate(self.category_id):
+            if category_id:
+                self.categories.setdefault(category_id, array("i")).append(row)
+        for row, code in enumerate(self.size_code):
+            if code >= 0:
+                self.size_rows.setdefault(code, array("i")).append(row)
+        self.on_sale_rows.extend(row for row, discount in enumerate(self.discount) if discount > 0)
+
+    def sort_key(self, sort: str, row: int) -> tuple:
+        """
+        The position of a row in a sort order, the order of the tuples is the order of the listing.
+
+        Args:
+            sort (str): One of SNAPSHOT_SORTS.
+            row (int): The row.
+
+        Returns:
+            tuple: The sort values, negated for the descending columns.
+        """
+        product_id = self.ids[row]
+        if sort == "id":
+            return (product_id,)
+        if sort == "price_asc":
+            return (self.price[row], product_id)
+        if sort == "price_desc":
+            return (-self.price[row], product_id)
+        if sort == "effective_price_asc":
+            return (self.effective_price[row], product_id)
+        if sort == "effective_price_desc":
+            return (-self.effective_price[row], -product_id)
+        return (-self.avg_rating[row], -self.num_reviews[row], product_id)
+
+    @staticmethod
+    def cursor_key(sort: str, values: list) -> tuple:
+        """
+        The sort_key of the last row of the previous page.
+
+        Args:
+            sort (str): One of SNAPSHOT_SORTS.
+            values (list): The sort values from the cursor, as encoded by listing_cursor_values.
+
+        Returns:
+            tuple: The sort key.
+
+        Raises:
+            ValueError, TypeError: If the values do not belong to the sort.
+        """
+        if len(values) != (3 if sort == "top_rated" else 1 if sort == "id" else 2):
+            raise ValueError(values)
+        product_id = int(values[-1])
+        if sort == "id":
+            return (product_id,)
+        if sort in ("price_asc", "effective_price_asc"):
+            return (float(values[0]), product_id)
+        if sort == "price_desc":
+            return (-float(values[0]), product_id)
+        if sort == "effective_price_desc":
+            return (-float(values[0]), -product_id)
+        return (-float(values[0]), -int(values[1]), product_id)
+
+    def cursor_values(self, sort: str, row: int) -> list:
+        """
+        The sort values of a row, as listing_cursor_values encodes them for the SQL listing.
+
+        Args:
+            sort (str): One of SNAPSHOT_SORTS.
+            row (int): The last row of the page.
+
+        Returns:
+            list: The value of every sort column.
+        """
+        product_id = self.ids[row]
+        if sort == "id":
+            return [product_id]
+        if sort in ("price_asc", "price_desc"):
+            return [self.price[row], product_id]
+        if sort in ("effective_price_asc", "effective_price_desc"):
+            return [self.effective_price[row], product_id]
+        return [self.avg_rating[row], self.num_reviews[row], product_id]
+
+    def _name_rows(self, keyword: str, first_row: int = 0):
+        """
+        Rows whose name contains the keyword, in id order.
+
+        Args:
+            keyword (str): The lowercase keyword.
+            first_row (int): The row to start from.
+
+        Yields:
+            int: The matching rows.
+        """
+        position = self.name_start[first_row] if first_row < len(self.ids) else len(self.names)
+        while True:
+            position = self.names.find(keyword, position)
+            if position < 0:
+                return
+            row = bisect.bisect_right(self.name_start, position) - 1
+            yield row
+            position = self.name_start[row + 1]
+
+    def _price_rows(self, sort: str, min_price: float = None, max_price: float = None):
+        """
+        Rows in a price range, a contiguous part of the price orders.
+        Products without a price are left to the price check.
+
+        Args:
+            sort (str): The sort key of the listing.
+            min_price (float): Lowest price (inclusive), None for no bound.
+            max_price (float): Highest price (inclusive), None for no bound.
+
+        Returns:
+            tuple: The rows, in the order of the sort for the price sorts and by price otherwise,
+                and whether they are in the order of the sort.
+        """
+        if sort == "price_desc":
+            order, key = self.orders["price_desc"], lambda row: -self.price[row]
+            low, high = (None if max_price is None else -max_price), (None if min_price is None else -min_price)
+        else:
+            order, key = self.orders["price_asc"], self.price.__getitem__
+            low, high = min_price, max_price
+        start = 0 if low is None else bisect.bisect_left(order, low, key=key)
+        end = len(order) if high is None else bisect.bisect_right(order, high, key=key)
+        return order[start:max(start, end)], sort in ("price_asc", "price_desc")
+
+    def _size_codes(self, product_size: str) -> list:
+        """
+        The codes of the sizes an ILIKE '%product_size%' filter keeps.
+
+        Args:
+            product_size (str): The size sent by the client.
+
+        Returns:
+            list: The size codes.
+        """
+        keyword = like_keyword(product_size)
+        return [code for code, size in enumerate(self.sizes) if keyword in size.lower()]
+
+    def _checks(self, category_id=None, min_price=None, max_price=None, name_keyword=None,
+                product_size=None, min_reviews=None, on_sale=False):
+        """
+        A test of every row for each filter.
+
+        Returns:
+            dict: Filter name -> function of the row returning whether it passes.
+        """
+        checks = {}
+        if category_id is not None:
+            checks["category"] = lambda row: self.category_id[row] == category_id
+        if min_price is not None or max_price is not None:
+            low = float("-inf") if min_price is None else min_price
+            high = float("inf") if max_price is None else max_price
+            checks["price"] = lambda row: low <= self.price[row] <= high and not self.price_null[row]
+        if name_keyword is not None:
+            keyword = like_keyword(name_keyword)
+            checks["name"] = lambda row: self.names.find(keyword, self.name_start[row], self.name_start[row + 1]) >= 0
+        if product_size is not None:
+            codes = set(self._size_codes(product_size))
+            checks["size"] = lambda row: self.size_code[row] in codes
+        if min_reviews is not None:
+            checks["reviews"] = lambda row: self.num_reviews[row] >= min_reviews
+        if on_sale:
+            checks["on_sale"] = lambda row: self.discount[row] > 0
+        return checks
+
+    def _sources(self, sort: str, checks: dict, filters: dict) -> dict:
+        """
+        The rows kept by the filters that have them at hand.
+
+        Args:
+            sort (str): The sort key of the listing.
+            checks (dict): The _checks of the listing.
+            filters (dict): The filters of the listing.
+
+        Returns:
+            dict: Filter name -> (number of rows, exact number or estimate, the rows or a function of the
+                first row returning them, whether they are in the order of the sort).
+        """
+        sources = {}
+        by_id = sort == "id"
+        if "category" in checks:
+            rows = self.categories.get(filters["category_id"], array("i"))
+            sources["category"] = (len(rows), True, rows, by_id)
+        if "price" in checks:
+            rows, ordered = self._price_rows(sort, filters.get("min_price"), filters.get("max_price"))
+            sources["price"] = (len(rows), True, rows, ordered)
+        if "size" in checks:
+            parts = [self.size_rows[code] for code in self._size_codes(filters["product_size"])]
+            # Several sizes are merged only if their rows are read
+            rows = parts[0] if len(parts) == 1 else lambda: array("i", sorted(row for part in parts for row in part))
+            sources["size"] = (sum(len(part) for part in parts), True, rows, by_id)
+        if "on_sale" in checks:
+            sources["on_sale"] = (len(self.on_sale_rows), True, self.on_sale_rows, by_id)
+        if "name" in checks:
+            keyword = like_keyword(filters["name_keyword"])
+            # Estimated from the first NAME_SAMPLE characters, a rare name counts as found once
+            sample = min(len(self.names), NAME_SAMPLE)
+            estimate = self.names.count(keyword, 0, sample) * len(self.names) / max(sample, 1)
+            sources["name"] = (max(estimate, 1), False, lambda first_row=0: self._name_rows(keyword, first_row), by_id)
+        return sources
+
+    def select(self, sort: str = "id", limit: int = 20, after: tuple = None, offset: int = 0, **filters) -> list:
+        """
+        The rows of a listing page.
+
+        The rows are read from whichever source is expected to be cheapest: an order of the rows
+        (the sort order of the catalog, or the rows of a filter already in that order) walked until
+        the page is full, or the rows kept by a selective filter, of which the page is picked with
+        a heap. The shares of the catalog kept by the filters are assumed independent.
+
+        Args:
+            sort (str): One of SNAPSHOT_SORTS.
+            limit (int): The number of rows.
+            after (tuple): The cursor_key of the last row of the previous page.
+            offset (int): Number of rows to skip.
+            **filters: SNAPSHOT_FILTERS values, None for the filters not applied.
+
+        Returns:
+            list: The rows of the page in the order of the sort.
+        """
+        total = len(self.ids)
+        wanted = offset + limit
+        checks = self._checks(**filters)
+        sources = self._sources(sort, checks, filters)
+        if not total or wanted <= 0 or any(exact and not size for size, exact, _, _ in sources.values()):
+            return []
+
+        expected = total
+        for size, _, _, _ in sources.values():
+            expected *= min(size / total, 1)
+
+        def walk_cost(size):
+            # Rows read in an order before the page is full
+            return min(size, wanted * size / max(expected, 1))
+
+        plans = [(walk_cost(total), "walk", None)]
+        for name, (size, _, _, ordered) in sources.items():
+            plans.append((walk_cost(size), "walk", name) if ordered else (size, "pick", name))
+        _, plan, source = min(plans, key=lambda plan: plan[0])
+
+        # The rows of the source pass its own filter, except the products without a price
+        remaining = [check for name, check in checks.items() if name != source or name == "price"]
+
+        def passes(row):
+            for check in remaining:
+                if not check(row):
+                    return False
+            return True
+
+        if plan == "pick":
+            rows = sources[source][2]
+            if callable(rows):
+                rows = rows()
+            key = lambda row: self.sort_key(sort, row)
+            rows = [row for row in rows if passes(row) and (after is None or key(row) > after)]
+            return heapq.nsmallest(wanted, rows, key=key)[offset:]
+
+        if source == "name":
+            first_row = 0 if after is None else bisect.bisect_right(self.ids, after[0])
+            rows = sources["name"][2](first_row)
+        else:
+            order = self.orders[sort] if source is None else sources[source][2]
+            if callable(order):
+                order = order()
+            start = 0 if after is None else bisect.bisect_right(order, after, key=lambda row: self.sort_key(sort, row))
+            if not remaining:
+                return list(order[start + offset:start + wanted])
+            rows = (order[position] for position in range(start, len(order)))
+
+        page = []
+        for row in rows:
+            if passes(row):
+                page.append(row)
+                if len(page) == wanted:
+                    break
+        return page[offset:]
+
+snapshot = CatalogSnapshot()
+snapshot_ready = False
+_refresh_task = None
+
+
+def answers(sort: str, filters: dict) -> bool:
+    """
+    Whether a listing can be answered from the snapshot of this worker.
+
+    Args:
+        sort (str): The sort key of the listing.
+        filters (dict): The filters of build_product_listing_query, None or False when not applied.
+
+    Returns:
+        bool: True if the snapshot is ready and supports the sort and every applied filter.
+    """
+    if not snapshot_ready or sort not in SNAPSHOT_SORTS:
+        return False
+    for name, value in filters.items():
+        if value is None or value is False:
+            continue
+        if name not in SNAPSHOT_FILTERS:
+            return False
+        if name in ("name_keyword", "product_size") and like_keyword(value) is None:
+            return False
+    return True
+
+
+def snapshot_rows(connection):
+    """
+    Stream the columns of the snapshot, with the nulls already coalesced like the listings do.
+
+    Args:
+        connection: SQLAlchemy connection object.
+
+    Returns:
+        Iterator: Lists of up to 10000 rows, in product id order.
+    """
+    from sqlalchemy import select, func, cast, Float
+    from server.models.models import Product, ProductReviewStats
+
+    query = (
+        select(
+            Product.id,
+            # lower() of postgres, the one ILIKE compares with
+            func.coalesce(func.lower(Product.product_name), ""),
+            func.coalesce(Product.price, 0.0),
+            Product.price.is_(None),
+            func.coalesce(Product.effective_price, 0.0),
+            func.coalesce(Product.category_id, 0),
+            Product.product_size,
+            func.coalesce(Product.current_discount_percent, 0.0),
+            func.coalesce(ProductReviewStats.num_reviews, 0),
+            func.coalesce(cast(ProductReviewStats.avg_rating, Float), 0.0),
+        )
+        .outerjoin(ProductReviewStats, Product.id == ProductReviewStats.product_id)
+        .order_by(Product.id)
+    )
+    return connection.execution_options(stream_results=True).execute(query).partitions(10000)
+
+
+def build_catalog_snapshot():
+    """
+    Read the catalog and make the new snapshot the one answering the listings of this process.
+
+    Returns:
+        CatalogSnapshot: The new snapshot.
+    """
+    global snapshot, snapshot_ready
+    from server.db.db import engine
+
+    started = time.perf_counter()
+    new_snapshot = CatalogSnapshot()
+    with engine.connect() as connection:
+        new_snapshot.load(snapshot_rows(connection))
+
+    snapshot, snapshot_ready = new_snapshot, True
+    print(f"Catalog snapshot built: {len(new_snapshot)} products in {time.perf_counter() - started:.1f}s")
+    return new_snapshot
+
+
+async def refresh_periodically():
+    """
+    Rebuild the snapshot every CATALOG_SNAPSHOT_REFRESH_SECONDS in a thread of the default executor.
+    The listings keep using the previous snapshot (or the database before the first one) meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, build_catalog_snapshot)
+        except Exception as e:
+            print(f"Catalog snapshot not refreshed: {e}")
+        await asyncio.sleep(CATALOG_SNAPSHOT_REFRESH_SECONDS)
+
+
+def start_refresh():
+    """Build the snapshot in the background and keep it fresh, once per process."""
+    global _refresh_task
+    if _refresh_task is None:
+        _refresh_task = asyncio.get_running_loop().create_task(refresh_periodically())
+
+
+def stop_refresh():
+    """Stop refreshing the snapshot."""
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
+
+
+if __name__ == "__main__":
+    # Benchmark against the SQL listings of the configured database: python -m server.utils.catalog_snapshot
+    import statistics
+    from server.db.db import SessionLocal
+    from server.db.fliter_product_with_reviews_helper import build_product_listing_query
+
+    build_catalog_snapshot()
+    categories = sorted(snapshot.categories, key=lambda category_id: len(snapshot.categories[category_id]))
+    listings = {
+        "category": ("id", {"category_id": categories[-1]}),
+        "smallest category": ("id", {"category_id": categories[0]}),
+        "category by price": ("price_asc", {"category_id": categories[-1]}),
+        "price range + name": ("id", {"min_price": 20, "max_price": 80, "name_keyword": "boot"}),
+        "narrow price range": ("price_desc", {"min_price": 49, "max_price": 50}),
+        "price range by price": ("price_asc", {"min_price": 100, "max_price": 150}),
+        "name by price": ("price_asc", {"name_keyword": "waterproof"}),
+        "size": ("id", {"product_size": "m"}),
+        "top rated": ("top_rated", {"min_reviews": 1}),
+        "on sale, cheapest": ("effective_price_asc", {"on_sale": True}),
+    }
+
+    def timed(function, repeat=20):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), result
+
+    session = SessionLocal()
+    try:
+        for name, (sort, filters) in listings.items():
+            for label, offset in (("first page", 0), ("page 50", 49 * 20)):
+                snapshot_ms, rows = timed(lambda: snapshot.select(sort, 20, offset=offset, **filters))
+                query = build_product_listing_query(sort=sort, startindex=offset, number=20, **filters)
+                sql_ms, result = timed(lambda: session.execute(query).all())
+                same = [snapshot.ids[row] for row in rows] == [row.Product.id for row in result]
+                print(f"{name:>22} {label:>10}: snapshot {snapshot_ms:8.3f} ms, SQL {sql_ms:8.3f} ms"
+                      f"{'' if same else '  (different rows)'}")
+    finally:
+        session.close()
@@ -0,0 +1,427 @@
+import asyncio
+import os
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from email.mime.text import MIMEText
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy.exc import SQLAlchemyError
+
+load_dotenv()
+
+# Write outgoing emails to the email_outbox table and return, a background sender of every worker sends them.
+# Off, they are sent inside the request, holding its thread for as long as the SMTP server takes
+EMAIL_OUTBOX_ENABLED: bool = os.getenv("EMAIL_OUTBOX_ENABLED", "false").lower() == "true"
+# SMTP server the emails are sent through
+SMTP_HOST: str = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT: int = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS: bool = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+# Seconds a connection, a command or a reply of the SMTP server may take
+SMTP_TIMEOUT_SECONDS: float = float(os.getenv("SMTP_TIMEOUT_SECONDS", 10))
+# Seconds the sender keeps its SMTP connection open without sending, for the next emails
+SMTP_IDLE_SECONDS: float = float(os.getenv("SMTP_IDLE_SECONDS", 60))
+# Account the emails are sent from, no login when empty
+SMTP_USERNAME: str = os.getenv("email", "")
+SMTP_PASSWORD: str = os.getenv("password", "")
+# Emails a sender claims and sends over one connection at a time
+EMAIL_OUTBOX_BATCH_SIZE: int = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 50))
+# Seconds between two looks at the outbox, the emails of other workers and the retries are sent after at most that
+EMAIL_OUTBOX_POLL_SECONDS: float = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", 5))
+# Attempts of an email before it is kept as failed
+EMAIL_OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 8))
+# Seconds before the first retry of an email, doubled by every attempt up to an hour
+EMAIL_OUTBOX_RETRY_SECONDS: float = float(os.getenv("EMAIL_OUTBOX_RETRY_SECONDS", 30))
+
+# Seconds the emails of a batch are claimed for, a sender that died releases them after that
+CLAIM_SECONDS = max(60.0, 2 * SMTP_TIMEOUT_SECONDS * (EMAIL_OUTBOX_BATCH_SIZE + 2))
+
+
+def build_message(recipient: str, subject: str, body: str) -> str:
+    """The email as sent over SMTP."""
+    message = MIMEText(body)
+    message["Subject"] = subject
+    message["From"] = SMTP_USERNAME
+    message["To"] = recipient
+    return message.as_string()
+
+
+def connect() -> smtplib.SMTP:
+    """
+    Open a connection to the SMTP server.
+
+    Returns:
+        smtplib.SMTP: The connection, logged in when SMTP_USERNAME is set.
+    """
+    connection = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+    try:
+        if SMTP_STARTTLS:
+            connection.starttls()
+        if SMTP_USERNAME:
+            connection.login(SMTP_USERNAME, SMTP_PASSWORD)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+def send_now(recipient: str, subject: str, body: str):
+    """
+    Send an email inside the caller, over a new connection.
+
+    Args:
+        recipient (str): The recipient's email address.
+        subject (str): The subject.
+        body (str): The text of the email.
+
+    Raises:
+        Exception: If the email could not be sent.
+    """
+    connection = connect()
+    try:
+        connection.sendmail(SMTP_USERNAME, [recipient], build_message(recipient, subject, body))
+    finally:
+        try:
+            connection.quit()
+        except smtplib.SMTPException:
+            connection.close()
+
+
+def enqueue(session, recipient: str, subject: str, body: str):
+    """
+    Add an email to the outbox, the background sender sends it.
+
+    Args:
+        session: The database session.
+        recipient (str): The recipient's email address.
+        subject (str): The subject.
+        body (str): The text of the email.
+
+    Raises:
+        HTTPException: If the email could not be stored.
+    """
+    from server.models.models import OutboundEmail
+
+    try:
+        session.add(OutboundEmail(recipient=recipient, subject=subject, body=body))
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {e}")
+
+    wake_sender()
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before the next attempt of an email that failed attempts times."""
+    return min(3600.0, EMAIL_OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1))
+
+
+class SMTPSender:
+    """
+    The SMTP connection of the sender of this worker, kept open between batches for SMTP_IDLE_SECONDS
+    and opened again when the server closed it.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.used_at = 0.0
+
+    def _connection(self) -> smtplib.SMTP:
+        if self.connection is not None:
+            try:
+                # Servers drop idle connections, a NOOP finds out before the first email of the batch
+                if self.connection.noop()[0] == 250:
+                    return self.connection
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self.connection = connect()
+        return self.connection
+
+    def send(self, recipient: str, message: str):
+        """
+        Send one email over the connection.
+
+        Raises:
+            smtplib.SMTPException, OSError: If the email was not sent.
+        """
+        connection = self._connection()
+        try:
+            connection.sendmail(SMTP_USERNAME, [recipient], message)
+        except (smtplib.SMTPException, OSError) as e:
+            if is_connection_error(e):
+                # The connection is unusable, the next email opens a new one
+                self.close()
+            raise
+        self.used_at = time.monotonic()
+
+    def close_when_idle(self):
+        if self.connection is not None and time.monotonic() - self.used_at > SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        self.connection = None
+
+
+def is_connection_error(error: Exception) -> bool:
+    """
+    Whether the SMTP server could not be reached or dropped the connection, as opposed to a reply refusing one email.
+    SMTPException is an OSError, only the OSErrors of the socket count.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_permanent(error: Exception) -> bool:
+    """Whether the SMTP server refused the email for good (a 5xx reply), it is not retried."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500 \
+        and not isinstance(error, smtplib.SMTPAuthenticationError)
+
+
+def claim_batch(connection):
+    """
+    Claim the next emails due, so the senders of the other workers skip them.
+
+    Args:
+        connection: SQLAlchemy connection object, in a transaction.
+
+    Returns:
+        list: Rows (id, recipient, subject, body, attempts) of at most EMAIL_OUTBOX_BATCH_SIZE emails.
+    """
+    from sqlalchemy import select, update, func
+    from server.models.models import OutboundEmail
+
+    due = (
+        select(OutboundEmail.id)
+        .where(OutboundEmail.status == "pending", OutboundEmail.next_attempt_at <= func.now())
+        .order_by(OutboundEmail.next_attempt_at)
+        .limit(EMAIL_OUTBOX_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return connection.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id.in_(due))
+        .values(
+            next_attempt_at=func.now() + timedelta(seconds=CLAIM_SECONDS),
+            attempts=OutboundEmail.attempts + 1,
+        )
+        .returning(OutboundEmail.id, OutboundEmail.recipient, OutboundEmail.subject, OutboundEmail.body, OutboundEmail.attempts)
+    ).fetchall()
+
+
+def send_batch(sender: SMTPSender) -> int:
+    """
+    Claim the emails due and send them over the connection of the sender.
+    Sent emails are deleted, failed ones are retried later with a backoff or kept as failed.
+
+    Args:
+        sender (SMTPSender): The sender of this worker.
+
+    Returns:
+        int: The number of claimed emails.
+    """
+    from sqlalchemy import delete, update, func
+    from server.db.db import engine
+    from server.models.models import OutboundEmail
+
+    with engine.begin() as connection:
+        batch = claim_batch(connection)
+    if not batch:
+        return 0
+
+    sent, failures = [], []
+    for index, (email_id, recipient, subject, body, attempts) in enumerate(batch):
+        try:
+            sender.send(recipient, build_message(recipient, subject, body))
+            sent.append(email_id)
+        except (smtplib.SMTPException, OSError) as e:
+            failures.append((email_id, attempts, e))
+            if is_connection_error(e):
+                # The server is unreachable, the rest of the batch is retried with this email
+                failures.extend((row[0], row[4], e) for row in batch[index + 1:])
+                break
+
+    with engine.begin() as connection:
+        if sent:
+            connection.execute(delete(OutboundEmail).where(OutboundEmail.id.in_(sent)))
+        for email_id, attempts, error in failures:
+            failed = is_permanent(error) or attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS
+            connection.execute(
+                update(OutboundEmail)
+                .where(OutboundEmail.id == email_id)
+                .values(
+                    status="failed" if failed else "pending",
+                    next_attempt_at=func.now() + timedelta(seconds=retry_delay(attempts)),
+                    last_error=str(error)[:1000],
+                )
+            )
+            print(f"Email {email_id} {'failed' if failed else 'will be retried'}: {error}")
+    return len(batch)
+
+
+def drain(sender: SMTPSender) -> int:
+    """
+    Send batches until no email is due.
+
+    Returns:
+        int: The number of claimed emails.
+    """
+    claimed = 0
+    while True:
+        count = send_batch(sender)
+        claimed += count
+        if count < EMAIL_OUTBOX_BATCH_SIZE:
+            return claimed
+
+
+_sender_task = None
+_sender_loop = None
+_wakeup = None
+
+
+def wake_sender():
+    """Make the sender of this worker look at the outbox now, from any thread."""
+    if _sender_loop is not None and _wakeup is not None:
+        _sender_loop.call_soon_threadsafe(_wakeup.set)
+
+
+async def send_periodically():
+    """
+    Drain the outbox in a thread when an email is enqueued by this worker or every EMAIL_OUTBOX_POLL_SECONDS,
+    closing the SMTP connection after SMTP_IDLE_SECONDS without emails.
+    """
+    loop = asyncio.get_running_loop()
+    sender = SMTPSender()
+    # One thread sends, the SMTP connection is used by a single thread at a time
+    lock = threading.Lock()
+
+    def run():
+        with lock:
+            drain(sender)
+            sender.close_when_idle()
+
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                await loop.run_in_executor(None, run)
+            except Exception as e:
+                print(f"Email outbox not drained: {e}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), EMAIL_OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # A batch still sending in its thread closes nothing, its connection goes with the process
+        if lock.acquire(blocking=False):
+            sender.close()
+            lock.release()
+
+
+def start_sender():
+    """Start the background sender of the outbox, once per process."""
+    global _sender_task, _sender_loop, _wakeup
+    if _sender_task is None:
+        _sender_loop = asyncio.get_running_loop()
+        _wakeup = asyncio.Event()
+        _sender_task = _sender_loop.create_task(send_periodically())
+
+
+def stop_sender():
+    """Stop the background sender, the emails left in the outbox are sent by the next one."""
+    global _sender_task, _sender_loop, _wakeup
+    if _sender_task is not None:
+        _sender_task.cancel()
+        _sender_task, _sender_loop, _wakeup = None, None, None
+
+if __name__ == "__main__":
+    # Latency of /reset/forget_password with the emails sent inside the request and through the outbox,
+    # against a local SMTP stand-in answering every command after a delay:
+    # python -m server.utils.email_outbox <email of a user> [requests] [seconds per SMTP reply]
+    import statistics
+    import sys
+    import httpx
+    from server.backend import app
+    from server.utils import rate_limit
+    # The module the app uses, this one runs as __main__
+    from server.utils import email_outbox
+
+    # The endpoints are measured, not the rate limit
+    rate_limit.check_rate_limit = lambda *args: {}
+
+    email = sys.argv[1]
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    reply_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    received = []
+
+    async def smtp_session(reader, writer):
+        async def reply(line):
+            await asyncio.sleep(reply_delay)
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        await reply("220 stand-in ESMTP")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                await reply("250 stand-in")
+            elif command == "DATA":
+                await reply("354 end with <CRLF>.<CRLF>")
+                received.append(await reader.readuntil(b"\r\n.\r\n"))
+                await reply("250 queued")
+            elif command == "QUIT":
+                await reply("221 bye")
+                break
+            else:
+                await reply("250 ok")
+        writer.close()
+
+    def serve(ready):
+        async def main():
+            server = await asyncio.start_server(smtp_session, "127.0.0.1", 0)
+            ready.append(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+        asyncio.run(main())
+
+    ready = []
+    threading.Thread(target=serve, args=(ready,), daemon=True).start()
+    while not ready:
+        time.sleep(0.01)
+    email_outbox.SMTP_HOST, email_outbox.SMTP_PORT = "127.0.0.1", ready[0]
+    email_outbox.SMTP_STARTTLS, email_outbox.SMTP_USERNAME = False, ""
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+            for enabled in (False, True):
+                email_outbox.EMAIL_OUTBOX_ENABLED = enabled
+                if enabled:
+                    email_outbox.start_sender()
+                received.clear()
+                started = time.perf_counter()
+                latencies = []
+                for _ in range(requests):
+                    request_started = time.perf_counter()
+                    response = await client.post("/reset/forget_password", json={"email": email})
+                    latencies.append((time.perf_counter() - request_started) * 1000)
+                    response.raise_for_status()
+                while len(received) < requests:
+                    await asyncio.sleep(0.01)
+                print(f"{'outbox' if enabled else 'inline':>6}: endpoint p50 {statistics.median(latencies):7.1f} ms, "
+                      f"max {max(latencies):7.1f} ms, {requests} emails delivered in {time.perf_counter() - started:.1f}s")
+            email_outbox.stop_sender()
+
+    asyncio.run(main())
@@ -1,6 +1,26 @@
 from passlib.context import CryptContext
+import asyncio
 import logging
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+load_dotenv()
+
+# Cost of new bcrypt hashes (2^rounds iterations). Hashes of another cost are rehashed at the next login
+BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Processes hashing and verifying passwords, so bcrypt holds neither the event loop nor the GIL of the worker.
+# They are spawned, so scripts serving the app must guard their entry point with if __name__ == "__main__".
+# 0 runs them in the threadpool of the worker
+PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+# Password operations a worker queues at most, the others are refused with a 503 (e.g. a credential stuffing burst)
+PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 
 def hash(password: str)-> str:
@@ -34,3 +54,183 @@ def verify(plain_password, hashed_password):
     except Exception as e:
         logging.error(f"Error verifying password: {e}")
         return False
+
+
+def verify_and_update(plain_password, hashed_password):
+    """
+    Verify a plain password and hash it again when its hash does not use the current cost.
+
+    Args:
+        plain_password (str): The plain password to verify.
+        hashed_password (str): The hashed password to compare against.
+
+    Returns:
+        tuple: (True if the passwords match, the new hash to store or None).
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception as e:
+        logging.error(f"Error verifying password: {e}")
+        return False, None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def executor():
+    """
+    The process pool of the password operations, started by the first one.
+
+    Returns:
+        ProcessPoolExecutor: The pool, None with PASSWORD_HASH_WORKERS=0.
+    """
+    global _executor
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # Forking a worker running an event loop and threads is unsafe, the pool starts fresh interpreters
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown():
+    """Stop the process pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _refuse():
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password operations, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
+def refuse_when_busy():
+    """
+    Refuse a request before it does any work (e.g. looks the user up) when its password operation would be refused.
+
+    Raises:
+        HTTPException: 503 with a Retry-After header when PASSWORD_HASH_MAX_PENDING operations are queued.
+    """
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        _refuse()
+
+
+@contextmanager
+def admitted():
+    """
+    Count a password operation against PASSWORD_HASH_MAX_PENDING while it runs.
+
+    Raises:
+        HTTPException: 503 with a Retry-After header when the worker already queues as many.
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            _refuse()
+        _pending += 1
+    try:
+        yield
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def run_async(function, *args):
+    """
+    Run a password operation (hash, verify, verify_and_update) off the event loop.
+
+    Args:
+        function (callable): The operation.
+        *args: Its arguments.
+
+    Returns:
+        The result of the operation.
+
+    Raises:
+        HTTPException: 503 when too many operations are queued.
+    """
+    with admitted():
+        return await asyncio.get_running_loop().run_in_executor(executor(), function, *args)
+
+
+def run(function, *args):
+    """
+    Run a password operation from a sync endpoint, in the process pool.
+    The thread waits without holding the GIL, bcrypt does not release it.
+
+    Args:
+        function (callable): The operation.
+        *args: Its arguments.
+
+    Returns:
+        The result of the operation.
+
+    Raises:
+        HTTPException: 503 when too many operations are queued.
+    """
+    with admitted():
+        pool = executor()
+        if pool is None:
+            return function(*args)
+        return pool.submit(function, *args).result()
+
+if __name__ == "__main__":
+    # Login throughput and catalog latency during a login flood, against the app in this process:
+    # python -m server.utils.hash_helper <email> <password> [concurrent logins] [seconds]
+    # Compare PASSWORD_HASH_WORKERS=0 (bcrypt in the threadpool, as before) with the process pool.
+    import statistics
+    import sys
+    import time
+    import httpx
+    from server.backend import app
+    from server.utils import rate_limit
+    # The module the app uses, this one runs as __main__
+    from server.utils import hash_helper
+
+    # The endpoints are measured, not the rate limit
+    rate_limit.check_rate_limit = lambda *args: {}
+
+    email, password = sys.argv[1], sys.argv[2]
+    logins = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            deadline = time.monotonic() + seconds
+            statuses = {}
+            latencies = []
+
+            async def flood():
+                while time.monotonic() < deadline:
+                    response = await client.post("/login", data={"username": email, "password": password})
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 503:
+                        await asyncio.sleep(0.05)
+
+            async def browse():
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    await client.get("/productfilter/getproducts/20/0")
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(*[flood() for _ in range(logins)], browse())
+        latencies.sort()
+        print(f"PASSWORD_HASH_WORKERS={hash_helper.PASSWORD_HASH_WORKERS} BCRYPT_ROUNDS={hash_helper.BCRYPT_ROUNDS}, {logins} concurrent logins for {seconds:.0f}s")
+        print(f"logins: {statuses.get(200, 0) / seconds:.1f}/s succeeded, responses {statuses}")
+        print(f"catalog: {len(latencies)} requests, p50 {statistics.median(latencies):.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms, max {latencies[-1]:.1f} ms")
+        hash_helper.shutdown()
+
+    asyncio.run(main())
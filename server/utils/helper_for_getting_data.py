@@ -1,132 +1,465 @@
-from fastapi import HTTPException
-from collections import defaultdict
+import os
+import time
+from fastapi import HTTPException, Response
+from fastapi.exceptions import ResponseValidationError
+from dotenv import load_dotenv
 from sqlalchemy.exc import SQLAlchemyError
+from server.db.fliter_product_with_reviews_helper import build_product_listing_query, listing_cursor_values, did_you_mean, build_facet_query, PRICE_BUCKETS
+from server.utils.pagination import encode_cursor, decode_cursor, clamp_page_size
+from server.utils import search_engine, catalog_snapshot
+from server.utils.listing_documents import listing_documents
+from server.utils.single_flight import SingleFlight
 
-def helper_for_filters_with_review_and_discount(session, query):
+load_dotenv()
+
+# Seconds the facet counts of the unfiltered catalog are reused before they are counted again
+FACET_CACHE_SECONDS: int = int(os.getenv("FACET_CACHE_SECONDS", 60))
+# Facets in the order of the bits of the grouping column of build_facet_query
+FACETS = ("category", "size", "color", "audience", "price")
+_unfiltered_facets = {"expires": 0.0, "total": 0, "facets": None}
+_facet_flights = SingleFlight()
+
+
+def product_listing_item(product, images, category_name, num_reviews, avg_rating, discount_percent):
+    """
+    The dictionary returned for a product in the listings.
+    Args:
+        product (Product): The product.
+        images (list): The images of the product.
+        category_name (str): The name of the product category.
+        num_reviews (int): The number of reviews.
+        avg_rating (float): The average rating.
+        discount_percent (float): The latest discount.
+    Returns:
+        dict: The product details with images and reviews.
+    """
+    return {
+        "id": product.id,
+        "product_name": product.product_name,
+        "description": product.description,
+        "price": product.price,
+        "stock_quantity": product.stock_quantity,
+        "product_size": product.product_size,
+        "SKU": product.SKU,
+        "target_audience": product.target_audience,
+        "product_color": product.product_color,
+        "created_at": product.created_at,
+        "category_id": product.category_id,
+        "images": images,
+        "num_reviews": num_reviews,
+        "avg_rating": avg_rating,
+        "discount_percent": discount_percent,
+        "category_name": category_name,
+    }
+
+
+async def helper_for_filters_with_review_and_discount(session, query):
     """
     Helper function to execute a query and extract product details with images and reviews.
     Args:
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
         query (Query): The query to execute.
     Returns:
         list: A list of dictionaries containing product details with images and reviews.
     """
     try:
         # Execute the query and get the results
-        result = session.execute(query).all()
+        result = (await session.execute(query)).all()
 
         if not result:
             raise HTTPException(status_code=404, detail="Products not found")
 
-        # Extract the Product, ProductImage, number of reviews, and average rating from the result
+        # Extract the Product, its images, number of reviews, average rating and latest discount from the result
+        # (searches also return their relevance, so the columns are read by name)
         products_with_images_and_reviews = [
-            {
-                "id": product.id,
-                "product_name": product.product_name,
-                "description": product.description,
-                "price": product.price,
-                "stock_quantity": product.stock_quantity,
-                "product_size": product.product_size,
-                "SKU": product.SKU,
-                "target_audience": product.target_audience,
-                "product_color": product.product_color,
-                "created_at": product.created_at,
-                "category_id": product.category_id,
-                "images": [{"id": image.id, "image_path": image.image_path} for image in product.images],
-                "num_reviews": num_reviews,
-                "avg_rating": avg_rating,
-                "discount_percent": avg_discount_percent,
-                "category_name": category_name,
-            }
-            for product, image,category_name, num_reviews, avg_rating, avg_discount_percent in result
+            product_listing_item(row.Product, row.images, row.category_name, row.num_reviews, row.avg_rating, row.latest_discount_percent)
+            for row in result
         ]
 
         return products_with_images_and_reviews
     except SQLAlchemyError as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")    
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
 
-def helper_for_getting_data_tranding(session, query):
+async def helper_for_listing_documents(session, query):
     """
-    Helper function to execute a query and extract product details with images and reviews.
+    Send a listing as the JSON written by postgres, without loading the products.
+    The body is the same as the FilterProductsProductCResponse list of helper_for_filters_with_review_and_discount.
     Args:
-        session (Session): The database session to execute the query.
-        query (Query): The query to execute.
+        session (AsyncSession): The database session to execute the query.
+        query (Query): A query of build_product_listing_query.
     Returns:
-        list: A list of dictionaries containing product details with images and reviews.
+        Response: The JSON array of the products.
+    Raises:
+        ResponseValidationError: If a product has NULL in a field the response model requires, as FastAPI
+            raises when it validates the list of helper_for_filters_with_review_and_discount.
     """
     try:
-        # Execute the query and get the results
-        result = session.execute(query).all()
-
-        if not result:
-            raise HTTPException(status_code=404, detail="Products not found")
-        # Extract the Product, ProductImage, number of reviews, average rating, and purchase count from the result
-        products_with_images_and_reviews = [
-            {
-                "id": product.id,
-                "product_name": product.product_name,
-                "description": product.description,
-                "price": product.price,
-                "stock_quantity": product.stock_quantity,
-                "product_size": product.product_size,
-                "SKU": product.SKU,
-                "target_audience": product.target_audience,
-                "product_color": product.product_color,
-                "created_at": product.created_at,
-                "category_id": product.category_id,
-                "images": [{"id": image.id, "image_path": image.image_path} for image in product.images],
-                "num_reviews": num_reviews,
-                "avg_rating": avg_rating,
-                "discount_percent": avg_discount_percent,
-                "purchase_count": purchase_count  # Include the purchase count in the result
-            }
-            for product, image, num_reviews, avg_rating, avg_discount_percent, purchase_count in result
-        ]
-        return products_with_images_and_reviews
+        documents = (await session.execute(listing_documents(query))).scalars().all()
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
-def helper_get_featured_products(session, query):
+    if not documents:
+        raise HTTPException(status_code=404, detail="Products not found")
+    invalid = [index for index, document in enumerate(documents) if document is None]
+    if invalid:
+        raise ResponseValidationError([
+            {"type": "null_field", "loc": ("response", index), "msg": "A required field of the product is NULL", "input": None}
+            for index in invalid
+        ])
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json")
+
+async def helper_get_featured_products(session, query):
     """
     Retrieves and organizes featured products with their images from the database.
 
     Args:
-        session: The session to execute the query.
+        session: The async session to execute the query.
         query: The query to retrieve the featured products.
 
     Returns:
         A list of dictionaries representing the featured products with their images.
     """
     try:
-        result = session.execute(query).all()
+        result = (await session.execute(query)).all()
 
-        # Use defaultdict to organize products with their images
-        products_dict = defaultdict(lambda: {"Product": None, "ProductImages": [], "num_reviews": 0, "avg_rating": None, "rownum": None, "discount_percent": None, "category_name": None})
+        # Use a dict to keep one entry per product in the order they were featured
+        products_dict = {}
 
-        for row in result:
+        for rownum, row in enumerate(result, start=1):
             product_id = row.Product.id
-            if not products_dict[product_id]["Product"]:
-                products_dict[product_id]["Product"] = row.Product
+            if product_id in products_dict:
+                continue
 
-            # Append each image to the ProductImages list
-            products_dict[product_id]["ProductImages"].append({"id": row.ProductImage.id, "product_id": product_id, "image_path": row.ProductImage.image_path})
-
-            # Sum up the reviews and calculate the average rating
-            products_dict[product_id]["num_reviews"] += row.num_reviews
-            if row.avg_rating is not None:
-                products_dict[product_id]["avg_rating"] = row.avg_rating
-
-            # Save the rownum for each product
-            products_dict[product_id]["rownum"] = row.rownum
-            products_dict[product_id]["discount_percent"] = row.latest_discount_percent
-            products_dict[product_id]["category_name"] = row.category_name
+            products_dict[product_id] = {
+                "Product": row.Product,
+                # Each image of the product with its product id
+                "ProductImages": [{**image, "product_id": product_id} for image in row.images],
+                "num_reviews": row.num_reviews,
+                "avg_rating": row.avg_rating,
+                "rownum": rownum,
+                "discount_percent": row.latest_discount_percent,
+                "category_name": row.category_name,
+            }
 
         # Convert the dictionary values to a list of results
         final_result = [result for result in products_dict.values()]
 
         return final_result
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+async def helper_for_product_page(session, limit: int, cursor: str = None, sort: str = "id", **filters):
+    """
+    Build, execute and page a keyset paginated product listing.
+    One extra row is fetched to know whether there is a next page.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        limit (int): The page size.
+        cursor (str): The next_cursor of the previous page, None for the first page.
+        sort (str): The sort key of the listing.
+        **filters: Filters passed to build_product_listing_query.
+    Returns:
+        dict: The items of the page and the cursor of the next page (None on the last page),
+            a search without results has no items and a did_you_mean suggestion.
+    """
+    # The hot listings are picked from the catalog snapshot of this worker when it is enabled
+    if catalog_snapshot.answers(sort, filters):
+        return await helper_for_snapshot_page(session=session, limit=limit, cursor=cursor, sort=sort, **filters)
+
+    after = decode_cursor(cursor, sort) if cursor else None
+    query = build_product_listing_query(sort=sort, after=after, number=limit + 1, **filters)
+    featured = filters.get("featured_only", False)
+
+    try:
+        result = (await session.execute(query)).all()
+
+        # Only the first page is missing products, later pages may just be empty.
+        # A search that finds nothing suggests the closest product or category name instead.
+        if not result and cursor is None:
+            if filters.get("search_keyword") is not None:
+                return {"items": [], "next_cursor": None, "did_you_mean": await did_you_mean(session, filters["search_keyword"])}
+            raise HTTPException(status_code=404, detail="Products not found")
+
+        next_cursor = None
+        if len(result) > limit:
+            result = result[:limit]
+            next_cursor = encode_cursor(sort, listing_cursor_values(sort, result[-1]))
+
+        if featured:
+            items = [
+                {
+                    "Product": row.Product,
+                    "ProductImages": [{**image, "product_id": row.Product.id} for image in row.images],
+                    "num_reviews": row.num_reviews,
+                    "avg_rating": row.avg_rating,
+                    "discount_percent": row.latest_discount_percent,
+                    "category_name": row.category_name,
+                }
+                for row in result
+            ]
+        else:
+            items = [
+                product_listing_item(row.Product, row.images, row.category_name, row.num_reviews, row.avg_rating, row.latest_discount_percent)
+                for row in result
+            ]
+
+        return {"items": items, "next_cursor": next_cursor}
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+async def hydrate_products(session, product_ids):
+    """
+    Load the listing details of products picked outside of the database (search engine, catalog snapshot).
+    Only the products of the page are read, in a single listing query.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        product_ids (list): The IDs of the products in the order they are listed.
+    Returns:
+        list: The product details with images and reviews in the given order.
+    """
+    if not product_ids:
+        return []
+
+    try:
+        result = (await session.execute(build_product_listing_query(product_ids=product_ids))).all()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    items = {
+        row.Product.id: product_listing_item(row.Product, row.images, row.category_name, row.num_reviews, row.avg_rating, row.latest_discount_percent)
+        for row in result
+    }
+    # A product deleted since the index or the snapshot was built is skipped
+    return [items[product_id] for product_id in product_ids if product_id in items]
+
+
+async def hydrate_search_hits(session, hits):
+    """
+    Load the listing details of the products found by the in-memory search engine.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        hits (list): (product id, score) of the products, best match first.
+    Returns:
+        list: The product details with images and reviews in the order of the hits.
+    """
+    return await hydrate_products(session, [product_id for product_id, score in hits])
+
+
+async def helper_for_search_engine_results(session, search_keyword: str, startindex: int, number: int):
+    """
+    Search products with the in-memory search engine, paged by offset.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        search_keyword (str): The keyword to search for.
+        startindex (int): The number of products to skip.
+        number (int): The number of products to return.
+    Returns:
+        list: The product details with images and reviews, best match first.
+    """
+    hits = search_engine.search_index.search(search_keyword, clamp_page_size(number), offset=max(startindex, 0))
+    items = await hydrate_search_hits(session, hits)
+    if not items:
+        raise HTTPException(status_code=404, detail="Products not found")
+    return items
+
+
+async def helper_for_search_engine_page(session, search_keyword: str, limit: int, cursor: str = None):
+    """
+    Search a page of products with the in-memory search engine, best match first.
+    The cursor holds the score and ID of the last product of the previous page.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        search_keyword (str): The keyword to search for.
+        limit (int): The page size.
+        cursor (str): The next_cursor of the previous page, None for the first page.
+    Returns:
+        dict: The items of the page and the cursor of the next page (None on the last page).
+    """
+    after = None
+    if cursor:
+        after = decode_cursor(cursor, "relevance")
+        if len(after) != 2 or not all(isinstance(value, (int, float)) for value in after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    hits = search_engine.search_index.search(search_keyword, limit + 1, after=tuple(after) if after else None)
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_cursor("relevance", [hits[-1][1], hits[-1][0]])
+
+    return {"items": await hydrate_search_hits(session, hits), "next_cursor": next_cursor}
+
+
+async def helper_for_snapshot_results(session, startindex: int, number: int, sort: str = "id", **filters):
+    """
+    A listing picked from the catalog snapshot, paged by offset.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        startindex (int): The number of products to skip.
+        number (int): The number of products to return.
+        sort (str): The sort key of the listing.
+        **filters: Filters of catalog_snapshot.SNAPSHOT_FILTERS.
+    Returns:
+        list: The product details with images and reviews.
+    """
+    snapshot = catalog_snapshot.snapshot
+    rows = snapshot.select(sort, clamp_page_size(number), offset=max(startindex, 0), **filters)
+    items = await hydrate_products(session, [snapshot.ids[row] for row in rows])
+    if not items:
+        raise HTTPException(status_code=404, detail="Products not found")
+    return items
+
+
+async def helper_for_snapshot_page(session, limit: int, cursor: str = None, sort: str = "id", **filters):
+    """
+    A keyset paginated listing picked from the catalog snapshot.
+    The cursors are the ones of helper_for_product_page, so a listing can be paged by both.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        limit (int): The page size.
+        cursor (str): The next_cursor of the previous page, None for the first page.
+        sort (str): The sort key of the listing.
+        **filters: Filters of catalog_snapshot.SNAPSHOT_FILTERS.
+    Returns:
+        dict: The items of the page and the cursor of the next page (None on the last page).
+    """
+    snapshot = catalog_snapshot.snapshot
+    after = None
+    if cursor:
+        try:
+            after = snapshot.cursor_key(sort, decode_cursor(cursor, sort))
+        except (ValueError, TypeError, ArithmeticError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    rows = snapshot.select(sort, limit + 1, after=after, **filters)
+    if not rows and cursor is None:
+        raise HTTPException(status_code=404, detail="Products not found")
+
+    values = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        values = snapshot.cursor_values(sort, rows[-1])
+
+    items = await hydrate_products(session, [snapshot.ids[row] for row in rows])
+
+    next_cursor = None
+    if values is not None:
+        if sort == "top_rated" and items and items[-1]["id"] == values[-1]:
+            # The exact average of the database, a float would not page the SQL listing exactly
+            values[0] = items[-1]["avg_rating"] or 0
+        next_cursor = encode_cursor(sort, values)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def facets_from_rows(rows):
+    """
+    Turn the rows of build_facet_query into the facet counts returned to the client.
+    Args:
+        rows (list): The rows of the facet query.
+    Returns:
+        tuple: The number of products matching every filter and the counts of every facet
+            (most products first, price buckets in price order).
+    """
+    total = 0
+    facets = {facet: [] for facet in FACETS}
+    for row in rows:
+        # The set grouped by one facet has only the bit of that facet clear
+        facet = next((facet for bit, facet in enumerate(reversed(FACETS)) if not row.grouping & (1 << bit)), None)
+        if facet is None:
+            total = row.total
+            continue
+
+        count, value = getattr(row, f"{facet}_count"), getattr(row, facet)
+        if not count or value is None:
+            continue
+        if facet == "price":
+            facets[facet].append({
+                "min_price": PRICE_BUCKETS[value - 1] if value else 0,
+                "max_price": PRICE_BUCKETS[value] if value < len(PRICE_BUCKETS) else None,
+                "count": count,
+            })
+        elif facet == "category":
+            facets[facet].append({"value": value, "label": row.category_name, "count": count})
+        else:
+            facets[facet].append({"value": value, "count": count})
+
+    for facet in FACETS:
+        if facet != "price":
+            facets[facet].sort(key=lambda item: (-item["count"], str(item["value"])))
+    facets["price"].sort(key=lambda item: item["min_price"])
+    return total, facets
+
+
+async def get_facets(session, **filters):
+    """
+    Count the products matching the filters per facet value, in one query.
+    The counts of the unfiltered catalog are the same for every shopper, so they are reused
+    for FACET_CACHE_SECONDS.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        **filters: Filters passed to build_facet_query.
+    Returns:
+        tuple: The number of matching products and the counts of every facet.
+    """
+    unfiltered = all(value is None for value in filters.values())
+    if not unfiltered:
+        return facets_from_rows((await session.execute(build_facet_query(**filters))).all())
+    if _unfiltered_facets["expires"] > time.monotonic():
+        return _unfiltered_facets["total"], _unfiltered_facets["facets"]
+
+    async def count_unfiltered():
+        total, facets = facets_from_rows((await session.execute(build_facet_query(**filters))).all())
+        _unfiltered_facets.update(expires=time.monotonic() + FACET_CACHE_SECONDS, total=total, facets=facets)
+        return total, facets
+
+    # When the counts expire, the concurrent requests wait for one of them to count again
+    return await _facet_flights.do("unfiltered", count_unfiltered)
+
+
+async def helper_for_faceted_page(session, limit: int, cursor: str = None, sort: str = "id", **filters):
+    """
+    A keyset paginated page of the products matching the filters, with the facet counts.
+    Facets describe the whole result, so only the first page counts them.
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        limit (int): The page size.
+        cursor (str): The next_cursor of the previous page, None for the first page.
+        sort (str): The sort key of the listing.
+        **filters: Filters passed to build_product_listing_query and build_facet_query.
+    Returns:
+        dict: The items of the page, the cursor of the next page (None on the last page) and,
+            on the first page, the total and the facet counts.
+    """
+    after = decode_cursor(cursor, sort) if cursor else None
+    query = build_product_listing_query(sort=sort, after=after, number=limit + 1, **filters)
+
+    try:
+        result = (await session.execute(query)).all()
+
+        next_cursor = None
+        if len(result) > limit:
+            result = result[:limit]
+            next_cursor = encode_cursor(sort, listing_cursor_values(sort, result[-1]))
+
+        items = [
+            product_listing_item(row.Product, row.images, row.category_name, row.num_reviews, row.avg_rating, row.latest_discount_percent)
+            for row in result
+        ]
+
+        total = facets = None
+        if cursor is None:
+            total, facets = await get_facets(session, **filters)
+
+        return {"items": items, "next_cursor": next_cursor, "total": total, "facets": facets}
+    except SQLAlchemyError as e:
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
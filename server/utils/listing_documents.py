@@ -0,0 +1,211 @@
+import os
+from typing import get_args
+
+from dotenv import load_dotenv
+from sqlalchemy import Text, literal_column
+from sqlalchemy.dialects import postgresql
+
+from server.models.models import Product, ProductCategory, ProductImage
+from server.db.fliter_product_with_reviews_helper import review_stats_table
+from server.schemas.filter_products_schemas import FilterProductsProductCResponse, FilterProductsProductImage
+
+load_dotenv()
+
+# Let postgres write the JSON of the product listings, the endpoints send its text as the response body
+# instead of loading Product objects and validating them against the response model
+LISTING_DOCUMENTS_ENABLED: bool = os.getenv("LISTING_DOCUMENTS_ENABLED", "false").lower() == "true"
+
+
+def _sql(column) -> str:
+    """
+    The SQL of a column of the listing query, e.g. products."SKU".
+    """
+    return str(column.compile(dialect=postgresql.dialect()))
+
+
+# The json_* functions give NULL for NULL, json_object writes null for the fields of the model that allow it
+
+def json_string(sql: str) -> str:
+    """
+    The value as a JSON string, escaped by postgres the way json.dumps(ensure_ascii=False) escapes it.
+    """
+    return f"to_json({sql})::text"
+
+
+def json_integer(sql: str) -> str:
+    """
+    The value as a JSON number.
+    """
+    return f"({sql})::text"
+
+
+def json_float(sql: str) -> str:
+    """
+    The value as a JSON number written like orjson writes the float (20.0 instead of 20, 1e20 instead of 1e+20).
+    Postgres prints the same shortest digits, but switches to exponents below 1e-4 and from 1e15 where orjson
+    does below 1e-5 and from 1e16: the numbers between are written again as numeric, without the exponent.
+    The whole numbers between 2^54 and 2^62, that no price reaches, postgres writes with all their digits.
+    """
+    value = f"({sql})::float8"
+    text = f"{value}::text"
+    return (
+        f"CASE WHEN {text} IN ('NaN', 'Infinity', '-Infinity') THEN 'null' "
+        f"WHEN {value} = 0 THEN {text} || '.0' "
+        f"WHEN {value} = trunc({value}) AND abs({value}) < 1e16 THEN {value}::bigint::text || '.0' "
+        f"WHEN abs({value}) >= 1e-5 AND abs({value}) < 1e16 THEN {text}::numeric::text "
+        rf"ELSE regexp_replace({text}, 'e\+?(-?)0*', 'e\1') END"
+    )
+
+
+def json_datetime(sql: str) -> str:
+    """
+    The timestamp as the JSON string pydantic writes for a datetime in UTC (no fraction when it is zero).
+    """
+    utc = f"({sql} AT TIME ZONE 'UTC')"
+    return (
+        f"""'"' || to_char({utc}, 'YYYY-MM-DD"T"HH24:MI:SS') """
+        f"|| CASE WHEN to_char({utc}, 'US') = '000000' THEN '' ELSE '.' || to_char({utc}, 'US') END "
+        f"""|| 'Z"'"""
+    )
+
+
+def json_object(model, values: dict) -> str:
+    """
+    A JSON object with the fields of the response model in the order FastAPI writes them.
+    Args:
+        model (BaseModel): The response model.
+        values (dict): The SQL of the JSON text of every field of the model.
+    Returns:
+        str: The SQL of the text of the object, compact like the responses of FastAPI. NULL when a field
+            the model requires is NULL, the response model refuses that row on the ORM path.
+    Raises:
+        KeyError: If a field of the model has no value, so a changed schema fails at import instead of
+            silently sending a different document.
+    """
+    parts = []
+    for position, (field, info) in enumerate(model.model_fields.items()):
+        parts.append("'" + ("{" if position == 0 else ",") + f'"{field}":' + "'")
+        if type(None) in get_args(info.annotation):
+            parts.append(f"coalesce({values[field]}, 'null')")
+        else:
+            parts.append(f"({values[field]})")
+    parts.append("'}'")
+    return " || ".join(parts)
+
+
+def product_images_document() -> str:
+    """
+    The images of the product as the JSON array of the listings, aggregated by a correlated subquery.
+    Returns:
+        str: The SQL of the text of the array ordered by image id, [] without images.
+            NULL when an image has NULL in a required field (string_agg would leave it out).
+    """
+    image = json_object(FilterProductsProductImage, {
+        "id": json_integer(_sql(ProductImage.id)),
+        "image_path": json_string(_sql(ProductImage.image_path)),
+    })
+    return (
+        f"SELECT CASE WHEN count(*) > count({image}) THEN NULL "
+        f"ELSE '[' || coalesce(string_agg({image}, ',' ORDER BY {_sql(ProductImage.id)}), '') || ']' END "
+        f"FROM {ProductImage.__tablename__} WHERE {_sql(ProductImage.product_id)} = {_sql(Product.id)}"
+    )
+
+
+def product_document() -> str:
+    """
+    The JSON of a product in the listings, the FilterProductsProductCResponse of the row.
+    Returns:
+        str: The SQL of the text of the product, it reads the tables joined by build_product_listing_query.
+            NULL for a product the response model refuses.
+    """
+    review_stats = review_stats_table()
+    return json_object(FilterProductsProductCResponse, {
+        "id": json_integer(_sql(Product.id)),
+        "product_name": json_string(_sql(Product.product_name)),
+        "description": json_string(_sql(Product.description)),
+        "price": json_float(_sql(Product.price)),
+        "stock_quantity": json_integer(_sql(Product.stock_quantity)),
+        "product_size": json_string(_sql(Product.product_size)),
+        "target_audience": json_string(_sql(Product.target_audience)),
+        "SKU": json_string(_sql(Product.SKU)),
+        "product_color": json_string(_sql(Product.product_color)),
+        "category_id": json_integer(_sql(Product.category_id)),
+        "images": product_images_document(),
+        "created_at": json_datetime(_sql(Product.created_at)),
+        "num_reviews": json_integer(f"coalesce({_sql(review_stats.c.num_reviews)}, 0)"),
+        "avg_rating": json_float(_sql(review_stats.c.avg_rating)),
+        "discount_percent": json_float(_sql(Product.current_discount_percent)),
+        "category_name": json_string(_sql(ProductCategory.category_name)),
+    })
+
+
+# Written once as SQL text: an expression tree of this size would cost more to hash into
+# the statement cache key on every request than building the response in Python
+PRODUCT_DOCUMENT = literal_column(product_document(), Text).label("document")
+
+
+def listing_documents(query):
+    """
+    Replace the columns of a listing by the JSON text of its products.
+    Args:
+        query (Select): A query of build_product_listing_query (without include_image).
+    Returns:
+        Select: One text column per product, in the order of the listing, NULL for the products with NULL
+            in a field the response model requires.
+    """
+    return query.with_only_columns(PRODUCT_DOCUMENT)
+
+if __name__ == "__main__":
+    # Compare with the responses of the ORM listings and measure the CPU time of both:
+    # python -m server.utils.listing_documents
+    import asyncio
+    import statistics
+    import time
+    from typing import List
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from server.db.db import AsyncSessionLocal
+    from server.db.fliter_product_with_reviews_helper import build_product_listing_query
+    from server.utils import helper_for_getting_data
+
+    listings = {
+        "first page": {},
+        "page 50": {"startindex": 49 * 20},
+        "by price": {"sort": "price_desc"},
+        "top rated": {"sort": "top_rated", "min_reviews": 1},
+        "on sale": {"on_sale": True, "sort": "effective_price_asc"},
+        "search": {"search_keyword": "shoe", "sort": "relevance"},
+    }
+    response_model = TypeAdapter(List[FilterProductsProductCResponse])
+
+    def orm_response(items):
+        # What FastAPI does with the list returned by the endpoint
+        return JSONResponse(jsonable_encoder(response_model.dump_python(response_model.validate_python(items), mode="json")))
+
+    async def measure(function, repeat=50):
+        cpu = []
+        for _ in range(repeat):
+            started = time.process_time()
+            body = (await function()).body
+            cpu.append((time.process_time() - started) * 1000)
+        return statistics.median(cpu), body
+
+    async def main():
+        async with AsyncSessionLocal() as session:
+            for name, arguments in listings.items():
+                for number in (20, 100):
+                    query = build_product_listing_query(number=number, **arguments)
+
+                    async def orm():
+                        return orm_response(await helper_for_getting_data.helper_for_filters_with_review_and_discount(session, query))
+
+                    async def documents():
+                        return await helper_for_getting_data.helper_for_listing_documents(session, query)
+
+                    orm_ms, expected = await measure(orm)
+                    documents_ms, body = await measure(documents)
+                    print(f"{name:>12} {number:>4} products: ORM {orm_ms:7.2f} ms CPU, documents {documents_ms:7.2f} ms CPU"
+                          f"{'' if body == expected else '  (DIFFERENT BODY)'}")
+
+    asyncio.run(main())
@@ -4,9 +4,11 @@ from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
 from dotenv import load_dotenv
-from server.schemas import token_schemas
-from server.models.models1 import session as db
+from server.schemas import token_schemas, user_schemas
+from sqlalchemy import select
+from server.db.db import AsyncSessionLocal
 from server.models.models import User
+from server.utils.shared_cache import LocalCache, TwoLevelCache, shared_store
 
 
 # following code is for debugging
@@ -23,6 +25,13 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES= int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 ACCESS_TOKEN_EXPIRE_DAY = int(os.getenv("ACCESS_TOKEN_EXPIRE_DAY"))
+# Seconds the user record read to check the token version is reused, 0 reads it on every request.
+# Revocations reach every worker right away through the shared cache (SHARED_CACHE_STORAGE)
+USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+# Upper bound of users cached in each worker before the least recently used ones are evicted
+USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+
+user_cache = TwoLevelCache("users", LocalCache(USER_CACHE_MAX_ENTRIES), shared_store())
 
 def create_access_token(data: dict):
     """
@@ -90,24 +99,100 @@ def verify_access_token(token: str, credentials_exeception):
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def user_tag(user_id: int) -> str:
+    """The tag of the cached record of the user."""
+    return f"user:{user_id}"
+
+
+async def get_user_record(user_id: int):
+    """
+    The record of a user, from the user cache or the database.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        user_schemas.CurrentUser: The user, None if it does not exist.
+    """
+    key = str(user_id)
+    generation = user_cache.generation
+    if USER_CACHE_TTL_SECONDS > 0:
+        cached = await user_cache.get_async(key)
+        if cached is not None:
+            return user_schemas.CurrentUser.model_validate_json(cached)
+
+    async with AsyncSessionLocal() as session:
+        user = (await session.execute(select(User).filter(User.id == user_id))).scalars().first()
+    if user is None:
+        return None
+
+    record = user_schemas.CurrentUser.model_validate(user, from_attributes=True)
+    if USER_CACHE_TTL_SECONDS > 0:
+        await user_cache.set_async(key, record.model_dump_json().encode(), [user_tag(user_id)], USER_CACHE_TTL_SECONDS, generation)
+    return record
+
+
+def forget_user(user_id: int):
+    """
+    Drop the cached record of the user in every worker, after a committed change of the user
+    (e.g. its token version).
+
+    Args:
+        user_id (int): The id of the user.
+    """
+    user_cache.invalidate(user_tag(user_id))
+
+
+async def forget_user_async(user_id: int):
+    """forget_user for the event loop, the invalidation is logged in the threadpool."""
+    await user_cache.invalidate_async(user_tag(user_id))
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)):
     """
-    Retrieves the current user based on the provided token.
+    The caller of the request from the claims of its access token, for authorization checks
+    (current_user.id, current_user.role). No query runs while the user record is cached.
 
     Parameters:
     - token (str): The access token used to authenticate the user. Defaults to `Depends(oauth2_scheme)`.
 
     Returns:
-    - user: The user object associated with the token.
+    - token_schemas.Principal: The id and role of the user.
+
+    Raises:
+    - HTTPException: 401 if the token is invalid, its user does not exist or its version was revoked.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not varify the credentails", headers={"WWW-Authenticate": "Bearer"})
 
-    token = verify_access_token(token, credentials_exception)
-    # print(token.id)
-    user = db.query(User).filter(User.id == token.id).first()
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload["user_id"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise credentials_exception
+
+    # Tokens issued before token versions carry none, they count as version 0
+    token_version = payload.get("ver", 0)
+    user = await get_user_record(user_id)
+    if user is None or token_version != user.token_version:
+        raise credentials_exception
 
-    return user
+    # The role is the one the token was issued with: changing the role of a user bumps its token version
+    # (trigger of the users table), which revokes the tokens once its cached record expires
+    return token_schemas.Principal(id=user_id, role=payload.get("role"), token_version=token_version)
+
+
+async def get_current_user(principal: token_schemas.Principal = Depends(get_current_principal)):
+    """
+    Retrieves the current user for the endpoints needing more than its id and role.
+
+    Parameters:
+    - principal (token_schemas.Principal): The caller of the request. Defaults to `Depends(get_current_principal)`.
+
+    Returns:
+    - user_schemas.CurrentUser: The user record, from the user cache.
+    """
+    return await get_user_record(principal.id)
 
 # Function to decode JWT token
 def decode_jwt_token(token: str):
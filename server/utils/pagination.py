@@ -0,0 +1,84 @@
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+load_dotenv()
+
+# Largest page any listing endpoint returns, also caps the legacy {number} path parameters
+MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", 100))
+# Page size used when the client does not send a limit
+DEFAULT_PAGE_SIZE: int = int(os.getenv("DEFAULT_PAGE_SIZE", 20))
+
+
+def clamp_page_size(number: int) -> int:
+    """
+    Cap the number of rows a listing may return.
+
+    Args:
+        number (int): The number of rows requested by the client.
+
+    Returns:
+        int: The number of rows the server is willing to return.
+    """
+    return max(0, min(number, MAX_PAGE_SIZE))
+
+
+def _json_default(value):
+    """
+    Serialize the sort values json does not know about.
+
+    Args:
+        value: A datetime or Decimal sort value.
+
+    Returns:
+        str: The value as a string.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Can not encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    """
+    Create the opaque cursor pointing right after the given row.
+
+    Args:
+        sort (str): The sort key of the listing.
+        values (list): The sort values of the last row of the page (ending with its id).
+
+    Returns:
+        str: The url safe cursor token.
+    """
+    payload = json.dumps({"s": sort, "v": values}, default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    """
+    Read the sort values back from a cursor token.
+
+    Args:
+        cursor (str): The cursor sent by the client.
+        sort (str): The sort key of the listing the cursor is used with.
+
+    Returns:
+        list: The sort values of the last row of the previous page.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed or belongs to another sort order.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["s"] != sort or not isinstance(payload["v"], list):
+            raise ValueError
+        return payload["v"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -1,41 +1,329 @@
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
 from fastapi import HTTPException, Request, status
-from typing import List
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+
+load_dotenv()
+
+# "memory" keeps the counters inside the worker (handy for tests and single worker runs),
+# "sqlite:///path/to/file" shares them between every uvicorn worker on the host.
+RATE_LIMIT_STORAGE: str = os.getenv(
+    "RATE_LIMIT_STORAGE",
+    f"sqlite:///{os.path.join(tempfile.gettempdir(), 'online_store_rate_limit.sqlite3')}",
+)
+# Upper bound of client keys the in-memory store keeps before evicting the least recently used
+RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+# Header set by the proxy in front of the app with the real client ip (e.g. "Fly-Client-IP").
+# For a list like X-Forwarded-For the right-most entry is used, the one appended by the proxy
+RATE_LIMIT_IP_HEADER: str = os.getenv("RATE_LIMIT_IP_HEADER", "")
+# Comma separated API keys issued to clients, each gets its own limit. Other keys sent in the
+# x-api-key header are ignored, the client is limited by user or ip
+RATE_LIMIT_API_KEYS: str = os.getenv("RATE_LIMIT_API_KEYS", "")
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+
+
+def _estimate(previous: int, current: int, elapsed: float) -> float:
+    """
+    Sliding window counter estimate of the calls made during the last time frame.
+
+    Args:
+        previous (int): Number of calls counted in the previous fixed window.
+        current (int): Number of calls counted in the current fixed window.
+        elapsed (float): Fraction (0..1) of the current window that has already passed.
+
+    Returns:
+        float: The weighted number of calls inside the sliding window.
+    """
+    return previous * (1 - elapsed) + current
 
-def rate_limited(max_calls: int, time_frame: int):
+
+class MemoryRateLimitStore:
+    """
+    Keeps two fixed window counters per client key inside the current process.
+    Memory is bounded by evicting the least recently seen keys.
     """
-    Decorator function that limits the number of calls to a function within a specified time frame.
-    
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.counters: "OrderedDict[str, list]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key: str, window: int, elapsed: float, max_calls: int, time_frame: int) -> Tuple[bool, float]:
+        """
+        Count one call for the key if it still fits into the limit.
+
+        Args:
+            key (str): The client key (scope + identity).
+            window (int): Index of the current fixed window.
+            elapsed (float): Fraction of the current window that has already passed.
+            max_calls (int): The maximum number of calls allowed in the time frame.
+            time_frame (int): Length of the window in seconds (unused, windows are rolled in place).
+
+        Returns:
+            tuple: (allowed, estimated number of calls in the sliding window).
+        """
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = [window, 0, 0]
+                self.counters[key] = counter
+                if len(self.counters) > self.max_keys:
+                    self.counters.popitem(last=False)
+            else:
+                self.counters.move_to_end(key)
+
+            # Roll the fixed windows forward: [window, previous count, current count]
+            if counter[0] != window:
+                counter[1] = counter[2] if counter[0] == window - 1 else 0
+                counter[2] = 0
+                counter[0] = window
+
+            estimate = _estimate(counter[1], counter[2], elapsed)
+            if estimate >= max_calls:
+                return False, estimate
+            counter[2] += 1
+            return True, estimate + 1
+
+
+class SQLiteRateLimitStore:
+    """
+    Keeps the fixed window counters in a local SQLite file so that every worker
+    process on the host shares the same limits.
+    """
+
+    # Expired windows are deleted once every PRUNE_EVERY hits
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " key TEXT NOT NULL,"
+            " window INTEGER NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (key, window)"
+            ") WITHOUT ROWID"
+        )
+
+    def hit(self, key: str, window: int, elapsed: float, max_calls: int, time_frame: int) -> Tuple[bool, float]:
+        """
+        Count one call for the key if it still fits into the limit.
+
+        The read and the increment run inside one IMMEDIATE transaction, so
+        concurrent workers can not both take the last free slot.
+
+        Args:
+            key (str): The client key (scope + identity).
+            window (int): Index of the current fixed window.
+            elapsed (float): Fraction of the current window that has already passed.
+            max_calls (int): The maximum number of calls allowed in the time frame.
+            time_frame (int): Length of the window in seconds, used to expire old rows.
+
+        Returns:
+            tuple: (allowed, estimated number of calls in the sliding window).
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                rows = dict(cursor.execute(
+                    "SELECT window, count FROM rate_limits WHERE key = ? AND window IN (?, ?)",
+                    (key, window - 1, window),
+                ).fetchall())
+                estimate = _estimate(rows.get(window - 1, 0), rows.get(window, 0), elapsed)
+                allowed = estimate < max_calls
+                if allowed:
+                    cursor.execute(
+                        "INSERT INTO rate_limits (key, window, count, expires_at) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (key, window) DO UPDATE SET count = count + 1",
+                        (key, window, (window + 2) * time_frame),
+                    )
+                    estimate += 1
+
+                self.hits += 1
+                if self.hits % self.PRUNE_EVERY == 0:
+                    cursor.execute("DELETE FROM rate_limits WHERE expires_at < ?", (time.time(),))
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            return allowed, estimate
+
+
+def _create_store():
+    """
+    Create the rate limit store configured with the RATE_LIMIT_STORAGE setting.
+
+    Returns:
+        The store used by every rate limited endpoint in this process.
+    """
+    if RATE_LIMIT_STORAGE.startswith("sqlite:///"):
+        return SQLiteRateLimitStore(RATE_LIMIT_STORAGE[len("sqlite:///"):])
+    return MemoryRateLimitStore()
+
+
+store = _create_store()
+
+# Digests of the issued API keys, the keys themselves are not kept
+api_key_digests = frozenset(
+    hashlib.sha256(api_key.strip().encode()).hexdigest()[:32] for api_key in RATE_LIMIT_API_KEYS.split(",") if api_key.strip()
+)
+
+
+def client_identity(request: Request) -> str:
+    """
+    Identify the client making the request.
+
+    An issued API key wins over the user id from the bearer token, which wins
+    over the client ip address. Unknown API keys are ignored, a new random key
+    per request must not get a new limit.
+
+    Args:
+        request (Request): The incoming request.
+
+    Returns:
+        str: The identity the rate limit is counted against.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        digest = hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        if digest in api_key_digests:
+            return "key:" + digest
+
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("user_id") is not None:
+                return f"user:{payload['user_id']}"
+        except JWTError:
+            # Invalid tokens are limited by ip like anonymous clients
+            pass
+
+    if RATE_LIMIT_IP_HEADER and request.headers.get(RATE_LIMIT_IP_HEADER):
+        # Entries left of the proxy's own are sent by the client and can be anything
+        return "ip:" + request.headers[RATE_LIMIT_IP_HEADER].split(",")[-1].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def check_rate_limit(request: Request, scope: str, max_calls: int, time_frame: int) -> Dict[str, str]:
+    """
+    Count the request against the limit of the client for the given scope.
+
+    Args:
+        request (Request): The incoming request.
+        scope (str): Name of the limited endpoint.
+        max_calls (int): The maximum number of calls allowed within the time frame.
+        time_frame (int): The time frame in seconds.
+
+    Returns:
+        dict: The X-RateLimit-* headers for the response.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header when the limit is exceeded.
+    """
+    now = time.time()
+    window, offset = divmod(now, time_frame)
+    window = int(window)
+    elapsed = offset / time_frame
+    key = f"{scope}|{client_identity(request)}"
+
+    allowed, estimate = store.hit(key, window, elapsed, max_calls, time_frame)
+
+    reset = math.ceil(time_frame - offset)
+    headers = {
+        "X-RateLimit-Limit": str(max_calls),
+        "X-RateLimit-Remaining": str(max(0, math.floor(max_calls - estimate))),
+        "X-RateLimit-Reset": str(reset),
+    }
+    if not allowed:
+        headers["Retry-After"] = str(max(1, reset))
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded", headers=headers)
+    return headers
+
+
+def rate_limited(max_calls: int, time_frame: int, scope: str = None):
+    """
+    Decorator function that limits the number of calls every client can make to a function within a specified time frame.
+
+    Clients are identified by API key, user id from the JWT or ip address (see client_identity)
+    and counted with a sliding window counter, so every request costs O(1) regardless of traffic.
+
     Parameters:
         max_calls (int): The maximum number of calls allowed within the time frame.
         time_frame (int): The time frame in seconds within which the maximum number of calls is enforced.
-    
+        scope (str): Name the limit is counted under. Defaults to the module and name of the function.
+
     Returns:
         decorator: The decorator function that wraps the original function.
     """
     def decorator(func):
         """
         Decorator function that limits the rate of calls to the wrapped function.
-        
+
         Args:
             func: The function to be wrapped.
             request: The request object.
             *args: Variable length argument list.
             **kwargs: Arbitrary keyword arguments.
-        
+
         Returns:
             The result of the wrapped function call.
         """
-        calls = []
-        @wraps(func)
-        async def wrapper(request: Request, *args, **kwargs):
-            now = time.time()
-            calls_in_time_frame = [call for call in calls if call > now - time_frame]
-            if len(calls_in_time_frame) >= max_calls:
-                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
-            calls.append(now)
-            return await func(request, *args, **kwargs)  # Added 'await' here
-        
+        limit_scope = scope or f"{func.__module__}.{func.__qualname__}"
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(request: Request, *args, **kwargs):
+                if isinstance(store, SQLiteRateLimitStore):
+                    # The SQLite transaction may wait on the other workers, not on the event loop
+                    request.state.rate_limit_headers = await run_in_threadpool(
+                        check_rate_limit, request, limit_scope, max_calls, time_frame
+                    )
+                else:
+                    request.state.rate_limit_headers = check_rate_limit(request, limit_scope, max_calls, time_frame)
+                return await func(request, *args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(request: Request, *args, **kwargs):
+                request.state.rate_limit_headers = check_rate_limit(request, limit_scope, max_calls, time_frame)
+                return func(request, *args, **kwargs)
+
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+async def add_rate_limit_headers(request: Request, call_next):
+    """
+    HTTP middleware that copies the X-RateLimit-* headers computed by rate_limited onto the response.
+
+    Args:
+        request (Request): The incoming request.
+        call_next: The next handler in the middleware chain.
+
+    Returns:
+        Response: The response of the endpoint with the rate limit headers.
+    """
+    response = await call_next(request)
+    response.headers.update(getattr(request.state, "rate_limit_headers", {}))
+    return response
@@ -0,0 +1,366 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import AsyncExitStack
+from enum import Enum
+from functools import wraps
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.db.db import AsyncSessionLocal
+from server.utils.serialization import typed_response
+from server.utils.shared_cache import LocalCache, TwoLevelCache, shared_store
+from server.utils.single_flight import SingleFlight
+
+load_dotenv()
+
+# Keep the JSON of the anonymous catalog endpoints (listings, categories, banners) in the worker and in the
+# store shared by the workers (SHARED_CACHE_STORAGE), serve it again until it expires or a write invalidates it
+RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+# Seconds a cached response is served
+RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 60))
+# Upper bound of responses cached in each worker before the least recently used ones are evicted
+RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+# Seconds an expired response of the endpoints cached with stale_while_revalidate is still served,
+# while one background request builds it again
+RESPONSE_CACHE_STALE_SECONDS: int = int(os.getenv("RESPONSE_CACHE_STALE_SECONDS", 30))
+# Send a weak ETag with the responses of the cached endpoints and answer a matching If-None-Match with 304
+# before running their queries. The ETag is derived from the version of the cache, which every write
+# invalidating it changes, so it is known without building the response
+CONDITIONAL_GET_ENABLED: bool = os.getenv("CONDITIONAL_GET_ENABLED", "false").lower() == "true"
+# max-age of the Cache-Control header of the cached endpoints, with 0 clients and CDNs keep the response
+# but revalidate it with its ETag on every use
+CACHE_CONTROL_MAX_AGE_SECONDS: int = int(os.getenv("CACHE_CONTROL_MAX_AGE_SECONDS", 0))
+
+# Invalidation tags. Every cached response carries the tags of what it shows, writes invalidate
+# the tags of what they change:
+# products - which products a listing shows (a product is created, updated or deleted)
+PRODUCTS = "products"
+# reviews - listings ordered or filtered by rating
+REVIEWS = "reviews"
+# sales - listings ordered or filtered by discount
+SALES = "sales"
+FEATURED = "featured"
+BANNERS = "banners"
+# categories - the category endpoints
+CATEGORIES = "categories"
+
+
+def product_tag(product_id: int) -> str:
+    """The tag of the responses showing the product."""
+    return f"product:{product_id}"
+
+
+def category_tag(category_id: int) -> str:
+    """The tag of the responses showing the category (or a product of it)."""
+    return f"category:{category_id}"
+
+
+def listing_tags(sort: str = None, on_sale: bool = False, min_rating: float = None):
+    """
+    The tags of a product listing with the given order and filters.
+
+    Args:
+        sort (str): The sort key of the listing.
+        on_sale (bool): Only products with a current discount.
+        min_rating (float): Only products with at least this average rating.
+
+    Returns:
+        list: The tags besides the product and category tags of the returned products.
+    """
+    sort = sort.value if isinstance(sort, Enum) else sort
+    tags = [PRODUCTS]
+    if sort == "top_rated" or min_rating is not None:
+        tags.append(REVIEWS)
+    if on_sale or sort in ("effective_price_asc", "effective_price_desc"):
+        tags.append(SALES)
+    if sort == "featured":
+        tags.append(FEATURED)
+    return tags
+
+
+def content_tags(document) -> set:
+    """
+    The product and category tags of a response, found in its JSON.
+    Objects with a product_name and an id are products, objects with a category_name and an id categories,
+    product_id and category_id fields reference them.
+
+    Args:
+        document: The parsed JSON of the response.
+
+    Returns:
+        set: The tags.
+    """
+    tags = set()
+    stack = [document]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            if "id" in value and "product_name" in value:
+                tags.add(product_tag(value["id"]))
+            if "id" in value and "category_name" in value:
+                tags.add(category_tag(value["id"]))
+            if value.get("product_id") is not None:
+                tags.add(product_tag(value["product_id"]))
+            if value.get("category_id") is not None:
+                tags.add(category_tag(value["category_id"]))
+            stack.extend(value.values())
+    return tags
+
+
+# The responses of every worker on the host share the second level, so a response is built once per host
+response_cache = TwoLevelCache(
+    "responses",
+    LocalCache(RESPONSE_CACHE_MAX_ENTRIES),
+    shared_store() if RESPONSE_CACHE_ENABLED or CONDITIONAL_GET_ENABLED else None,
+)
+# Requests missing the same response in this worker wait for the one building it
+flights = SingleFlight()
+
+
+def invalidate(*tags):
+    """
+    Invalidate the cached responses of the tags in every worker after a committed write.
+    Invalidated responses are dropped, they are not served stale, and the ETags of the cached endpoints change.
+
+    Args:
+        *tags (str): The tags changed by the write.
+    """
+    if RESPONSE_CACHE_ENABLED or CONDITIONAL_GET_ENABLED:
+        response_cache.invalidate(*tags)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Whether the If-None-Match header of the request names the ETag (weak comparison).
+
+    Args:
+        request (Request): The incoming request.
+        etag (str): The current ETag of the response.
+
+    Returns:
+        bool: True when the client has the current response.
+    """
+    header = request.headers.get("if-none-match") if request is not None else None
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in header.split(","))
+
+
+class CachePolicy:
+    """
+    How the responses of one endpoint are cached. The route (TypedResponseRoute) binds the response model
+    the body is written with, endpoints of other routers are not cached.
+    """
+
+    def __init__(self, name: str, tags=(), ttl: int = None, stale_seconds: int = 0):
+        self.name = name
+        self.tags = tags
+        self.ttl = ttl or RESPONSE_CACHE_TTL_SECONDS
+        self.stale_seconds = stale_seconds
+        self.response_model = None
+        self.status_code = 200
+        self.bound = False
+
+    def bind(self, response_model, status_code: int = 200):
+        """Called by the route with its response model (None when it has none) and status code."""
+        self.response_model = response_model
+        self.status_code = status_code
+        self.bound = True
+
+    @property
+    def active(self) -> bool:
+        return (RESPONSE_CACHE_ENABLED or CONDITIONAL_GET_ENABLED) and self.bound
+
+    def key(self, params: dict) -> str:
+        """
+        The cache key of a request: the endpoint and its parsed parameters in name order, so the order
+        of the query parameters, defaults and number formats (1 or 01) give the same key.
+        Dependencies (session, request, ...) are not part of it.
+        """
+        parts = []
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, Enum):
+                value = value.value
+            if isinstance(value, (list, tuple, set)):
+                value = sorted(map(repr, value))
+            elif not isinstance(value, (str, int, float, bool, type(None))):
+                continue
+            parts.append(f"{name}={value!r}")
+        return self.name + "?" + "&".join(parts)
+
+    def serialize(self, content) -> Response:
+        return typed_response(self.response_model, content, self.status_code)
+
+    def etag(self, key: str) -> str:
+        """
+        The weak ETag of a request, read before its response is built: the request, the version of the cache
+        and the TTL period, so responses depending on data no write invalidates (purchases) change too.
+        """
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return f'W/"{digest}-{response_cache.version}-{int(time.time() // self.ttl)}"'
+
+    def cache_control(self) -> str:
+        value = f"public, max-age={CACHE_CONTROL_MAX_AGE_SECONDS}"
+        if not CACHE_CONTROL_MAX_AGE_SECONDS:
+            value += ", must-revalidate"
+        if self.stale_seconds:
+            value += f", stale-while-revalidate={self.stale_seconds}"
+        return value
+
+    def not_modified(self, etag: str) -> Response:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": self.cache_control()})
+
+    def validated(self, response: Response, etag: str = None) -> Response:
+        """Add the ETag and Cache-Control headers to a successful response."""
+        if CONDITIONAL_GET_ENABLED and response.status_code == self.status_code:
+            if etag is not None:
+                response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = self.cache_control()
+        return response
+
+    def hit(self, body: bytes, state: str = "HIT") -> Response:
+        return Response(content=body, status_code=self.status_code, media_type="application/json", headers={"X-Cache": state})
+
+    def response_tags(self, params: dict, response: Response) -> set:
+        """The tags of the endpoint and of the content of a response."""
+        tags = set(self.tags(params) if callable(self.tags) else self.tags)
+        return tags | content_tags(json.loads(response.body))
+
+    def store(self, key: str, params: dict, response: Response, generation: tuple):
+        """Cache a successful response with its tags."""
+        if response.status_code != self.status_code:
+            return
+        response_cache.set(key, response.body, self.response_tags(params, response), self.ttl, generation, self.stale_seconds)
+        response.headers["X-Cache"] = "MISS"
+
+    async def store_async(self, key: str, params: dict, response: Response, generation: tuple):
+        """store for the event loop, the shared store is written in the threadpool."""
+        if response.status_code != self.status_code:
+            return
+        await response_cache.set_async(
+            key, response.body, self.response_tags(params, response), self.ttl, generation, self.stale_seconds,
+        )
+        response.headers["X-Cache"] = "MISS"
+
+    async def build(self, func, key: str, args: tuple, kwargs: dict, own_sessions: bool = False) -> Response:
+        """
+        Call the endpoint, cache its response and return it.
+
+        Args:
+            func (callable): The async endpoint.
+            key (str): The cache key of the request.
+            args (tuple): The positional arguments of the request (the request itself).
+            kwargs (dict): The parameters of the request.
+            own_sessions (bool): Open new database sessions instead of the sessions of the request,
+                for builds outliving the request (stale while revalidate).
+
+        Returns:
+            Response: The response of the endpoint.
+        """
+        generation = response_cache.generation
+        async with AsyncExitStack() as stack:
+            if own_sessions:
+                kwargs = {
+                    name: await stack.enter_async_context(AsyncSessionLocal()) if isinstance(value, AsyncSession) else value
+                    for name, value in kwargs.items()
+                }
+            # Written while the sessions are open, the content may be ORM objects
+            response = self.serialize(await func(*args, **kwargs))
+        await self.store_async(key, kwargs, response, generation)
+        return response
+
+
+def _request(args: tuple, kwargs: dict):
+    """The request among the arguments of an endpoint (rate_limited passes it positionally)."""
+    for value in (*args, *kwargs.values()):
+        if isinstance(value, Request):
+            return value
+    return None
+
+
+def cached_response(tags=(), ttl: int = None, stale_while_revalidate: bool = False):
+    """
+    Decorator caching the response of an anonymous GET endpoint in the response cache.
+    Put it below rate_limited, so cached responses still count towards the rate limit.
+    Concurrent requests of an async endpoint missing the same response wait for the one building it.
+    With CONDITIONAL_GET_ENABLED the responses carry an ETag and Cache-Control, and requests naming the
+    current ETag in If-None-Match get a 304 without the endpoint running.
+
+    Args:
+        tags: The invalidation tags of the endpoint, or a function of the endpoint parameters returning them.
+            The product and category tags of the returned products are added from the response.
+        ttl (int): Seconds a response is served, RESPONSE_CACHE_TTL_SECONDS by default.
+        stale_while_revalidate (bool): For expensive async endpoints, serve an expired response for
+            RESPONSE_CACHE_STALE_SECONDS more while it is built again in the background.
+
+    Returns:
+        decorator: The decorator wrapping the endpoint.
+    """
+    def decorator(func):
+        policy = CachePolicy(
+            f"{func.__module__}.{func.__qualname__}", tags, ttl,
+            RESPONSE_CACHE_STALE_SECONDS if stale_while_revalidate else 0,
+        )
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not policy.active:
+                    return await func(*args, **kwargs)
+                key = policy.key(kwargs)
+                # The version of the cache in the ETag includes the invalidations of the other workers
+                await response_cache.sync_async()
+                etag = policy.etag(key) if CONDITIONAL_GET_ENABLED else None
+                if etag is not None and etag_matches(_request(args, kwargs), etag):
+                    return policy.not_modified(etag)
+                if not RESPONSE_CACHE_ENABLED:
+                    return policy.validated(policy.serialize(await func(*args, **kwargs)), etag)
+
+                body = await response_cache.get_async(key, policy.stale_seconds)
+                if body is not None:
+                    return policy.validated(policy.hit(body), etag)
+                if policy.stale_seconds:
+                    body = response_cache.get_stale(key)
+                    if body is not None:
+                        flights.refresh(key, lambda: policy.build(func, key, args, kwargs, own_sessions=True))
+                        # Without the ETag, it would validate the stale response against the fresh one
+                        return policy.validated(policy.hit(body, "STALE"))
+                response = await flights.do(key, lambda: policy.build(func, key, args, kwargs))
+                # Every waiting request sends its own copy, the middlewares add headers to it
+                copy = Response(content=response.body, status_code=response.status_code, headers=dict(response.headers))
+                return policy.validated(copy, etag)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not policy.active:
+                    return func(*args, **kwargs)
+                key = policy.key(kwargs)
+                response_cache.sync()
+                etag = policy.etag(key) if CONDITIONAL_GET_ENABLED else None
+                if etag is not None and etag_matches(_request(args, kwargs), etag):
+                    return policy.not_modified(etag)
+                if not RESPONSE_CACHE_ENABLED:
+                    return policy.validated(policy.serialize(func(*args, **kwargs)), etag)
+
+                body = response_cache.get(key)
+                if body is not None:
+                    return policy.validated(policy.hit(body), etag)
+                generation = response_cache.generation
+                response = policy.serialize(func(*args, **kwargs))
+                policy.store(key, kwargs, response, generation)
+                return policy.validated(response, etag)
+
+        wrapper.response_cache = policy
+        return wrapper
+    return decorator
@@ -0,0 +1,512 @@
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from array import array
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "postgres" searches with the full text index of the database,
+# "memory" answers /productfilter/getbyname from the in-process index of this module
+SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "postgres").lower()
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1: float = 1.2
+BM25_B: float = 0.75
+
+# Every occurrence of a word counts this many times in the term frequency of the product
+FIELD_WEIGHTS = {
+    "product_name": 3.0,
+    "category_name": 2.0,
+    "SKU": 2.0,
+    "product_color": 1.0,
+    "target_audience": 1.0,
+    "description": 1.0,
+}
+
+# Share of deleted products in the index above which the postings are compacted
+COMPACT_RATIO: float = 0.25
+# Never compact for fewer deleted products than this
+COMPACT_MIN_DEAD: int = 1000
+# Single word searches of a word in at least this many products only score the most promising
+# blocks of its postings instead of every product
+PRUNE_MIN_POSTINGS: int = 4096
+PRUNE_BLOCK_SIZE: int = 128
+
+
+def _normalize(word: str) -> str:
+    """
+    Fold the plural of a word onto its singular ("shoes" -> "shoe"), leaving words like "dress" alone.
+
+    Args:
+        word (str): A lowercase word.
+
+    Returns:
+        str: The indexed form of the word.
+    """
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """
+    Split a text into its indexed words.
+
+    Args:
+        text (str): The text, None is treated as empty.
+
+    Returns:
+        list: The normalized words in the order they appear.
+    """
+    if not text:
+        return []
+    return [_normalize(word) for word in re.findall(r"\w+", text.lower())]
+
+
+class SearchIndex:
+    """
+    Inverted index of the products ranked with BM25.
+
+    Every product is a document with an internal number. The postings of a term are two
+    parallel arrays holding the documents containing it and the weighted term frequencies.
+    Products are indexed and removed one by one: a removed document stays in the postings
+    as a tombstone (its product id is set to 0) until enough of them pile up to compact the
+    arrays. The terms of every document are kept in a flat forward index so the document
+    frequencies stay exact when a product is removed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.term_ids = {}
+        self.postings_docs = []
+        self.postings_tf = []
+        self.df = array("i")
+        # Per document: product id (0 once removed), weighted length and start in the forward index
+        self.doc_product = array("i")
+        self.doc_length = array("f")
+        self.doc_start = array("i")
+        self.forward = array("i")
+        # Document of every product id, -1 if it is not indexed
+        self.doc_of = array("i")
+        self.live = 0
+        self.dead = 0
+        self.total_length = 0.0
+        # Block maxima of the common terms, see _blocks
+        self.blocks = {}
+
+    def __len__(self):
+        return self.live
+
+    def add(self, product_id: int, fields: dict):
+        """
+        Index a product, replacing the previous version of it.
+
+        Args:
+            product_id (int): The ID of the product.
+            fields (dict): The text of the product keyed by the names in FIELD_WEIGHTS.
+        """
+        frequencies = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(fields.get(field)):
+                frequencies[word] = frequencies.get(word, 0.0) + weight
+
+        with self.lock:
+            self._remove(product_id)
+
+            doc = len(self.doc_product)
+            length = sum(frequencies.values())
+            self.doc_product.append(product_id)
+            self.doc_length.append(length)
+            self.doc_start.append(len(self.forward))
+
+            for word, frequency in frequencies.items():
+                term = self.term_ids.get(word)
+                if term is None:
+                    term = self.term_ids[word] = len(self.postings_docs)
+                    self.postings_docs.append(array("i"))
+                    self.postings_tf.append(array("f"))
+                    self.df.append(0)
+                self.postings_docs[term].append(doc)
+                self.postings_tf[term].append(frequency)
+                self.df[term] += 1
+                self.forward.append(term)
+
+            if product_id >= len(self.doc_of):
+                self.doc_of.extend([-1] * (product_id + 1 - len(self.doc_of)))
+            self.doc_of[product_id] = doc
+            self.live += 1
+            self.total_length += length
+
+    def remove(self, product_id: int):
+        """
+        Remove a product from the index, unknown products are ignored.
+
+        Args:
+            product_id (int): The ID of the product.
+        """
+        with self.lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id: int):
+        doc = self.doc_of[product_id] if product_id < len(self.doc_of) else -1
+        if doc < 0:
+            return
+
+        for term in self.forward[self.doc_start[doc]:self._doc_end(doc)]:
+            self.df[term] -= 1
+        self.doc_of[product_id] = -1
+        self.doc_product[doc] = 0
+        self.live -= 1
+        self.dead += 1
+        self.total_length -= self.doc_length[doc]
+
+        if self.dead >= COMPACT_MIN_DEAD and self.dead > COMPACT_RATIO * (self.live + self.dead):
+            self._compact()
+
+    def _doc_end(self, doc: int) -> int:
+        return self.doc_start[doc + 1] if doc + 1 < len(self.doc_start) else len(self.forward)
+
+    def _compact(self):
+        """
+        Drop the removed documents from every array and renumber the remaining ones.
+        """
+        renumbered = array("i", [-1]) * len(self.doc_product)
+        doc_product, doc_length, doc_start, forward = array("i"), array("f"), array("i"), array("i")
+
+        for doc, product_id in enumerate(self.doc_product):
+            if not product_id:
+                continue
+            renumbered[doc] = len(doc_product)
+            self.doc_of[product_id] = len(doc_product)
+            doc_product.append(product_id)
+            doc_length.append(self.doc_length[doc])
+            doc_start.append(len(forward))
+            forward.extend(self.forward[self.doc_start[doc]:self._doc_end(doc)])
+
+        for term, docs in enumerate(self.postings_docs):
+            kept_docs, kept_tf = array("i"), array("f")
+            for doc, frequency in zip(docs, self.postings_tf[term]):
+                if renumbered[doc] >= 0:
+                    kept_docs.append(renumbered[doc])
+                    kept_tf.append(frequency)
+            self.postings_docs[term] = kept_docs
+            self.postings_tf[term] = kept_tf
+
+        self.doc_product, self.doc_length, self.doc_start, self.forward = doc_product, doc_length, doc_start, forward
+        self.blocks = {}
+        self.dead = 0
+
+    def search(self, keyword: str, limit: int, after: tuple = None, offset: int = 0) -> list:
+        """
+        Find the products containing every word of the keyword, best match first.
+
+        Args:
+            keyword (str): The search keyword.
+            limit (int): The number of products to return.
+            after (tuple): (score, product id) of the last product of the previous page, None for the first page.
+            offset (int): The number of matching products to skip.
+
+        Returns:
+            list: (product id, score) of the matching products ordered by score, then product id.
+        """
+        words = list(dict.fromkeys(tokenize(keyword)))
+        if not words or limit <= 0:
+            return []
+
+        with self.lock:
+            terms = [self.term_ids.get(word) for word in words]
+            if self.live == 0 or None in terms or any(self.df[term] == 0 for term in terms):
+                return []
+
+            # Start from the rarest word so the candidates shrink as early as possible
+            terms.sort(key=lambda term: self.df[term])
+            average_length = self.total_length / self.live
+            normalization = BM25_K1 * (1 - BM25_B)
+            slope = BM25_K1 * BM25_B / average_length
+            saturations = [
+                math.log(1 + (self.live - self.df[term] + 0.5) / (self.df[term] + 0.5)) * (BM25_K1 + 1)
+                for term in terms
+            ]
+
+            if len(terms) == 1 and len(self.postings_docs[terms[0]]) >= PRUNE_MIN_POSTINGS:
+                hits = self._top_hits(terms[0], saturations[0], normalization, slope, offset + limit, after)
+            else:
+                hits = self._all_hits(terms, saturations, normalization, slope)
+                if after is not None:
+                    after_score, after_id = after
+                    hits = [hit for hit in hits if hit[1] < after_score or (hit[1] == after_score and hit[0] > after_id)]
+
+        return heapq.nsmallest(offset + limit, hits, key=lambda hit: (-hit[1], hit[0]))[offset:]
+
+    def _all_hits(self, terms: list, saturations: list, normalization: float, slope: float) -> list:
+        """
+        Score every product containing all the terms.
+
+        Returns:
+            list: (product id, score) of the matching products.
+        """
+        doc_product, doc_length = self.doc_product, self.doc_length
+        scores = None
+
+        for term, saturation in zip(terms, saturations):
+            docs, frequencies = self.postings_docs[term], self.postings_tf[term]
+            matched = {}
+            if scores is None:
+                for doc, frequency in zip(docs, frequencies):
+                    if doc_product[doc]:
+                        matched[doc] = saturation * frequency / (frequency + normalization + slope * doc_length[doc])
+            elif len(scores) * 16 < len(docs):
+                # Few candidates left: look them up in the (ascending) postings instead of walking them
+                for doc, score in scores.items():
+                    position = bisect.bisect_left(docs, doc)
+                    if position < len(docs) and docs[position] == doc:
+                        frequency = frequencies[position]
+                        matched[doc] = score + saturation * frequency / (frequency + normalization + slope * doc_length[doc])
+            else:
+                for doc, frequency in zip(docs, frequencies):
+                    score = scores.get(doc)
+                    if score is not None:
+                        matched[doc] = score + saturation * frequency / (frequency + normalization + slope * doc_length[doc])
+            scores = matched
+            if not scores:
+                return []
+
+        return [(doc_product[doc], score) for doc, score in scores.items()]
+
+    def _top_hits(self, term: int, saturation: float, normalization: float, slope: float, number: int, after: tuple) -> list:
+        """
+        Find the best products of a single common term (block-max pruning).
+
+        The postings are walked block by block, best block first. No product of a block can score
+        more than its highest term frequency in its shortest product, nor win a tie against a lower
+        product id than the lowest of the block, so the walk stops as soon as no remaining block
+        can beat the worst product kept.
+
+        Returns:
+            list: (product id, score) of at least the best number products after the cursor.
+        """
+        doc_product, doc_length = self.doc_product, self.doc_length
+        docs, frequencies = self.postings_docs[term], self.postings_tf[term]
+        max_frequency, min_length, min_product = self._blocks(term)
+
+        block_bounds = [
+            saturation * frequency / (frequency + normalization + slope * length)
+            for frequency, length in zip(max_frequency, min_length)
+        ]
+        if after is not None:
+            # Blocks entirely before the cursor can be skipped too
+            block_bounds = [bound if bound <= after[0] else after[0] for bound in block_bounds]
+
+        # Min heap of (score, -product id): the root is the worst product kept
+        kept = []
+        for block in sorted(range(len(block_bounds)), key=lambda block: (-block_bounds[block], min_product[block])):
+            if len(kept) == number and (block_bounds[block], -min_product[block]) < kept[0]:
+                break
+            for position in range(block * PRUNE_BLOCK_SIZE, min((block + 1) * PRUNE_BLOCK_SIZE, len(docs))):
+                doc = docs[position]
+                product_id = doc_product[doc]
+                if not product_id:
+                    continue
+                frequency = frequencies[position]
+                score = saturation * frequency / (frequency + normalization + slope * doc_length[doc])
+                if after is not None and not (score < after[0] or (score == after[0] and product_id > after[1])):
+                    continue
+                if len(kept) < number:
+                    heapq.heappush(kept, (score, -product_id))
+                elif (score, -product_id) > kept[0]:
+                    heapq.heapreplace(kept, (score, -product_id))
+
+        return [(-negative_id, score) for score, negative_id in kept]
+
+    def prepare(self):
+        """
+        Compute the block maxima of the common terms up front, so no search pays for them.
+        """
+        with self.lock:
+            for term, docs in enumerate(self.postings_docs):
+                if len(docs) >= PRUNE_MIN_POSTINGS:
+                    self._blocks(term)
+
+    def _blocks(self, term: int) -> tuple:
+        """
+        The highest term frequency, shortest product and lowest product id of every block of
+        postings of a term. Computed on first use and extended as postings are appended. Removed
+        products only make the values too optimistic, which keeps them valid bounds until the
+        next compaction.
+
+        Returns:
+            tuple: (max frequency, min length, min product id) arrays with one value per block.
+        """
+        docs, frequencies = self.postings_docs[term], self.postings_tf[term]
+        max_frequency, min_length, min_product, covered = self.blocks.get(term, (array("f"), array("f"), array("i"), 0))
+        if covered == len(docs):
+            return max_frequency, min_length, min_product
+
+        # The last block may have been partial, so it is computed again
+        first = covered // PRUNE_BLOCK_SIZE
+        del max_frequency[first:], min_length[first:], min_product[first:]
+        for start in range(first * PRUNE_BLOCK_SIZE, len(docs), PRUNE_BLOCK_SIZE):
+            block = docs[start:start + PRUNE_BLOCK_SIZE]
+            max_frequency.append(max(frequencies[start:start + PRUNE_BLOCK_SIZE]))
+            min_length.append(min(self.doc_length[doc] for doc in block))
+            min_product.append(min((self.doc_product[doc] for doc in block if self.doc_product[doc]), default=0))
+        self.blocks[term] = (max_frequency, min_length, min_product, len(docs))
+        return max_frequency, min_length, min_product
+
+
+# The index of this process, filled by build_search_index when SEARCH_BACKEND is "memory".
+# Every worker process keeps (and maintains) its own copy.
+search_index = SearchIndex()
+search_index_ready = False
+
+
+def product_search_rows(session, product_ids: list = None):
+    """
+    Stream the indexed text of the products.
+
+    Args:
+        session: SQLAlchemy session object.
+        product_ids (list): Only these products, None for all of them.
+
+    Returns:
+        Result: Rows with the product id and the fields of FIELD_WEIGHTS.
+    """
+    from sqlalchemy import select
+    from server.models.models import Product, ProductCategory
+
+    query = (
+        select(
+            Product.id, Product.product_name, Product.description, Product.SKU,
+            Product.product_color, Product.target_audience, ProductCategory.category_name,
+        )
+        .outerjoin(ProductCategory, Product.category_id == ProductCategory.id)
+        .execution_options(stream_results=True)
+    )
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    return session.execute(query).yield_per(10000)
+
+
+def build_search_index():
+    """
+    Index every product of the database and make the index the one searched by this process.
+
+    Returns:
+        SearchIndex: The new index.
+    """
+    global search_index, search_index_ready
+    from server.db.db import SessionLocal
+
+    started = time.perf_counter()
+    index = SearchIndex()
+    session = SessionLocal()
+    try:
+        for row in product_search_rows(session):
+            index.add(row.id, row._mapping)
+    finally:
+        session.close()
+    index.prepare()
+
+    search_index, search_index_ready = index, True
+    print(f"Search index built: {len(index)} products in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def index_products(session, product_ids: list):
+    """
+    Bring the index up to date with the committed state of some products.
+    Products that no longer exist are removed. Does nothing unless the index is in use.
+
+    Args:
+        session: SQLAlchemy session object.
+        product_ids (list): The IDs of the created or changed products.
+    """
+    if not search_index_ready or not product_ids:
+        return
+
+    found = set()
+    for row in product_search_rows(session, product_ids):
+        search_index.add(row.id, row._mapping)
+        found.add(row.id)
+    for product_id in set(product_ids) - found:
+        search_index.remove(product_id)
+
+
+def remove_product(product_id: int):
+    """
+    Remove a deleted product from the index. Does nothing unless the index is in use.
+
+    Args:
+        product_id (int): The ID of the deleted product.
+    """
+    if search_index_ready:
+        search_index.remove(product_id)
+
+
+if __name__ == "__main__":
+    # Benchmark on a synthetic catalog: python -m server.utils.search_engine [number of products]
+    import random
+    import resource
+    import statistics
+    import sys
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    common = ["shoe", "boot", "shirt", "dress", "jacket", "jeans", "sneaker", "hat", "bag", "watch",
+              "leather", "cotton", "wool", "denim", "running", "casual", "classic", "slim", "summer", "winter"]
+    colors = ["red", "blue", "black", "white", "green", "grey", "brown", "pink"]
+    audiences = ["men", "women", "kids", "unisex"]
+    # A long tail of rare words, like brand and model names
+    rare = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(7)) for _ in range(50000)]
+    description_words = common + rare[:2000]
+
+    def products():
+        for product_id in range(1, size + 1):
+            yield product_id, {
+                "product_name": " ".join(rng.sample(common, 2) + [rng.choice(rare)]),
+                "description": " ".join(rng.choice(description_words) for _ in range(12)),
+                "SKU": f"SKU-{product_id:08d}",
+                "product_color": rng.choice(colors),
+                "target_audience": rng.choice(audiences),
+                "category_name": rng.choice(common[:10]),
+            }
+
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index = SearchIndex()
+    for product_id, fields in products():
+        index.add(product_id, fields)
+    index.prepare()
+    build_seconds = time.perf_counter() - started
+    memory_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before) / 1024
+
+    print(f"{size} products indexed in {build_seconds:.1f}s ({size / build_seconds:.0f}/s), "
+          f"{len(index.term_ids)} terms, ~{memory_mb:.0f} MB")
+
+    queries = {
+        "rare word": [rng.choice(rare) for _ in range(200)],
+        "sku": [f"sku {rng.randint(1, size):08d}" for _ in range(200)],
+        "rare + common": [f"{rng.choice(rare)} {rng.choice(common)}" for _ in range(200)],
+        "two common words": [" ".join(rng.sample(common, 2)) for _ in range(20)],
+        "common word": [rng.choice(common) for _ in range(20)],
+    }
+    for name, keywords in queries.items():
+        timings = []
+        for keyword in keywords:
+            started = time.perf_counter()
+            index.search(keyword, 20)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{name:>18}: median {statistics.median(timings):8.3f} ms, "
+              f"p95 {timings[int(len(timings) * 0.95) - 1]:8.3f} ms")
+
+    started = time.perf_counter()
+    for product_id in range(1, size // 10):
+        index.add(product_id, {"product_name": "updated product", "description": "changed"})
+    print(f"{size // 10} products updated in {time.perf_counter() - started:.1f}s")
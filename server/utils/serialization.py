@@ -0,0 +1,178 @@
+import asyncio
+import os
+from functools import lru_cache, wraps
+
+from dotenv import load_dotenv
+from fastapi import Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import ResponseValidationError
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter, ValidationError
+
+load_dotenv()
+
+# GET endpoints of the routers using TypedResponseRoute validate their result against the response model
+# and write the JSON in one pass of a precompiled TypeAdapter, instead of validating, dumping to Python
+# objects and encoding those again
+TYPED_RESPONSES_ENABLED: bool = os.getenv("TYPED_RESPONSES_ENABLED", "false").lower() == "true"
+
+
+@lru_cache(maxsize=None)
+def response_adapter(response_model) -> TypeAdapter:
+    """
+    The TypeAdapter of a response model, built once per model.
+
+    Args:
+        response_model: The response_model of a route (a model or e.g. List[model]).
+
+    Returns:
+        TypeAdapter: The validator and serializer of the model.
+    """
+    return TypeAdapter(response_model)
+
+
+def typed_response(response_model, content, status_code: int = 200) -> Response:
+    """
+    Validate the result of an endpoint and write it as JSON with the TypeAdapter of its response model.
+    The body is the one FastAPI writes for the response model.
+
+    Args:
+        response_model: The response_model of the route, None to encode the content like routes without one.
+        content: The value returned by the endpoint (ORM objects, dicts, ...).
+        status_code (int): The status code of the route.
+
+    Returns:
+        Response: The JSON response. Responses returned by the endpoint are passed through.
+
+    Raises:
+        ResponseValidationError: If the content does not match the response model, like FastAPI does.
+    """
+    if isinstance(content, Response):
+        return content
+    if response_model is None:
+        return ORJSONResponse(jsonable_encoder(content), status_code=status_code)
+
+    adapter = response_adapter(response_model)
+    try:
+        value = adapter.validate_python(content, from_attributes=True)
+    except ValidationError as e:
+        raise ResponseValidationError(errors=e.errors(), body=content)
+    return Response(content=adapter.dump_json(value), status_code=status_code, media_type="application/json")
+
+
+def typed_endpoint(endpoint, response_model, status_code: int = 200):
+    """
+    Wrap an endpoint so its result is written by typed_response.
+    The signature is kept, so FastAPI resolves the same parameters and dependencies.
+
+    Args:
+        endpoint (callable): The endpoint function (sync or async).
+        response_model: The response_model of the route.
+        status_code (int): The status code of the route.
+
+    Returns:
+        callable: The wrapped endpoint, async when the endpoint is.
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            return typed_response(response_model, await endpoint(*args, **kwargs), status_code)
+    else:
+        # Sync endpoints run in the threadpool, so does the serialization of their result
+        @wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            return typed_response(response_model, endpoint(*args, **kwargs), status_code)
+
+    wrapper.typed_response = True
+    return wrapper
+
+
+class TypedResponseRoute(APIRoute):
+    """
+    Route class of the routers with high volume GET endpoints (APIRouter(route_class=TypedResponseRoute)).
+    With TYPED_RESPONSES_ENABLED their response body is written by the TypeAdapter of the response model.
+    Other methods, routes without a response model and endpoints returning a Response are left as they are.
+    GET endpoints decorated with cached_response get the response model their cached body is written with.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        if isinstance(response_model, DefaultPlaceholder):
+            response_model = None
+        status_code = kwargs.get("status_code") or 200
+        is_get = "GET" in (kwargs.get("methods") or ())
+
+        cache_policy = getattr(endpoint, "response_cache", None)
+        if is_get and cache_policy is not None:
+            cache_policy.bind(response_model, status_code)
+
+        if (
+            TYPED_RESPONSES_ENABLED
+            and is_get
+            and response_model is not None
+            # Routes are copied with their (already wrapped) endpoint when the router is included
+            and not getattr(endpoint, "typed_response", False)
+        ):
+            endpoint = typed_endpoint(endpoint, response_model, status_code)
+        super().__init__(path, endpoint, **kwargs)
+
+if __name__ == "__main__":
+    # Serialization cost of a listing of 100 products: python -m server.utils.serialization
+    import json
+    import statistics
+    import time
+    from datetime import datetime, timezone
+    from typing import List
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from server.schemas.filter_products_schemas import FilterProductsProductCResponse
+
+    response_model = List[FilterProductsProductCResponse]
+    items = [
+        {
+            "id": i,
+            "product_name": f"classic red shoe {i}",
+            "description": f"A classic shoe made for everyday wear, item {i}",
+            "price": i % 200 + 0.99,
+            "stock_quantity": i % 50,
+            "product_size": "M",
+            "SKU": f"sku{i}",
+            "target_audience": "men",
+            "product_color": "red",
+            "created_at": datetime(2026, 10, 18, 12, 0, i % 60, i, tzinfo=timezone.utc),
+            "category_id": 1 + i % 8,
+            "images": [{"id": i, "image_path": f"img{i}.png"}, {"id": i + 100, "image_path": f"img{i}b.png"}],
+            "num_reviews": i % 7,
+            "avg_rating": 3.5 if i % 7 else None,
+            "discount_percent": 10.0 if i % 3 == 0 else None,
+            "category_name": "footwear",
+        }
+        for i in range(100)
+    ]
+    # What FastAPI does with the returned list (serialize_response and the response class)
+    adapter = TypeAdapter(response_model)
+
+    def fastapi_default():
+        return JSONResponse(adapter.dump_python(adapter.validate_python(items, from_attributes=True), mode="json")).body
+
+    def fastapi_orjson():
+        return ORJSONResponse(adapter.dump_python(adapter.validate_python(items, from_attributes=True), mode="json")).body
+
+    def typed():
+        return typed_response(response_model, items).body
+
+    def timed(function, repeat=500):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = function()
+            timings.append((time.perf_counter() - started) * 1e6)
+        return statistics.median(timings), body
+
+    baseline_us, expected = timed(fastapi_default)
+    print(f"{'validate + dump_python + json.dumps':>40}: {baseline_us:8.1f} us")
+    for name, function in (("validate + dump_python + orjson", fastapi_orjson), ("TypeAdapter validate + dump_json", typed)):
+        us, body = timed(function)
+        same = json.loads(body) == json.loads(expected)
+        print(f"{name:>40}: {us:8.1f} us{'' if body == expected else ' (same JSON, other bytes)' if same else ' (DIFFERENT JSON)'}")
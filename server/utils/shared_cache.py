@@ -0,0 +1,561 @@
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+load_dotenv()
+
+# Second level of the caches, shared by the uvicorn workers of the host:
+# "memory" keeps every cache inside its worker (single worker runs and tests),
+# "sqlite:///path/to/file" shares the entries and the invalidations between the workers.
+SHARED_CACHE_STORAGE: str = os.getenv(
+    "SHARED_CACHE_STORAGE",
+    f"sqlite:///{os.path.join(tempfile.gettempdir(), 'online_store_cache.sqlite3')}",
+)
+# Seconds the invalidation log is kept, longer than the ttl of any cached entry
+SHARED_CACHE_LOG_SECONDS: int = int(os.getenv("SHARED_CACHE_LOG_SECONDS", 3600))
+
+
+class LocalCache:
+    """
+    Bounded LRU cache of byte values with a time to live and invalidation by tag, the first level of a cache.
+    Values can be kept stale for a while after they expire, for callers serving them while they are revalidated.
+    Shared by the event loop and the threadpool of sync endpoints, so every operation holds the lock.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # key -> (expires, stale until, value, tags)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.keys_by_tag = defaultdict(set)
+        # Bumped by every invalidation, a value built across one is not stored
+        self.generation = 0
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self.lock = threading.Lock()
+
+    def _remove(self, key: str):
+        """Drop an entry and its tag references. The lock must be held."""
+        _, _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_tag[tag]
+
+    def get(self, key: str):
+        """
+        The cached value of the key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bytes: The value, None when it is not cached or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            now = time.monotonic()
+            if entry[0] <= now:
+                if entry[1] <= now:
+                    self._remove(key)
+                    self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[2]
+
+    def get_stale(self, key: str):
+        """
+        The value of the key after it expired, while it is kept stale.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bytes: The value, None when it is not cached or no longer kept.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            self.counters["stale_hits"] += 1
+            return entry[2]
+
+    def set(self, key: str, value: bytes, tags, ttl: float, generation: int, stale_seconds: float = 0) -> bool:
+        """
+        Cache a value.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value.
+            tags (iterable): The invalidation tags of the value.
+            ttl (float): Seconds the value is served.
+            generation (int): The generation read before the value was built.
+            stale_seconds (float): Seconds the value is kept for get_stale after it expired.
+
+        Returns:
+            bool: False when an invalidation happened meanwhile and the value was not stored.
+        """
+        tags = frozenset(tags)
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if key in self.entries:
+                self._remove(key)
+            expires = time.monotonic() + ttl
+            self.entries[key] = (expires, expires + stale_seconds, value, tags)
+            for tag in tags:
+                self.keys_by_tag[tag].add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+            return True
+
+    def invalidate(self, *tags) -> int:
+        """
+        Drop the values carrying any of the tags.
+
+        Args:
+            *tags (str): The changed tags.
+
+        Returns:
+            int: The number of dropped values.
+        """
+        with self.lock:
+            self.generation += 1
+            keys = set()
+            for tag in tags:
+                keys |= self.keys_by_tag.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self.counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """Drop every value."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.keys_by_tag.clear()
+
+    def stats(self) -> dict:
+        """
+        The counters of the cache.
+
+        Returns:
+            dict: hits, stale hits, misses, evictions, expirations, invalidations, the number of entries and the hit ratio.
+        """
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries), max_entries=self.max_entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class SQLiteCacheStore:
+    """
+    Keeps the cached values and a log of the invalidations in a local SQLite file, so every worker process
+    on the host reads the values the others built and drops the values the others invalidated.
+
+    The sequence number of the last invalidation is also written to a small memory mapped file next to the
+    database, the workers compare it with the last one they applied before every lookup and only read the
+    log when it moved. It is written while the write transaction holds the database lock, so it never goes back.
+    Every cache sharing the store also has a version, the sequence number of the last invalidation of its tags.
+    """
+
+    # Expired values and old invalidations are deleted once every PRUNE_EVERY writes
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " tags TEXT NOT NULL,"
+            " expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_tags ("
+            " tag TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " PRIMARY KEY (tag, key)"
+            ") WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tags TEXT NOT NULL,"
+            " created_at REAL NOT NULL"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_versions ("
+            " prefix TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        descriptor = os.open(path + ".seq", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(descriptor).st_size < 8:
+                os.ftruncate(descriptor, 8)
+            self.sequence_map = mmap.mmap(descriptor, 8)
+        finally:
+            os.close(descriptor)
+        # A new sequence file starts at 0, behind the log
+        last = self.last_sequence()
+        if self.sequence() < last:
+            struct.pack_into("<Q", self.sequence_map, 0, last)
+
+    def sequence(self) -> int:
+        """The sequence number of the last invalidation of any worker, without a query."""
+        return struct.unpack_from("<Q", self.sequence_map)[0]
+
+    def last_sequence(self) -> int:
+        """The sequence number of the last logged invalidation."""
+        with self.lock:
+            return self.connection.execute("SELECT coalesce(max(seq), 0) FROM cache_invalidations").fetchone()[0]
+
+    def version(self, prefix: str) -> int:
+        """The sequence number of the last invalidation of the cache with the key prefix, 0 if it had none."""
+        with self.lock:
+            row = self.connection.execute("SELECT version FROM cache_versions WHERE prefix = ?", (prefix,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def get(self, key: str):
+        """
+        The cached value of the key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: (value, tags, seconds left), None when it is not cached or expired.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, tags, expires_at FROM cache_entries WHERE key = ? AND expires_at > ?", (key, now),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1].split("\n") if row[1] else [], row[2] - now
+
+    def set(self, key: str, value: bytes, tags, ttl: float, sequence: int) -> bool:
+        """
+        Cache a value unless an invalidation was logged after the sequence number.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value.
+            tags (iterable): The invalidation tags of the value.
+            ttl (float): Seconds the value is served.
+            sequence (int): The sequence number read before the value was built.
+
+        Returns:
+            bool: False when the value was not stored.
+        """
+        tags = sorted(set(tags))
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                last = cursor.execute("SELECT coalesce(max(seq), 0) FROM cache_invalidations").fetchone()[0]
+                if last > sequence:
+                    cursor.execute("ROLLBACK")
+                    return False
+                cursor.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+                cursor.execute(
+                    "INSERT INTO cache_entries (key, value, tags, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value, tags = excluded.tags, expires_at = excluded.expires_at",
+                    (key, value, "\n".join(tags), now + ttl),
+                )
+                cursor.executemany("INSERT INTO cache_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+                self._prune(cursor, now)
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            return True
+
+    def invalidate(self, tags, prefix: str = None) -> int:
+        """
+        Drop the values carrying any of the tags and log the invalidation for the other workers.
+
+        Args:
+            tags (iterable): The changed tags.
+            prefix (str): The key prefix of the cache the tags belong to, its version becomes the sequence number.
+
+        Returns:
+            int: The sequence number of the invalidation.
+        """
+        tags = sorted(set(tags))
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ",".join("?" * len(tags))
+                keys = f"SELECT key FROM cache_tags WHERE tag IN ({placeholders})"
+                cursor.execute(f"DELETE FROM cache_entries WHERE key IN ({keys})", tags)
+                cursor.execute(f"DELETE FROM cache_tags WHERE key IN ({keys})", tags)
+                cursor.execute("INSERT INTO cache_invalidations (tags, created_at) VALUES (?, ?)", ("\n".join(tags), now))
+                sequence = cursor.lastrowid
+                if prefix is not None:
+                    cursor.execute(
+                        "INSERT INTO cache_versions (prefix, version) VALUES (?, ?) "
+                        "ON CONFLICT (prefix) DO UPDATE SET version = excluded.version",
+                        (prefix, sequence),
+                    )
+                self._prune(cursor, now)
+                struct.pack_into("<Q", self.sequence_map, 0, sequence)
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            return sequence
+
+    def changes(self, since: int):
+        """
+        The invalidations logged after a sequence number.
+
+        Args:
+            since (int): The sequence number of the last applied invalidation.
+
+        Returns:
+            tuple: ((sequence number, tags) of the invalidations in the order they were logged,
+                the last sequence number, whether invalidations after since were already pruned from the log).
+        """
+        with self.lock:
+            first = self.connection.execute("SELECT min(seq) FROM cache_invalidations").fetchone()[0]
+            rows = self.connection.execute(
+                "SELECT seq, tags FROM cache_invalidations WHERE seq > ? ORDER BY seq", (since,),
+            ).fetchall()
+        invalidations = [(seq, [tag for tag in row_tags.split("\n") if tag]) for seq, row_tags in rows]
+        last = rows[-1][0] if rows else since
+        return invalidations, last, first is not None and first > since + 1 and bool(rows)
+
+    def _prune(self, cursor, now: float):
+        """Delete expired values and old invalidations every PRUNE_EVERY writes. The transaction must be open."""
+        self.writes += 1
+        if self.writes % self.PRUNE_EVERY:
+            return
+        cursor.execute("DELETE FROM cache_tags WHERE key IN (SELECT key FROM cache_entries WHERE expires_at < ?)", (now,))
+        cursor.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+        # The last invalidation stays, it keeps the sequence numbers growing
+        cursor.execute(
+            "DELETE FROM cache_invalidations WHERE created_at < ? AND seq < (SELECT max(seq) FROM cache_invalidations)",
+            (now - SHARED_CACHE_LOG_SECONDS,),
+        )
+
+
+@lru_cache(maxsize=None)
+def shared_store():
+    """
+    The second level store configured with the SHARED_CACHE_STORAGE setting, opened by the first cache using it.
+
+    Returns:
+        SQLiteCacheStore: The store shared by the workers, None with "memory".
+
+    Raises:
+        ValueError: If the setting names an unknown storage.
+    """
+    if SHARED_CACHE_STORAGE.startswith("sqlite:///"):
+        return SQLiteCacheStore(SHARED_CACHE_STORAGE[len("sqlite:///"):])
+    if SHARED_CACHE_STORAGE == "memory":
+        return None
+    raise ValueError(f"Unknown SHARED_CACHE_STORAGE: {SHARED_CACHE_STORAGE}")
+
+
+class TwoLevelCache:
+    """
+    A LocalCache in front of the store shared by the workers.
+
+    Lookups read the local cache first and the shared store on a miss, copying what they find into the
+    local cache. Values are written to both. Invalidations drop the values of the tags in both and are
+    logged, every worker applies the logged invalidations of the others to its local cache before its
+    next lookup. Keys and tags are prefixed with the name of the cache in the shared store, so caches
+    of different data (responses, users, ...) share one store.
+
+    The store is a SQLite database waiting up to 5 seconds for the lock of another worker, async callers
+    use get_async, set_async and invalidate_async, which only leave the event loop to query it.
+    """
+
+    def __init__(self, name: str, local: LocalCache, store=None):
+        self.name = name
+        self.local = local
+        self.store = store
+        self.prefix = name + ":"
+        self.applied = store.last_sequence() if store is not None else 0
+        # Sequence number of the last invalidation of this cache the local cache applied
+        self.shared_version = store.version(self.prefix) if store is not None else 0
+        self.counters = {"shared_hits": 0, "shared_misses": 0, "remote_invalidations": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def generation(self) -> tuple:
+        """Read before building a value and passed to set, so a value built across an invalidation is not stored."""
+        return self.local.generation, self.applied
+
+    @property
+    def version(self) -> int:
+        """
+        Changes with every invalidation of this cache by any worker (of this worker with "memory"), for validators
+        like ETags. Invalidations of the other caches of the store do not change it. Up to date after a sync.
+        """
+        return self.shared_version if self.store is not None else self.local.generation
+
+    def sync(self):
+        """Apply the invalidations the other workers logged since the last lookup to the local cache."""
+        if self.store is None or self.store.sequence() == self.applied:
+            return
+        with self.lock:
+            invalidations, last, pruned = self.store.changes(self.applied)
+            if pruned:
+                self.local.clear()
+                self.shared_version = self.store.version(self.prefix)
+            mine = []
+            for sequence, tags in invalidations:
+                tags = [tag[len(self.prefix):] for tag in tags if tag.startswith(self.prefix)]
+                if tags:
+                    mine.extend(tags)
+                    self.shared_version = sequence
+            if mine:
+                self.counters["remote_invalidations"] += self.local.invalidate(*mine)
+            self.applied = last
+
+    async def sync_async(self):
+        """sync for the event loop, the log is read in the threadpool."""
+        if self.store is not None and self.store.sequence() != self.applied:
+            await run_in_threadpool(self.sync)
+
+    def get(self, key: str, stale_seconds: float = 0):
+        """
+        The cached value of the key.
+
+        Args:
+            key (str): The cache key.
+            stale_seconds (float): Seconds a value found in the shared store is kept stale in the local cache.
+
+        Returns:
+            bytes: The value, None when neither level has it.
+        """
+        self.sync()
+        value = self.local.get(key)
+        if value is not None or self.store is None:
+            return value
+        return self._get_shared(key, stale_seconds)
+
+    async def get_async(self, key: str, stale_seconds: float = 0):
+        """get for the event loop: the log and the shared store are read in the threadpool, local hits are not."""
+        await self.sync_async()
+        value = self.local.get(key)
+        if value is not None or self.store is None:
+            return value
+        return await run_in_threadpool(self._get_shared, key, stale_seconds)
+
+    def _get_shared(self, key: str, stale_seconds: float):
+        """The value of the key in the shared store, copied into the local cache."""
+        entry = self.store.get(self.prefix + key)
+        if entry is None:
+            self.counters["shared_misses"] += 1
+            return None
+        self.counters["shared_hits"] += 1
+        value, tags, ttl = entry
+        self.local.set(key, value, [tag[len(self.prefix):] for tag in tags], ttl, self.local.generation, stale_seconds)
+        return value
+
+    def get_stale(self, key: str):
+        """The value of the key kept stale in the local cache, see LocalCache.get_stale."""
+        return self.local.get_stale(key)
+
+    def set(self, key: str, value: bytes, tags, ttl: float, generation: tuple, stale_seconds: float = 0) -> bool:
+        """
+        Cache a value in both levels.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value.
+            tags (iterable): The invalidation tags of the value.
+            ttl (float): Seconds the value is served.
+            generation (tuple): The generation read before the value was built.
+            stale_seconds (float): Seconds the value is kept stale in the local cache after it expired.
+
+        Returns:
+            bool: False when an invalidation happened meanwhile and the value was not stored.
+        """
+        self.sync()
+        local_generation, sequence = generation
+        if not self.local.set(key, value, tags, ttl, local_generation, stale_seconds):
+            return False
+        if self.store is not None:
+            return self.store.set(self.prefix + key, value, [self.prefix + tag for tag in tags], ttl, sequence)
+        return True
+
+    async def set_async(self, key: str, value: bytes, tags, ttl: float, generation: tuple, stale_seconds: float = 0) -> bool:
+        """set for the event loop, the shared store is written in the threadpool."""
+        if self.store is None:
+            return self.set(key, value, tags, ttl, generation, stale_seconds)
+        return await run_in_threadpool(self.set, key, value, tags, ttl, generation, stale_seconds)
+
+    def invalidate(self, *tags) -> int:
+        """
+        Drop the values carrying any of the tags in every worker.
+
+        Args:
+            *tags (str): The changed tags.
+
+        Returns:
+            int: The number of values dropped from the local cache.
+        """
+        dropped = self.local.invalidate(*tags)
+        if self.store is not None:
+            sequence = self.store.invalidate([self.prefix + tag for tag in tags], self.prefix)
+            with self.lock:
+                # Nothing else was logged in between, there is nothing to apply
+                if sequence == self.applied + 1:
+                    self.applied = self.shared_version = sequence
+        return dropped
+
+    async def invalidate_async(self, *tags) -> int:
+        """invalidate for the event loop, the invalidation is logged in the threadpool."""
+        if self.store is None:
+            return self.invalidate(*tags)
+        return await run_in_threadpool(self.invalidate, *tags)
+
+    def clear(self):
+        """Drop every value of this worker."""
+        self.local.clear()
+
+    def stats(self) -> dict:
+        """
+        The counters of both levels.
+
+        Returns:
+            dict: The counters of the local cache, the hits and misses of the shared store and
+                the values dropped by invalidations of other workers.
+        """
+        stats = self.local.stats()
+        stats.update(self.counters, storage="memory" if self.store is None else "sqlite")
+        return stats
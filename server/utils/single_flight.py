@@ -0,0 +1,98 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key inside the worker: the first caller computes,
+    the callers arriving while it runs await its result (or its exception) instead of computing again.
+
+    Any async helper can use it, e.g. around an expensive query:
+
+        flights = SingleFlight()
+        rows = await flights.do(("top_rated", number), lambda: run_the_query(session, number))
+    """
+
+    def __init__(self):
+        # key -> future of the computation in flight
+        self.calls = {}
+        # Background refreshes, referenced until they finish so they are not garbage collected
+        self.tasks = set()
+        # Keys of the background refreshes that did not start computing yet
+        self.scheduled = set()
+
+    def in_flight(self, key) -> bool:
+        return key in self.calls or key in self.scheduled
+
+    async def do(self, key, compute):
+        """
+        The result of compute, shared with the concurrent callers of the same key.
+
+        Args:
+            key (hashable): What is computed.
+            compute (callable): Coroutine function without arguments computing the result.
+
+        Returns:
+            The result of the computation of the first caller.
+
+        Raises:
+            Exception: The exception raised by the computation, raised in every caller.
+        """
+        while True:
+            future = self.calls.get(key)
+            if future is None:
+                break
+            try:
+                # A cancelled waiter must not cancel the computation of the others
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The first caller was cancelled (e.g. the client went away), compute again
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await compute()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Retrieved, so a computation failing without waiters is not logged as never retrieved
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+    def refresh(self, key, compute) -> bool:
+        """
+        Compute the key in a background task, unless it is already computed.
+        Used to revalidate a stale value after it was returned.
+
+        Args:
+            key (hashable): What is computed.
+            compute (callable): Coroutine function without arguments computing the result, it must not use
+                anything that belongs to the request that started it (e.g. its database session).
+
+        Returns:
+            bool: False when a computation of the key was already in flight.
+        """
+        if self.in_flight(key):
+            return False
+
+        async def run():
+            try:
+                await self.do(key, compute)
+            except Exception as e:
+                print(f"Background refresh of {key} failed: {e}")
+            finally:
+                self.scheduled.discard(key)
+
+        self.scheduled.add(key)
+        task = asyncio.get_running_loop().create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
@@ -0,0 +1,515 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+from array import array
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Build the autocomplete index at startup, /productfilter/suggest answers nothing without it.
+# Every worker keeps its own index: the products a worker changes and the searches it counts are only in its
+# index, so with several workers (WORKERS of run.py) the suggestions depend on the worker answering until
+# they restart. Enable it when the app runs a single worker.
+AUTOCOMPLETE_ENABLED: bool = os.getenv("AUTOCOMPLETE_ENABLED", "false").lower() == "true"
+# Most suggestions /productfilter/suggest returns
+MAX_SUGGESTIONS: int = int(os.getenv("MAX_SUGGESTIONS", 10))
+# A search keyword is suggested once this many searches for it found products
+POPULAR_QUERY_MIN_COUNT: int = int(os.getenv("POPULAR_QUERY_MIN_COUNT", 3))
+# Most distinct search keywords counted, later new keywords are not tracked
+POPULAR_QUERY_MAX_TRACKED: int = 100000
+
+# Prefixes matching more suggestions than this keep their best suggestions cached,
+# the others are ranked by scanning their range of the sorted keys
+SCAN_LIMIT: int = 256
+
+# Sorts after every character, so key + LAST_CHARACTER is above every key starting with key
+LAST_CHARACTER = "\U0010ffff"
+
+
+def normalize(text: str) -> str:
+    """
+    The key a suggestion is stored and matched under: lowercase, single spaced.
+
+    Args:
+        text (str): The text of the suggestion, None is treated as empty.
+
+    Returns:
+        str: The normalized text.
+    """
+    return " ".join(text.lower().split()) if text else ""
+
+
+def normalize_prefix(prefix: str) -> str:
+    """
+    Normalize what the user typed so far. A trailing space is kept, so "red " only
+    completes to phrases whose first word is "red".
+
+    Args:
+        prefix (str): The typed text.
+
+    Returns:
+        str: The normalized prefix.
+    """
+    key = normalize(prefix)
+    if key and prefix[-1].isspace():
+        key += " "
+    return key
+
+
+class SuggestIndex:
+    """
+    Prefix index of the product names, category names and popular search keywords.
+
+    Every distinct (normalized) text is one suggestion whose weight adds up its sources:
+    1 + the number of reviews of every product with that name, 1 + the number of products
+    of a category and the number of searches of a keyword. The keys are kept in a sorted
+    list, so the suggestions starting with a prefix are a contiguous range found with bisect.
+    Ranges too large to scan keep their best suggestions in a cache, which every weight
+    change patches in place.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.key_entries = array("i")
+        # Per suggestion: key (None once removed), text shown and weight
+        self.entry_of = {}
+        self.entry_key = []
+        self.entry_text = []
+        self.weight = array("q")
+        # Best suggestions of the large prefixes, best first
+        self.top = {}
+        # Per product id: suggestion of its name (-1 if none), weight it adds and category
+        self.product_entry = array("i")
+        self.product_weight = array("q")
+        self.product_category = array("i")
+        # Per category id: suggestion of its name and number of products
+        self.category_entry = {}
+        self.category_products = {}
+        self.query_counts = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self, products, categories):
+        """
+        Fill an empty index in one pass, sorting the keys once.
+
+        Args:
+            products: (product id, product name, category id, number of reviews) of every product.
+            categories: (category id, category name) of every category.
+        """
+        with self.lock:
+            for product_id, product_name, category_id, num_reviews in products:
+                self._grow(product_id)
+                self.product_weight[product_id] = 1 + (num_reviews or 0)
+                self.product_entry[product_id] = self._entry(product_name)
+                if self.product_entry[product_id] >= 0:
+                    self.weight[self.product_entry[product_id]] += self.product_weight[product_id]
+                if category_id is not None:
+                    self.product_category[product_id] = category_id
+                    self.category_products[category_id] = self.category_products.get(category_id, 0) + 1
+
+            for category_id, category_name in categories:
+                self.category_entry[category_id] = entry = self._entry(category_name)
+                if entry >= 0:
+                    self.weight[entry] += 1 + self.category_products.get(category_id, 0)
+
+            # Every product and category adds at least 1, so no suggestion is without weight
+            order = sorted(range(len(self.entry_key)), key=self.entry_key.__getitem__)
+            self.keys = [self.entry_key[entry] for entry in order]
+            self.key_entries = array("i", order)
+
+            # Rank every large prefix up front, so no search has to
+            self._fill("", 0, len(self.keys))
+            self.top.pop("", None)
+
+    def suggest(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> list:
+        """
+        The suggestions starting with the typed text, most popular first.
+
+        Args:
+            prefix (str): The typed text.
+            limit (int): The number of suggestions, at most MAX_SUGGESTIONS.
+
+        Returns:
+            list: The texts of the suggestions.
+        """
+        key = normalize_prefix(prefix)
+        if not key:
+            return []
+        with self.lock:
+            return [self.entry_text[entry] for entry in self._best(key)[:limit]]
+
+    def add_product(self, product_id: int, product_name: str, category_id: int, num_reviews: int):
+        """
+        Index a created or changed product, replacing what it added before.
+
+        Args:
+            product_id (int): The ID of the product.
+            product_name (str): The name of the product.
+            category_id (int): The category of the product, None for none.
+            num_reviews (int): The number of reviews of the product.
+        """
+        with self.lock:
+            self._remove_product(product_id)
+            self._grow(product_id)
+            weight = 1 + (num_reviews or 0)
+            self.product_weight[product_id] = weight
+            self.product_entry[product_id] = self._add_weight(product_name, weight)
+            if category_id is not None:
+                self.product_category[product_id] = category_id
+                self._add_category_products(category_id, 1)
+
+    def remove_product(self, product_id: int):
+        """
+        Remove what a deleted product added to the suggestions.
+
+        Args:
+            product_id (int): The ID of the product.
+        """
+        with self.lock:
+            self._remove_product(product_id)
+
+    def set_category(self, category_id: int, category_name: str = None):
+        """
+        Index a created or renamed category, or remove a deleted one (category_name None).
+
+        Args:
+            category_id (int): The ID of the category.
+            category_name (str): The name of the category, None if it was deleted.
+        """
+        with self.lock:
+            weight = 1 + self.category_products.get(category_id, 0)
+            entry = self.category_entry.pop(category_id, -1)
+            if entry >= 0:
+                self._change_weight(entry, -weight)
+            if category_name is None:
+                # Its products have no category any more
+                self.category_products.pop(category_id, None)
+                return
+            self.category_entry[category_id] = self._add_weight(category_name, weight)
+
+    def record_query(self, keyword: str):
+        """
+        Count a search that found products, popular keywords become suggestions.
+
+        Args:
+            keyword (str): The search keyword.
+        """
+        key = normalize(keyword)
+        if not key:
+            return
+        with self.lock:
+            count = self.query_counts.get(key)
+            if count is None and len(self.query_counts) >= POPULAR_QUERY_MAX_TRACKED:
+                return
+            count = self.query_counts[key] = (count or 0) + 1
+            if count == POPULAR_QUERY_MIN_COUNT:
+                self._add_weight(keyword, count)
+            elif count > POPULAR_QUERY_MIN_COUNT:
+                self._add_weight(keyword, 1)
+
+    def _grow(self, product_id: int):
+        if product_id >= len(self.product_entry):
+            missing = product_id + 1 - len(self.product_entry)
+            self.product_entry.extend([-1] * missing)
+            self.product_weight.extend([0] * missing)
+            self.product_category.extend([-1] * missing)
+
+    def _remove_product(self, product_id: int):
+        if product_id >= len(self.product_entry):
+            return
+        if self.product_entry[product_id] >= 0:
+            self._change_weight(self.product_entry[product_id], -self.product_weight[product_id])
+            self.product_entry[product_id] = -1
+        if self.product_category[product_id] >= 0:
+            self._add_category_products(self.product_category[product_id], -1)
+            self.product_category[product_id] = -1
+
+    def _add_category_products(self, category_id: int, count: int):
+        # Products of deleted categories no longer count
+        if category_id not in self.category_products and category_id not in self.category_entry:
+            return
+        self.category_products[category_id] = self.category_products.get(category_id, 0) + count
+        entry = self.category_entry.get(category_id, -1)
+        if entry >= 0:
+            self._change_weight(entry, count)
+
+    def _entry(self, text: str) -> int:
+        """
+        The suggestion of a text, created without weight (and unsorted) if it is new.
+        Returns -1 for an empty text.
+        """
+        key = normalize(text)
+        if not key:
+            return -1
+        entry = self.entry_of.get(key)
+        if entry is None:
+            entry = self.entry_of[key] = len(self.entry_key)
+            self.entry_key.append(key)
+            self.entry_text.append(" ".join(text.split()))
+            self.weight.append(0)
+        return entry
+
+    def _add_weight(self, text: str, amount: int) -> int:
+        """
+        Add weight to the suggestion of a text, inserting it in the sorted keys if it is new.
+        Returns the suggestion, -1 for an empty text.
+        """
+        entry = self._entry(text)
+        if entry < 0:
+            return -1
+        if self.weight[entry] <= 0:
+            position = bisect.bisect_left(self.keys, self.entry_key[entry])
+            self.keys.insert(position, self.entry_key[entry])
+            self.key_entries.insert(position, entry)
+        self._change_weight(entry, amount)
+        return entry
+
+    def _change_weight(self, entry: int, amount: int):
+        self.weight[entry] += amount
+        key = self.entry_key[entry]
+        if self.weight[entry] <= 0:
+            position = bisect.bisect_left(self.keys, key)
+            del self.keys[position], self.key_entries[position]
+            self._forget(entry)
+
+        # Patch the cached best suggestions of every prefix of the key
+        for length in range(1, len(key) + 1):
+            best = self.top.get(key[:length])
+            if best is None:
+                continue
+            if entry in best:
+                if amount < 0:
+                    # Whatever comes next is not known, rank the prefix again on its next use
+                    del self.top[key[:length]]
+                    continue
+                best.sort(key=self._rank)
+            elif amount > 0 and (len(best) < MAX_SUGGESTIONS or self._rank(entry) < self._rank(best[-1])):
+                best.append(entry)
+                best.sort(key=self._rank)
+                del best[MAX_SUGGESTIONS:]
+
+    def _forget(self, entry: int):
+        del self.entry_of[self.entry_key[entry]]
+        self.entry_key[entry] = None
+        self.entry_text[entry] = None
+
+    def _rank(self, entry: int):
+        return -self.weight[entry], self.entry_key[entry]
+
+    def _best(self, key: str) -> list:
+        """
+        The best MAX_SUGGESTIONS suggestions starting with a normalized prefix.
+        """
+        best = self.top.get(key)
+        if best is not None:
+            return best
+
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + LAST_CHARACTER, start)
+        if end - start > SCAN_LIMIT:
+            return self._fill(key, start, end)
+        return self._scan(start, end)
+
+    def _scan(self, start: int, end: int) -> list:
+        """
+        The best MAX_SUGGESTIONS suggestions of a range of the sorted keys.
+        """
+        weight, key_entries = self.weight, self.key_entries
+        # Positions in the sorted keys follow the keys, so the smallest position wins a tie
+        positions = heapq.nsmallest(
+            MAX_SUGGESTIONS, range(start, end),
+            key=lambda position: (-weight[key_entries[position]], position),
+        )
+        return [key_entries[position] for position in positions]
+
+    def _fill(self, key: str, start: int, end: int) -> list:
+        """
+        Rank and cache a large prefix from the best suggestions of its one character longer
+        prefixes, ranking (and caching) the large ones among them first.
+        """
+        candidates = []
+        position = start
+        if position < end and self.keys[position] == key:
+            candidates.append(self.key_entries[position])
+            position += 1
+
+        while position < end:
+            child = self.keys[position][:len(key) + 1]
+            child_end = bisect.bisect_left(self.keys, child + LAST_CHARACTER, position, end)
+            if child_end - position > SCAN_LIMIT:
+                best = self.top.get(child)
+                candidates.extend(best if best is not None else self._fill(child, position, child_end))
+            else:
+                candidates.extend(self._scan(position, child_end))
+            position = child_end
+
+        best = self.top[key] = sorted(candidates, key=self._rank)[:MAX_SUGGESTIONS]
+        return best
+
+
+# The index of this process, filled by build_suggest_index at startup.
+# Every worker process keeps (and maintains) its own copy.
+suggest_index = SuggestIndex()
+suggest_index_ready = False
+
+
+def build_suggest_index():
+    """
+    Load the product and category names of the database and make the index the one used by this process.
+
+    Returns:
+        SuggestIndex: The new index.
+    """
+    global suggest_index, suggest_index_ready
+    from sqlalchemy import select
+    from server.db.db import SessionLocal
+    from server.models.models import Product, ProductCategory, ProductReviewStats
+
+    started = time.perf_counter()
+    index = SuggestIndex()
+    session = SessionLocal()
+    try:
+        products = session.execute(
+            select(Product.id, Product.product_name, Product.category_id, ProductReviewStats.num_reviews)
+            .outerjoin(ProductReviewStats, ProductReviewStats.product_id == Product.id)
+            .execution_options(stream_results=True)
+        ).yield_per(10000)
+        categories = session.execute(select(ProductCategory.id, ProductCategory.category_name)).all()
+        index.load(products, categories)
+    finally:
+        session.close()
+
+    suggest_index, suggest_index_ready = index, True
+    print(f"Suggest index built: {len(index)} suggestions in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def refresh_product_suggestions(session, product_ids: list):
+    """
+    Bring the suggestions up to date with the committed state of some products.
+    Products that no longer exist are removed. Does nothing unless the index is in use.
+
+    Args:
+        session: SQLAlchemy session object.
+        product_ids (list): The IDs of the created or changed products.
+    """
+    if not suggest_index_ready or not product_ids:
+        return
+    from sqlalchemy import select
+    from server.models.models import Product, ProductReviewStats
+
+    rows = session.execute(
+        select(Product.id, Product.product_name, Product.category_id, ProductReviewStats.num_reviews)
+        .outerjoin(ProductReviewStats, ProductReviewStats.product_id == Product.id)
+        .filter(Product.id.in_(product_ids))
+    ).all()
+    for row in rows:
+        suggest_index.add_product(row.id, row.product_name, row.category_id, row.num_reviews)
+    for product_id in set(product_ids) - {row.id for row in rows}:
+        suggest_index.remove_product(product_id)
+
+
+def remove_product_suggestions(product_id: int):
+    """
+    Remove a deleted product from the suggestions. Does nothing unless the index is in use.
+
+    Args:
+        product_id (int): The ID of the deleted product.
+    """
+    if suggest_index_ready:
+        suggest_index.remove_product(product_id)
+
+
+def refresh_category_suggestions(category_id: int, category_name: str = None):
+    """
+    Index a created or renamed category, or remove a deleted one. Does nothing unless the index is in use.
+
+    Args:
+        category_id (int): The ID of the category.
+        category_name (str): The committed name of the category, None if it was deleted.
+    """
+    if suggest_index_ready:
+        suggest_index.set_category(category_id, category_name)
+
+
+def suggest(prefix: str, limit: int = MAX_SUGGESTIONS) -> list:
+    """
+    The suggestions of this process starting with the typed text, most popular first.
+
+    Args:
+        prefix (str): The typed text.
+        limit (int): The number of suggestions, at most MAX_SUGGESTIONS.
+
+    Returns:
+        list: The texts of the suggestions.
+    """
+    return suggest_index.suggest(prefix, limit)
+
+
+def record_search(keyword: str):
+    """
+    Count a search that found products towards the popular search suggestions.
+
+    Args:
+        keyword (str): The search keyword.
+    """
+    if suggest_index_ready:
+        suggest_index.record_query(keyword)
+
+
+if __name__ == "__main__":
+    # Benchmark on a synthetic catalog: python -m server.utils.suggest_index [number of products]
+    import random
+    import resource
+    import statistics
+    import string
+    import sys
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    adjectives = ["classic", "slim", "relaxed", "vintage", "premium", "waterproof", "leather", "cotton", "wool", "running"]
+    colors = ["red", "blue", "green", "black", "white", "grey", "navy", "brown"]
+    nouns = ["shoe", "sneaker", "boot", "shirt", "jacket", "coat", "hoodie", "jeans", "dress", "bag"]
+    # Brand and model names make most product names unique
+    brands = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))) for _ in range(20000)]
+
+    def products():
+        for product_id in range(1, size + 1):
+            if rng.random() < 0.5:
+                name = f"{rng.choice(brands)} {rng.choice(adjectives)} {rng.choice(nouns)} {rng.randint(1, 999)}"
+            else:
+                name = f"{rng.choice(adjectives)} {rng.choice(colors)} {rng.choice(nouns)} {rng.choice(brands)}"
+            yield product_id, name.title(), rng.randint(1, 50), rng.choice([0, 0, 0, 1, 2, 5, 40])
+
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index = SuggestIndex()
+    index.load(products(), [(category_id, f"category {category_id}") for category_id in range(1, 51)])
+    build_seconds = time.perf_counter() - started
+    memory_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before) / 1024
+    print(f"{size} products loaded in {build_seconds:.1f}s, {len(index)} suggestions, "
+          f"{len(index.top)} cached prefixes, ~{memory_mb:.0f} MB")
+
+    keys = [rng.choice(index.keys) for _ in range(2000)]
+    for length in (1, 2, 3, 4, 6, 10):
+        timings = []
+        for key in keys:
+            started = time.perf_counter()
+            index.suggest(key[:length])
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"prefix length {length:>2}: median {statistics.median(timings):.4f} ms, "
+              f"p99 {timings[int(len(timings) * 0.99) - 1]:.4f} ms, max {timings[-1]:.4f} ms")
+
+    started = time.perf_counter()
+    for product_id in range(1, 10001):
+        index.add_product(product_id, f"{rng.choice(adjectives)} {rng.choice(nouns)} {product_id}", 1, 3)
+    for _ in range(10000):
+        index.record_query(f"{rng.choice(adjectives)} {rng.choice(nouns)}")
+    print(f"10000 product updates and 10000 searches recorded in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from server.utils.shared_cache import shared_store
+
+load_dotenv()
+
+# Answer the lookups of reset tokens that were never used from a Bloom filter of the blacklist kept by
+# every worker, only the tokens it may contain are looked up in the tokens table.
+# Single host only: the workers learn the tokens the others used from the invalidation log of the SQLite
+# shared cache (SHARED_CACHE_STORAGE), which is local to the host, a used token could be replayed on another
+# host. The filter is not used with SHARED_CACHE_STORAGE="memory", where no worker learns of the others
+TOKEN_BLOOM_FILTER_ENABLED: bool = os.getenv("TOKEN_BLOOM_FILTER_ENABLED", "false").lower() == "true"
+# Blacklisted tokens the filter is sized for at least, it is sized for twice the rows when it is rebuilt
+TOKEN_BLOOM_CAPACITY: int = int(os.getenv("TOKEN_BLOOM_CAPACITY", 100000))
+# Share of the lookups of valid tokens that still reach the database when the filter holds its capacity
+TOKEN_BLOOM_ERROR_RATE: float = float(os.getenv("TOKEN_BLOOM_ERROR_RATE", 0.001))
+# Seconds between two deletions of the expired tokens of the blacklist, 0 never deletes them
+TOKEN_PRUNE_INTERVAL_SECONDS: int = int(os.getenv("TOKEN_PRUNE_INTERVAL_SECONDS", 3600))
+# Rows deleted per transaction, so the pruning never holds many row locks or a long transaction
+TOKEN_PRUNE_BATCH_SIZE: int = int(os.getenv("TOKEN_PRUNE_BATCH_SIZE", 1000))
+
+# Prefix of the tags logged in the shared store when a token is blacklisted, the other workers add it to their filter
+TAG_PREFIX = "token_blacklist:"
+
+
+def token_digest(token: str) -> bytes:
+    """The SHA-256 digest of a token, the filter and the shared log only hold digests."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class BloomFilter:
+    """
+    A Bloom filter of SHA-256 digests: "not in the filter" is certain, "in the filter" may be wrong
+    with the error rate it was sized for.
+
+    The digest is already uniform, its first 16 bytes give the two hashes the bit positions are
+    derived from (h1 + i * h2, Kirsch and Mitzenmacher), no other hashing is done.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest: bytes):
+        first, second = struct.unpack_from("<QQ", digest)
+        # An odd step never cycles through a subset of the bits
+        second |= 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+bloom_filter = None
+# Sequence number of the shared log the filter has applied
+_applied = 0
+# Digests blacklisted by this worker while a filter is built, added to it before it replaces the current one
+_building = None
+_lock = threading.Lock()
+_prune_task = None
+
+
+def filter_enabled() -> bool:
+    """Whether the filter is used: it is enabled and the workers share the log of the blacklisted tokens."""
+    return TOKEN_BLOOM_FILTER_ENABLED and shared_store() is not None
+
+
+def build_filter():
+    """
+    Fill a new filter with the blacklisted tokens that did not expire and make it the one of this process.
+
+    Returns:
+        BloomFilter: The new filter.
+    """
+    global bloom_filter, _applied, _building
+    from sqlalchemy import select, func
+    from server.db.db import engine
+    from server.models.models import Token
+
+    started = time.perf_counter()
+    store = shared_store()
+    with _lock:
+        _building = []
+    # Read before the rows, the tokens blacklisted meanwhile by other workers are applied by the next lookup
+    applied = store.last_sequence() if store is not None else 0
+    with engine.connect() as connection:
+        rows = connection.execute(select(func.count()).select_from(Token).where(Token.expires_at >= func.now())).scalar()
+        new_filter = BloomFilter(max(TOKEN_BLOOM_CAPACITY, 2 * rows), TOKEN_BLOOM_ERROR_RATE)
+        tokens = connection.execution_options(stream_results=True).execute(
+            select(Token.token).where(Token.expires_at >= func.now())
+        )
+        for partition in tokens.partitions(10000):
+            for (token,) in partition:
+                new_filter.add(token_digest(token))
+
+    with _lock:
+        for digest in _building:
+            new_filter.add(digest)
+        bloom_filter, _applied, _building = new_filter, applied, None
+    print(f"Token blacklist filter built: {new_filter.count} tokens in {time.perf_counter() - started:.2f}s")
+    return new_filter
+
+
+def _sync():
+    """Add the tokens the other workers blacklisted since the last lookup to the filter."""
+    global bloom_filter, _applied
+    store = shared_store()
+    if store is None or store.sequence() == _applied:
+        return
+    with _lock:
+        invalidations, last, pruned = store.changes(_applied)
+        if not pruned:
+            for _, tags in invalidations:
+                for tag in tags:
+                    if tag.startswith(TAG_PREFIX):
+                        bloom_filter.add(bytes.fromhex(tag[len(TAG_PREFIX):]))
+            _applied = last
+            return
+    # The log no longer has every token blacklisted since the filter was built (e.g. the worker was idle longer
+    # than SHARED_CACHE_LOG_SECONDS), the filter is read again from the database
+    build_filter()
+
+
+def may_contain(token: str) -> bool:
+    """
+    Whether the token may be blacklisted.
+
+    Args:
+        token (str): The token.
+
+    Returns:
+        bool: False only when the token is certainly not blacklisted, True when the database must be asked
+            (the filter is disabled, not built yet or says it may contain the token).
+    """
+    if bloom_filter is None:
+        return True
+    _sync()
+    return token_digest(token) in bloom_filter
+
+
+def remember(token: str):
+    """
+    Add a token to the filter of every worker, after its row was committed.
+
+    Args:
+        token (str): The blacklisted token.
+    """
+    global _applied
+    if not filter_enabled():
+        return
+    digest = token_digest(token)
+    with _lock:
+        if bloom_filter is not None:
+            bloom_filter.add(digest)
+        if _building is not None:
+            _building.append(digest)
+    store = shared_store()
+    if store is not None:
+        sequence = store.invalidate([TAG_PREFIX + digest.hex()])
+        with _lock:
+            # Nothing else was logged in between, there is nothing to apply
+            if sequence == _applied + 1:
+                _applied = sequence
+
+
+def prune_expired_tokens(batch_size: int = TOKEN_PRUNE_BATCH_SIZE) -> int:
+    """
+    Delete the blacklisted tokens that expired, in transactions of batch_size rows.
+    An expired token is refused when it is decoded, its row is no longer needed.
+
+    Args:
+        batch_size (int): Rows deleted per transaction.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    from sqlalchemy import select, delete, func
+    from server.db.db import engine
+    from server.models.models import Token
+
+    expired = (
+        select(Token.id)
+        .where(Token.expires_at < func.now())
+        .limit(batch_size)
+        # Workers pruning at the same time delete different rows instead of waiting on each other
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(delete(Token).where(Token.id.in_(expired))).rowcount
+        deleted += rows
+        if rows < batch_size:
+            return deleted
+
+
+def prune_and_rebuild():
+    """Delete the expired tokens, then rebuild the filter without them (bits can not be removed from it)."""
+    deleted = prune_expired_tokens()
+    if deleted:
+        print(f"Token blacklist pruned: {deleted} expired tokens")
+    if filter_enabled() and (deleted or bloom_filter is None):
+        build_filter()
+
+
+async def maintain_periodically():
+    """
+    Build the filter, then prune the expired tokens every TOKEN_PRUNE_INTERVAL_SECONDS,
+    in a thread of the default executor. Lookups ask the database until the filter is built.
+    """
+    loop = asyncio.get_running_loop()
+    if filter_enabled():
+        try:
+            await loop.run_in_executor(None, build_filter)
+        except Exception as e:
+            print(f"Token blacklist filter not built: {e}")
+    elif TOKEN_BLOOM_FILTER_ENABLED:
+        print('Token blacklist filter not used: SHARED_CACHE_STORAGE="memory" does not share the used tokens between the workers')
+    if TOKEN_PRUNE_INTERVAL_SECONDS <= 0:
+        return
+    while True:
+        await asyncio.sleep(TOKEN_PRUNE_INTERVAL_SECONDS)
+        try:
+            await loop.run_in_executor(None, prune_and_rebuild)
+        except Exception as e:
+            print(f"Token blacklist not pruned: {e}")
+
+
+def start_maintenance():
+    """Build the filter in the background and prune the blacklist periodically, once per process."""
+    global _prune_task
+    if _prune_task is None:
+        _prune_task = asyncio.get_running_loop().create_task(maintain_periodically())
+
+
+def stop_maintenance():
+    """Stop pruning the blacklist."""
+    global _prune_task
+    if _prune_task is not None:
+        _prune_task.cancel()
+        _prune_task = None
@@ -0,0 +1,135 @@
+import os
+import uuid
+
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+load_dotenv()
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """
+    The engine of the database named by the DB setting, migrated with alembic upgrade head.
+    The tests using it are skipped when no PostgreSQL database is configured or reachable.
+    """
+    if not (os.getenv("DB") or "").startswith("postgres"):
+        pytest.skip("DB does not name a PostgreSQL database")
+    from server.db.db import engine
+
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except OperationalError as e:
+        pytest.skip(f"The database is not reachable: {e}")
+    return engine
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    """
+    A client of the app, its requests are not rate limited. Started as a context manager, the requests share
+    one event loop and the connections of the asyncio engine, the startup and shutdown hooks run.
+    """
+    from fastapi.testclient import TestClient
+    from server.backend import app
+    from server.db.db import async_engine
+    from server.utils import rate_limit, response_cache
+
+    monkeypatch.setattr(rate_limit, "check_rate_limit", lambda *args: {})
+    # The endpoints run their queries, they are not answered from the response cache
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(response_cache, "CONDITIONAL_GET_ENABLED", False)
+    with TestClient(app) as client:
+        yield client
+        # The pooled connections belong to the event loop of this client
+        client.portal.call(async_engine.dispose)
+
+
+class Catalog:
+    """
+    A category and a user, with the products the test adds to them. Every product has two images, a review
+    of the user (counted in its review statistics), a sale and a purchase, is featured and is in the cart and
+    the favorites of the user.
+    """
+
+    def __init__(self, engine):
+        from server.db.db import SessionLocal
+        from server.models.models import ProductCategory, User
+        from server.utils import oauth2
+
+        self.engine = engine
+        # Names, sizes and colors only the products of this catalog have
+        self.keyword = f"zq{uuid.uuid4().hex[:10]}"
+        self.product_ids = []
+        with SessionLocal() as session:
+            category = ProductCategory(category_name=f"{self.keyword} category")
+            user = User(username=self.keyword, email=f"{self.keyword}@example.com", password="x", role="user")
+            session.add_all([category, user])
+            session.commit()
+            self.category_id, self.user_id = category.id, user.id
+        token = oauth2.create_access_token(data={"user_id": self.user_id, "role": "user", "ver": 0})
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def add_products(self, count: int) -> list:
+        """Add count products, returns their ids."""
+        from server.db.db import SessionLocal
+        from server.db.review_stats_helper import apply_review_delta
+        from server.models.models import Product, ProductImage, Review, Sales, FeaturedProduct, Cart, Favorite, UserPurchase
+
+        with SessionLocal() as session:
+            products = [
+                Product(
+                    product_name=f"{self.keyword} shoe {len(self.product_ids) + index}",
+                    description="comfortable",
+                    price=10.0 + index,
+                    stock_quantity=3,
+                    product_size=self.keyword,
+                    SKU=f"{self.keyword}-{len(self.product_ids) + index}",
+                    target_audience="men",
+                    product_color=self.keyword,
+                    category_id=self.category_id,
+                )
+                for index in range(count)
+            ]
+            session.add_all(products)
+            session.flush()
+            for index, product in enumerate(products):
+                session.add_all([
+                    ProductImage(image_path=f"{product.id}a.png", product_id=product.id),
+                    ProductImage(image_path=f"{product.id}b.png", product_id=product.id),
+                    Review(product_id=product.id, user_id=self.user_id, rating=1 + index % 5, comment="ok"),
+                    Sales(product_id=product.id, discount_percent=10),
+                    FeaturedProduct(product_id=product.id),
+                    Cart(product_id=product.id, user_id=self.user_id, quantity=1),
+                    Favorite(product_id=product.id, user_id=self.user_id),
+                    UserPurchase(product_id=product.id, user_id=self.user_id, status="delivered"),
+                ])
+                apply_review_delta(session, product.id, 1 + index % 5, 1)
+            session.commit()
+            ids = [product.id for product in products]
+        self.product_ids.extend(ids)
+        return ids
+
+    def delete(self):
+        with self.engine.begin() as connection:
+            if self.product_ids:
+                ids = {"ids": tuple(self.product_ids)}
+                for table in (
+                    "carts", "favorites", "user_purchases", "featured_products", "sales", "reviews", "product_images",
+                    "banners", "product_review_stats",
+                ):
+                    connection.execute(text(f"DELETE FROM {table} WHERE product_id IN :ids"), ids)
+                connection.execute(text("DELETE FROM products WHERE id IN :ids"), ids)
+            connection.execute(text("DELETE FROM product_categories WHERE id = :id"), {"id": self.category_id})
+            connection.execute(text("DELETE FROM users WHERE id = :id"), {"id": self.user_id})
+
+
+@pytest.fixture
+def catalog(engine):
+    """A Catalog deleted after the test."""
+    catalog = Catalog(engine)
+    yield catalog
+    catalog.delete()
@@ -0,0 +1,294 @@
+import asyncio
+import smtplib
+import threading
+import time
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from server.utils import email_outbox
+
+
+class StubSender:
+    """Stands in for SMTPSender: raises the given errors in turn, sends when the next one is None or none is left."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.sent = []
+
+    def send(self, recipient: str, message: str):
+        self.calls += 1
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.sent.append(recipient)
+
+
+class SMTPStandIn:
+    """
+    A local SMTP server answering every command after reply_delay seconds, keeping the messages it received.
+    The recipients in refused are refused with a 550.
+    """
+
+    def __init__(self, reply_delay: float, refused=()):
+        self.reply_delay = reply_delay
+        self.refused = set(refused)
+        self.received = []
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.session, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def session(self, reader, writer):
+        async def reply(line: str):
+            await asyncio.sleep(self.reply_delay)
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        await reply("220 stand-in ESMTP")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                await reply("250 stand-in")
+            elif command.startswith("RCPT") and any(recipient.upper() in command for recipient in self.refused):
+                await reply("550 no such user")
+            elif command == "DATA":
+                await reply("354 end with <CRLF>.<CRLF>")
+                self.received.append(await reader.readuntil(b"\r\n.\r\n"))
+                await reply("250 queued")
+            elif command == "QUIT":
+                await reply("221 bye")
+                break
+            else:
+                await reply("250 ok")
+        writer.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture
+def outbox(engine):
+    """Empties the email_outbox table around the test, returns a function adding emails to it."""
+    def add(count: int = 1, attempts: int = 0) -> list:
+        with engine.begin() as connection:
+            return [
+                connection.execute(
+                    text(
+                        "INSERT INTO email_outbox (recipient, subject, body, attempts) "
+                        "VALUES (:recipient, 'subject', 'body', :attempts) RETURNING id"
+                    ),
+                    {"recipient": f"user{index}@example.com", "attempts": attempts},
+                ).scalar()
+                for index in range(count)
+            ]
+
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM email_outbox"))
+    yield add
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM email_outbox"))
+
+
+def outbox_rows(engine) -> dict:
+    """id -> (status, attempts, seconds until the next attempt, last error) of the emails in the outbox."""
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT id, status, attempts, extract(epoch FROM next_attempt_at - now()), last_error "
+                "FROM email_outbox ORDER BY id"
+            )
+        ).fetchall()
+    return {row[0]: (row[1], row[2], float(row[3]), row[4]) for row in rows}
+
+
+def test_retry_delay_doubles_up_to_an_hour(monkeypatch):
+    monkeypatch.setattr(email_outbox, "EMAIL_OUTBOX_RETRY_SECONDS", 30.0)
+
+    assert [email_outbox.retry_delay(attempts) for attempts in range(1, 6)] == [30, 60, 120, 240, 480]
+    assert email_outbox.retry_delay(8) == 3600
+    assert email_outbox.retry_delay(50) == 3600
+
+
+@pytest.mark.parametrize(
+    "error, permanent",
+    [
+        (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}), True),
+        (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user"), "b@example.com": (451, b"later")}), False),
+        (smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"mailbox full")}), False),
+        (smtplib.SMTPDataError(554, b"message rejected"), True),
+        (smtplib.SMTPDataError(451, b"try again later"), False),
+        (smtplib.SMTPSenderRefused(553, b"sender refused", "store@example.com"), True),
+        # Wrong credentials are a mistake of the configuration, the emails are sent once it is fixed
+        (smtplib.SMTPAuthenticationError(535, b"bad credentials"), False),
+        (smtplib.SMTPServerDisconnected("connection closed"), False),
+        (ConnectionRefusedError(), False),
+        (TimeoutError(), False),
+    ],
+)
+def test_is_permanent(error, permanent):
+    assert email_outbox.is_permanent(error) is permanent
+
+
+def test_sent_emails_are_deleted(engine, outbox):
+    outbox(2)
+    sender = StubSender()
+
+    assert email_outbox.send_batch(sender) == 2
+    assert sorted(sender.sent) == ["user0@example.com", "user1@example.com"]
+    assert outbox_rows(engine) == {}
+
+
+def test_temporary_failure_is_retried_with_backoff(engine, outbox, monkeypatch):
+    monkeypatch.setattr(email_outbox, "EMAIL_OUTBOX_RETRY_SECONDS", 30.0)
+    [email_id] = outbox()
+
+    email_outbox.send_batch(StubSender(smtplib.SMTPDataError(451, b"try again later")))
+    status, attempts, delay, error = outbox_rows(engine)[email_id]
+    assert (status, attempts) == ("pending", 1)
+    assert 25 < delay <= 30
+    assert "try again later" in error
+
+    # Not due before its retry
+    assert email_outbox.send_batch(StubSender()) == 0
+
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE email_outbox SET next_attempt_at = now()"))
+    email_outbox.send_batch(StubSender(smtplib.SMTPDataError(451, b"try again later")))
+    status, attempts, delay, _ = outbox_rows(engine)[email_id]
+    assert (status, attempts) == ("pending", 2)
+    assert 55 < delay <= 60
+
+
+def test_permanent_failure_is_not_retried(engine, outbox):
+    [email_id] = outbox()
+
+    email_outbox.send_batch(StubSender(smtplib.SMTPRecipientsRefused({"user0@example.com": (550, b"no such user")})))
+    status, attempts, _, _ = outbox_rows(engine)[email_id]
+    assert (status, attempts) == ("failed", 1)
+
+
+def test_last_attempt_is_kept_as_failed(engine, outbox, monkeypatch):
+    monkeypatch.setattr(email_outbox, "EMAIL_OUTBOX_MAX_ATTEMPTS", 3)
+    [email_id] = outbox(attempts=2)
+
+    email_outbox.send_batch(StubSender(smtplib.SMTPDataError(451, b"try again later")))
+    status, attempts, _, _ = outbox_rows(engine)[email_id]
+    assert (status, attempts) == ("failed", 3)
+
+
+@pytest.mark.parametrize(
+    "error, connection_error",
+    [
+        (ConnectionRefusedError(), True),
+        (TimeoutError(), True),
+        (smtplib.SMTPServerDisconnected("connection closed"), True),
+        (smtplib.SMTPConnectError(421, b"too busy"), True),
+        # SMTPException is an OSError, a refused email is not a connection error
+        (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}), False),
+        (smtplib.SMTPDataError(451, b"try again later"), False),
+    ],
+)
+def test_is_connection_error(error, connection_error):
+    assert email_outbox.is_connection_error(error) is connection_error
+
+
+@pytest.mark.parametrize("code, status", [(550, "failed"), (451, "pending")])
+def test_refused_email_does_not_stop_the_batch(engine, outbox, code, status):
+    outbox(3)
+    # The first email of the batch is refused
+    sender = StubSender(smtplib.SMTPRecipientsRefused({"user@example.com": (code, b"refused")}))
+
+    assert email_outbox.send_batch(sender) == 3
+    assert len(sender.sent) == 2
+    assert [row[:2] for row in outbox_rows(engine).values()] == [(status, 1)]
+
+
+def test_refused_recipient_keeps_the_connection(monkeypatch):
+    smtp = SMTPStandIn(0, refused=["refused@example.com"])
+    monkeypatch.setattr(email_outbox, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(email_outbox, "SMTP_PORT", smtp.port)
+    monkeypatch.setattr(email_outbox, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email_outbox, "SMTP_USERNAME", "")
+    sender = email_outbox.SMTPSender()
+    try:
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            sender.send("refused@example.com", email_outbox.build_message("refused@example.com", "subject", "body"))
+        connection = sender.connection
+        assert connection is not None
+        sender.send("user@example.com", email_outbox.build_message("user@example.com", "subject", "body"))
+        assert sender.connection is connection
+        assert len(smtp.received) == 1
+    finally:
+        sender.close()
+        smtp.close()
+
+
+def test_unreachable_server_reschedules_the_rest_of_the_batch(engine, outbox):
+    outbox(3)
+    sender = StubSender(ConnectionRefusedError())
+
+    assert email_outbox.send_batch(sender) == 3
+    # The other emails do not wait for their own connection timeout
+    assert sender.calls == 1
+    assert [(status, attempts) for status, attempts, _, _ in outbox_rows(engine).values()] == [("pending", 1)] * 3
+
+
+def test_claimed_emails_are_reclaimed_after_claim_seconds(engine, outbox, monkeypatch):
+    monkeypatch.setattr(email_outbox, "CLAIM_SECONDS", 0.5)
+    [email_id] = outbox()
+
+    with engine.begin() as connection:
+        assert [(row[0], row[4]) for row in email_outbox.claim_batch(connection)] == [(email_id, 1)]
+    # The sender claiming them died: the other senders skip them until the claim runs out
+    with engine.begin() as connection:
+        assert email_outbox.claim_batch(connection) == []
+    time.sleep(0.6)
+    with engine.begin() as connection:
+        assert [(row[0], row[4]) for row in email_outbox.claim_batch(connection)] == [(email_id, 2)]
+
+
+def test_forget_password_does_not_wait_for_the_smtp_server(engine, outbox, client, monkeypatch):
+    reply_delay = 0.5
+    smtp = SMTPStandIn(reply_delay)
+    monkeypatch.setattr(email_outbox, "EMAIL_OUTBOX_ENABLED", True)
+    monkeypatch.setattr(email_outbox, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(email_outbox, "SMTP_PORT", smtp.port)
+    monkeypatch.setattr(email_outbox, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email_outbox, "SMTP_USERNAME", "")
+    email = f"reset-{uuid.uuid4().hex[:12]}@example.com"
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (username, email, password, role) VALUES (:email, :email, 'x', 'user')"),
+            {"email": email},
+        )
+    try:
+        # Opens the connections of the pool
+        client.post("/reset/forget_password", json={"email": "nobody@example.com"})
+
+        started = time.perf_counter()
+        response = client.post("/reset/forget_password", json={"email": email})
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 200
+        # Sent inside the request, the email would take at least six replies of the server
+        assert elapsed < reply_delay
+        assert smtp.received == []
+
+        sender = email_outbox.SMTPSender()
+        try:
+            assert email_outbox.drain(sender) == 1
+        finally:
+            sender.close()
+        assert len(smtp.received) == 1
+        assert b"reset-password?token=" in smtp.received[0]
+        assert outbox_rows(engine) == {}
+    finally:
+        smtp.close()
+        with engine.begin() as connection:
+            connection.execute(text("DELETE FROM users WHERE email = :email"), {"email": email})
@@ -0,0 +1,89 @@
+import pytest
+from fastapi.exceptions import ResponseValidationError
+from sqlalchemy import text
+
+
+def document_paths(catalog, number: int) -> list:
+    """
+    The listings answered with the documents of listing_documents when LISTING_DOCUMENTS_ENABLED is set, but
+    the random products: they are drawn from the whole table on every request.
+    """
+    keyword, category_id = catalog.keyword, catalog.category_id
+    return [
+        f"/productfilter/getbyname/{keyword}/{number}/0",
+        f"/productfilter/getproducts/{number}/0",
+        f"/productfilter/getbycategory/{category_id}/{number}/0",
+        f"/productfilter/getbycategory_keyword/{category_id}/{keyword}/{number}/0",
+        f"/productfilter/filterbyprice/0/1000/{number}/{keyword}/0",
+        f"/landingpage/gettopratedproducts/{number}",
+    ]
+
+
+def listing_bodies(client, catalog, monkeypatch, listing_documents: bool, number: int) -> list:
+    from server.routers import filter_products_router, landing_page_router
+
+    monkeypatch.setattr(filter_products_router, "LISTING_DOCUMENTS_ENABLED", listing_documents)
+    monkeypatch.setattr(landing_page_router, "LISTING_DOCUMENTS_ENABLED", listing_documents)
+    bodies = []
+    for path in document_paths(catalog, number):
+        response = client.get(path, headers=catalog.headers)
+        assert response.status_code == 200, f"{path}: {response.status_code} {response.text[:200]}"
+        bodies.append(response.content)
+    return bodies
+
+
+@pytest.fixture
+def edge_products(catalog, engine):
+    """Products of the catalog with the values whose JSON is easy to get wrong."""
+    with engine.connect() as connection:
+        encoding = connection.execute(text("SHOW server_encoding")).scalar()
+    if encoding != "UTF8":
+        pytest.skip(f"The database stores {encoding} text, not the unicode of the products")
+    plain, text_product, without_images, rated = catalog.add_products(4)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "UPDATE products SET description = :description, price = 12.345, product_color = :color "
+                "WHERE id = :id"
+            ),
+            {"id": text_product, "description": 'a "quoted" \\ back\\slash\nnew line\ttab é ü 😀  ', "color": "</script>"},
+        )
+        connection.execute(text("UPDATE products SET price = 1e20 WHERE id = :id"), {"id": plain})
+        connection.execute(text("DELETE FROM product_images WHERE product_id = :id"), {"id": without_images})
+        connection.execute(text("UPDATE products SET current_discount_percent = 12.5 WHERE id = :id"), {"id": rated})
+        connection.execute(
+            text("UPDATE product_review_stats SET num_reviews = 3, rating_sum = 10, avg_rating = 10 / 3.0 WHERE product_id = :id"),
+            {"id": rated},
+        )
+    return catalog
+
+
+def test_listing_documents_are_the_orm_responses(client, edge_products, monkeypatch):
+    catalog = edge_products
+    orm = listing_bodies(client, catalog, monkeypatch, False, 1000)
+    documents = listing_bodies(client, catalog, monkeypatch, True, 1000)
+
+    paths = document_paths(catalog, 1000)
+    assert dict(zip(paths, documents)) == dict(zip(paths, orm))
+
+
+@pytest.mark.parametrize(
+    "null_field",
+    [
+        "UPDATE products SET description = NULL WHERE id = :id",
+        "UPDATE products SET product_color = NULL WHERE id = :id",
+        "UPDATE product_images SET image_path = NULL WHERE product_id = :id",
+    ],
+    ids=["description", "product_color", "image_path"],
+)
+@pytest.mark.parametrize("listing_documents", [False, True], ids=["orm", "listing_documents"])
+def test_product_with_a_null_required_field_is_refused(client, catalog, engine, monkeypatch, null_field, listing_documents):
+    from server.routers import filter_products_router
+
+    monkeypatch.setattr(filter_products_router, "LISTING_DOCUMENTS_ENABLED", listing_documents)
+    _, product_id = catalog.add_products(2)
+    with engine.begin() as connection:
+        connection.execute(text(null_field), {"id": product_id})
+
+    with pytest.raises(ResponseValidationError):
+        client.get(f"/productfilter/getbycategory/{catalog.category_id}/10/0")
@@ -0,0 +1,20 @@
+from sqlalchemy import text
+
+
+def test_hot_lookups_use_their_index(engine, catalog):
+    # Imported here, the models need the DB setting
+    from server.db.query_plans import check_query_plans
+
+    # Without rows in the tables every plan costs the same and the planner may pick any index
+    catalog.add_products(100)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    with engine.connect() as connection:
+        results = check_query_plans(connection)
+
+    missing = [
+        f"{lookup}: {index} not used, plan reads {', '.join(sorted(used)) or 'no index'}"
+        for lookup, index, used, ok in results
+        if not ok
+    ]
+    assert not missing, "Lookups without their index (a migration was not applied?):\n" + "\n".join(missing)
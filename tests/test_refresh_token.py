@@ -0,0 +1,45 @@
+import uuid
+
+import pytest
+from jose import jwt
+from sqlalchemy import text
+
+
+@pytest.fixture
+def user_id(engine):
+    """A user with the role "user", deleted after the test."""
+    name = f"refresh-{uuid.uuid4().hex[:12]}"
+    with engine.begin() as connection:
+        user_id = connection.execute(
+            text("INSERT INTO users (username, email, password, role) VALUES (:name, :email, 'x', 'user') RETURNING id"),
+            {"name": name, "email": f"{name}@example.com"},
+        ).scalar()
+    yield user_id
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+
+
+def refresh(client, user_id: int, role: str, token_version: int):
+    from server.utils import oauth2
+
+    token = oauth2.create_refresh_token(data={"user_id": user_id, "role": role, "ver": token_version})
+    return client.post("/refresh-token", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_role_change_revokes_the_tokens(client, engine, user_id):
+    from server.utils import oauth2
+
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE users SET role = 'admin' WHERE id = :id"), {"id": user_id})
+        # Writing the same role does not revoke anything
+        connection.execute(text("UPDATE users SET role = 'admin' WHERE id = :id"), {"id": user_id})
+        token_version = connection.execute(text("SELECT token_version FROM users WHERE id = :id"), {"id": user_id}).scalar()
+    assert token_version == 1
+
+    assert refresh(client, user_id, "user", 0).status_code == 401
+
+    response = refresh(client, user_id, "user", 1)
+    assert response.status_code == 200
+    # The role of the new access token is the one of the user, not the one of the refresh token
+    payload = jwt.decode(response.json()["access_token"], oauth2.SECRET_KEY, algorithms=[oauth2.ALGORITHM])
+    assert (payload["role"], payload["ver"]) == ("admin", 1)
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import event
+
+# Statements a listing may run, whatever the number of products it returns
+MAX_STATEMENTS = 4
+# Products of the first pages, the second pages show twice as many
+PAGE_SIZE = 5
+
+
+def listing_paths(catalog, number: int) -> list:
+    """The listing endpoints, with pages of number products filled with the products of the catalog where they filter."""
+    keyword, category_id = catalog.keyword, catalog.category_id
+    return [
+        f"/productfilter/getbyname/{keyword}/{number}/0",
+        f"/productfilter/getproducts/{number}/0",
+        f"/productfilter/getbycategory/{category_id}/{number}/0",
+        f"/productfilter/getbycategory_keyword/{category_id}/{keyword}/{number}/0",
+        f"/productfilter/searchbyproductsize/{keyword}/{number}/0",
+        f"/productfilter/filterbyprice/0/1000/{number}/{keyword}/0",
+        f"/productfilter/getfeaturedproducts/{number}/0",
+        f"/productfilter/dealoftheday/{number}",
+        f"/productfilter/newarrivals/{number}",
+        f"/productfilter/getbyname/{keyword}?limit={number}",
+        f"/productfilter/facetedsearch?category_id={category_id}&limit={number}",
+        f"/productfilter/getproducts?limit={number}",
+        f"/productfilter/getbycategory/{category_id}?limit={number}",
+        f"/productfilter/getbycategory_keyword/{category_id}/{keyword}?limit={number}",
+        f"/productfilter/searchbyproductsize/{keyword}?limit={number}",
+        f"/productfilter/filterbyprice/0/1000/{keyword}?limit={number}",
+        f"/productfilter/getfeaturedproducts?limit={number}",
+        f"/landingpage/getrandomproducts/{number}",
+        f"/landingpage/gettrendingproducts/{number}",
+        f"/landingpage/gettopratedproducts/{number}",
+        f"/landingpage/gettopratedproducts?limit={number}",
+        "/favorites/get-all",
+        "/cart/allproducts",
+    ]
+
+
+@pytest.fixture
+def statement_counter(engine):
+    """Counts the statements both engines send to the database."""
+    from server.db.db import async_engine
+
+    counter = {"statements": 0}
+
+    def count(*args):
+        counter["statements"] += 1
+
+    engines = (engine, async_engine.sync_engine)
+    for listened in engines:
+        event.listen(listened, "before_cursor_execute", count)
+    yield counter
+    for listened in engines:
+        event.remove(listened, "before_cursor_execute", count)
+
+
+def statement_counts(client, catalog, counter, number: int) -> list:
+    """The statements of every listing endpoint, with pages of number products."""
+    counts = []
+    for path in listing_paths(catalog, number):
+        # The user record is cached by the first request of the user
+        client.get(path, headers=catalog.headers)
+        counter["statements"] = 0
+        response = client.get(path, headers=catalog.headers)
+        assert response.status_code == 200, f"{path}: {response.status_code} {response.text[:200]}"
+        counts.append(counter["statements"])
+    return counts
+
+
+@pytest.mark.parametrize("listing_documents", [False, True], ids=["orm", "listing_documents"])
+def test_listing_statement_count_does_not_grow_with_the_page(client, catalog, statement_counter, monkeypatch, listing_documents):
+    from server.routers import filter_products_router, landing_page_router
+
+    monkeypatch.setattr(filter_products_router, "LISTING_DOCUMENTS_ENABLED", listing_documents)
+    monkeypatch.setattr(landing_page_router, "LISTING_DOCUMENTS_ENABLED", listing_documents)
+
+    catalog.add_products(PAGE_SIZE)
+    small = statement_counts(client, catalog, statement_counter, PAGE_SIZE)
+    catalog.add_products(PAGE_SIZE)
+    large = statement_counts(client, catalog, statement_counter, 2 * PAGE_SIZE)
+
+    paths = listing_paths(catalog, PAGE_SIZE)
+    assert dict(zip(paths, large)) == dict(zip(paths, small))
+    assert {path: count for path, count in zip(paths, small) if count > MAX_STATEMENTS} == {}